@@ -0,0 +1,157 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+import config
+
+# Per register aggregation settings: window length in seconds and the percentiles to compute, if any
+AggregationPolicy = namedtuple('AggregationPolicy', 'window percentiles')
+
+def parse_aggregation_policy(active_register):
+    """ Reads the aggregation settings of an activeRegisters entry.
+        Returns None when no window is set, in which case every sample is reported as is
+    """
+    window = active_register.get(config.ACTIVE_REGISTERS_KEY_AGGREGATION_WINDOW)
+    if window == None:
+        return None
+    if window <= 0:
+        raise ValueError('{0} must be positive, got {1}'.format(config.ACTIVE_REGISTERS_KEY_AGGREGATION_WINDOW, window))
+    percentiles = active_register.get(config.ACTIVE_REGISTERS_KEY_AGGREGATION_PERCENTILES) or []
+    for percentile in percentiles:
+        if not 0 <= percentile <= 100:
+            raise ValueError('Percentile must be between 0 and 100, got {0}'.format(percentile))
+    return AggregationPolicy(window, tuple(percentiles))
+
+class WindowBuffer(object):
+    """ Fixed memory accumulator of one aggregation window. Count, min, max, sum and last cover every sample,
+        percentiles are computed from a ring of the most recent max_samples samples
+    """
+    __slots__ = ['ring', 'size', 'index', 'count', 'min', 'max', 'sum', 'last']
+
+    def __init__(self, max_samples, keep_samples):
+        self.ring = array('d', [0.0]) * max_samples if keep_samples else None
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self.index = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.last = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.last = value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+        if self.ring != None:
+            self.ring[self.index] = value
+            self.index = (self.index + 1) % len(self.ring)
+            self.size = min(self.size + 1, len(self.ring))
+
+    def percentile(self, sorted_samples, percentile):
+        """ Nearest-rank percentile of the sorted samples
+        """
+        rank = int(math.ceil(percentile / 100.0 * len(sorted_samples)))
+        return sorted_samples[max(rank - 1, 0)]
+
+    def summary(self, name, percentiles):
+        """ Returns the (field name, value) pairs of the window
+        """
+        fields = [
+            ('{0}_min'.format(name), self.min),
+            ('{0}_max'.format(name), self.max),
+            ('{0}_mean'.format(name), self.sum / self.count),
+            ('{0}_last'.format(name), self.last),
+            ('{0}_count'.format(name), self.count)]
+        if percentiles and self.size:
+            samples = sorted(self.ring[:self.size])
+            for percentile in percentiles:
+                fields.append(('{0}_p{1:g}'.format(name, percentile), self.percentile(samples, percentile)))
+        return fields
+
+class Aggregator(object):
+    """ Collects samples of registers with an aggregation window and emits their min/max/mean/last/count
+        (and percentiles) once per window, so registers can be polled much faster than they are uploaded.
+        Windows are aligned to multiples of their length since the epoch
+    """
+
+    def __init__(self, policies, max_samples=None):
+        self.max_samples = config.AGGREGATION_MAX_SAMPLES if max_samples == None else max_samples
+        self.policies = {}
+        # register name -> (window buffer, end time of the current window)
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.update_policies(policies)
+
+    def add(self, values, now=None):
+        """ Splits the name to value dict in samples to aggregate and values to report as is.
+            Returns (values to report as is, list of (field name, value) of the windows that ended)
+        """
+        now = time.time() if now == None else now
+        passthrough = {}
+        with self._lock:
+            emitted = self._collect(now)
+            for name, value in values.items():
+                window = self._windows.get(name)
+                if window == None:
+                    passthrough[name] = value
+                    continue
+                buffer, end = window
+                if end == None:
+                    self._windows[name] = (buffer, self._window_end(name, now))
+                buffer.add(value)
+        return passthrough, emitted
+
+    def collect(self, now=None):
+        """ Returns the (field name, value) pairs of the windows that ended, and starts their next window
+        """
+        now = time.time() if now == None else now
+        with self._lock:
+            return self._collect(now)
+
+    def next_window_end(self):
+        """ Returns the earliest end of a window holding samples, None if there is none
+        """
+        with self._lock:
+            ends = [end for _, end in self._windows.values() if end != None]
+        return min(ends) if ends else None
+
+    def update_policies(self, policies):
+        """ Replaces the policies, keeping the window of registers whose policy did not change
+        """
+        policies = dict((name, policy) for name, policy in policies.items() if policy != None)
+        with self._lock:
+            for name, policy in policies.items():
+                if self.policies.get(name) != policy:
+                    self._windows[name] = (WindowBuffer(self.max_samples, bool(policy.percentiles)), None)
+            for name in list(self._windows.keys()):
+                if name not in policies:
+                    del self._windows[name]
+            self.policies = policies
+
+    def _window_end(self, name, now):
+        window = self.policies[name].window
+        return (math.floor(now / window) + 1) * window
+
+    def _collect(self, now):
+        emitted = []
+        for name in sorted(self._windows.keys()):
+            buffer, end = self._windows[name]
+            if end == None or end > now:
+                continue
+            if buffer.count:
+                emitted.extend(buffer.summary(name, self.policies[name].percentiles))
+            buffer.clear()
+            self._windows[name] = (buffer, None)
+        return emitted
@@ -0,0 +1,108 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import threading
+import time
+
+
+class _CallbackInfo(object):
+    """ Mirrors the callback info objects passed by iotc
+    """
+
+    def __init__(self, tag=None, payload=None, status_code=0):
+        self._tag = tag
+        self._payload = payload
+        self._status_code = status_code
+        self.response = (200, '{}')
+
+    def setResponse(self, response_code, response_message):
+        self.response = (response_code, response_message)
+
+    def getTag(self):
+        return self._tag
+
+    def getPayload(self):
+        return self._payload
+
+    def getStatusCode(self):
+        return self._status_code
+
+class CloudStub(object):
+    """ Local stand-in for iotc.Device. Connects instantly, records every telemetry message and can 
+        push desired properties, so the gateway can be driven end to end without IoT Central
+    """
+
+    lock = threading.Lock()
+    devices = {}
+    messages = []
+    # message properties of every telemetry message, in the order of messages
+    message_properties = []
+    properties = []
+    # seconds a connection takes, as provisioning and the MQTT handshake would
+    connect_latency = 0
+
+    def __init__(self, scope_id, key, device_id, connect_type):
+        self.device_id = device_id
+        self.callbacks = {}
+        self.connected = False
+        with CloudStub.lock:
+            CloudStub.devices[device_id] = self
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.devices = {}
+            cls.messages = []
+            cls.message_properties = []
+            cls.properties = []
+
+    def setLogLevel(self, log_level):
+        pass
+
+    def setModelData(self, model_data):
+        pass
+
+    def on(self, event, callback):
+        self.callbacks[event] = callback
+
+    def connect(self):
+        if CloudStub.connect_latency:
+            time.sleep(CloudStub.connect_latency)
+        self.connected = True
+        self._fire('ConnectionStatus', _CallbackInfo())
+
+    def disconnect(self):
+        self.connected = False
+
+    def isConnected(self):
+        return self.connected
+
+    def doNext(self, idle_time=None):
+        pass
+
+    def sendTelemetry(self, payload, properties=None):
+        with CloudStub.lock:
+            CloudStub.messages.append((time.time(), self.device_id, payload))
+            CloudStub.message_properties.append(properties)
+
+    def sendProperty(self, payload):
+        with CloudStub.lock:
+            CloudStub.properties.append((time.time(), self.device_id, payload))
+
+    def push_setting(self, key, value):
+        """ Delivers a desired property update as IoT Central would
+        """
+        self._fire('SettingsUpdated', _CallbackInfo(key, json.dumps({'value': value, '$version': 1})))
+
+    def invoke_command(self, name, payload=''):
+        """ Invokes a command as IoT Central would, returns its (status code, response payload)
+        """
+        info = _CallbackInfo(name, payload)
+        self._fire('Command', info)
+        return info.response
+
+    def _fire(self, event, info):
+        callback = self.callbacks.get(event)
+        if callback != None:
+            callback(info)
@@ -0,0 +1,86 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+""" Micro benchmark of telemetry encoding: the former string formatting path, json.dumps and the members
+    encoding sent by the slaves, without and with batching and compression.
+
+    python -m benchmarks.encoder --registers 10,100 --snapshots 10000 --batch 10
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from telemetry_encoder import TelemetryBatcher, encode_members
+
+def _format_join(register_names, values):
+    # the encoding of SlaveDevice.report_registers before encode_members
+    payload_components = ['"{0}":{1}'.format(name, values[name]) for name in register_names if name in values]
+    return ['{{{0}}}'.format(",".join(payload_components))]
+
+def _json_dumps(register_names, values):
+    return [json.dumps(dict((name, values[name]) for name in register_names if name in values))]
+
+def _encoders(register_names, batch):
+    single = TelemetryBatcher(0, compress=False)
+    batched = TelemetryBatcher(3600, compress=False)
+    compressed = TelemetryBatcher(3600, compress=True)
+    counter = [0]
+
+    def encode_batched(batcher):
+        def encode(register_names, values):
+            messages = batcher.add(encode_members(values))
+            counter[0] += 1
+            if counter[0] % batch == 0:
+                messages.extend(batcher.flush(force=True))
+            return messages
+        return encode
+
+    return [
+        ('format_join', _format_join),
+        ('json_dumps', _json_dumps),
+        ('members', lambda register_names, values: single.add(encode_members(values))),
+        ('members_batch{}'.format(batch), encode_batched(batched)),
+        ('members_batch{}_gzip'.format(batch), encode_batched(compressed))]
+
+def run_once(register_count, snapshot_count, batch):
+    """ Encodes snapshot_count snapshots of register_count registers with every encoder and returns a result row each
+    """
+    register_names = ['register{}'.format(i) for i in range(register_count)]
+    snapshots = [dict((name, random.randint(0, 65535)) for name in register_names) for _ in range(64)]
+    results = []
+    for label, encode in _encoders(register_names, batch):
+        messages = []
+        def run():
+            for i in range(snapshot_count):
+                messages.extend(encode(register_names, snapshots[i % len(snapshots)]))
+        seconds = timeit.timeit(run, number=1)
+        results.append({
+            'registers': register_count,
+            'encoder': label,
+            'us_per_snapshot': seconds / snapshot_count * 1e6,
+            'messages': len(messages),
+            'bytes_per_snapshot': sum(len(message) for message in messages) / float(snapshot_count)
+        })
+    return results
+
+COLUMNS = ['registers', 'encoder', 'us_per_snapshot', 'messages', 'bytes_per_snapshot']
+
+def _format_row(result):
+    return '\t'.join('{0:.1f}'.format(result[c]) if isinstance(result[c], float) else str(result[c]) for c in COLUMNS)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registers', default='10,100', help='comma separated register counts per slave')
+    parser.add_argument('--snapshots', type=int, default=10000, help='snapshots encoded per run')
+    parser.add_argument('--batch', type=int, default=10, help='snapshots per batched message')
+    args = parser.parse_args()
+
+    print('\t'.join(COLUMNS))
+    for register_count in [int(r) for r in args.registers.split(',')]:
+        for result in run_once(register_count, args.snapshots, args.batch):
+            print(_format_row(result))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+""" End to end throughput benchmark of the gateway against a local slave farm and IoT Central stand-in.
+
+    python -m benchmarks.run --transport rtu --slaves 1,10,50 --registers 10,100 --duration 30
+
+    With --idle, no poll of the slaves is due during the run, which measures the CPU the gateway uses while waiting.
+
+    With --replay, the slaves of a recorded Modbus trace answer instead of the slave farm.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+import iotc
+
+import config
+from benchmarks.cloud_stub import CloudStub
+from benchmarks.slave_farm import FaultInjection, SlaveFarm
+from bus_trace import read_trace
+from slave_health import HEALTH_HEALTHY
+
+# updateInterval of --idle runs, in seconds
+IDLE_INTERVAL = 10 ** 7
+# registers of every slave that --settings writes to
+SETTING_REGISTERS = 5
+# seconds left after a --settings run for the last writes to be acknowledged
+SETTINGS_GRACE = 2
+# maxAge of the --read-now commands served from the cache, in seconds
+CACHED_MAX_AGE = 3600
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def _registers(register_count, prefix='register'):
+    return [{
+        config.ACTIVE_REGISTERS_KEY_REGISTER_NAME: '{0}{1}'.format(prefix, i),
+        config.ACTIVE_REGISTERS_KEY_ADDRESS: i,
+        config.ACTIVE_REGISTERS_KEY_TYPE: config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER
+    } for i in range(register_count)]
+
+def _register_name(slave, register, profile_count=1):
+    if profile_count <= 1:
+        return 'register{}'.format(register)
+    return 'model{0}_register{1}'.format(slave % profile_count, register)
+
+def _push_settings(rate, slave_count, register_count, profile_count, stop, updates):
+    """ Pushes rate setting updates per second to the first registers of the slaves in turn, as dashboard 
+        sliders would, until stop is set. Appends the (time, device id, register name, value) of every update to updates
+    """
+    i = 0
+    while not stop.wait(1.0 / rate):
+        slave = i % slave_count
+        name = _register_name(slave, (i // slave_count) % register_count, profile_count)
+        device = CloudStub.devices.get('benchslave{}'.format(slave))
+        if device != None:
+            value = i & 0xffff
+            updates.append((time.time(), device.device_id, name, value))
+            device.push_setting(name, value)
+        i += 1
+
+def _setting_acks(updates, properties):
+    """ Returns the seconds from the push of every setting update to its acknowledgement, and the number of 
+        updates acknowledged with a status code other than 200
+    """
+    pushes = dict(((device_id, name, value), sent) for sent, device_id, name, value in updates)
+    latencies = []
+    failed = 0
+    for acknowledged, device_id, payload in properties:
+        for name, reported in json.loads(payload).items():
+            sent = pushes.get((device_id, name, reported.get('value')))
+            if sent == None:
+                continue
+            if reported.get('statusCode') == 200:
+                latencies.append(acknowledged - sent)
+            else:
+                failed += 1
+    return latencies, failed
+
+def _invoke_reads(rate, slave_count, profile_count, stop, reads):
+    """ Invokes rate readNow commands per second for the first register of the slaves in turn until stop is set, 
+        every other one with maxAge 0 so that it is read from the bus. Appends the (source, seconds, status code) 
+        of every command to reads
+    """
+    i = 0
+    while not stop.wait(1.0 / rate):
+        slave = i % slave_count
+        device = CloudStub.devices.get('benchslave{}'.format(slave))
+        if device != None:
+            source = 'bus' if (i // slave_count) % 2 == 0 else 'cache'
+            payload = json.dumps({config.COMMAND_KEY_REGISTERS: [_register_name(slave, 0, profile_count)], 
+                config.COMMAND_KEY_MAX_AGE: 0 if source == 'bus' else CACHED_MAX_AGE})
+            started = time.time()
+            status_code, _ = device.invoke_command(config.COMMAND_READ_NOW, payload)
+            reads.append((source, time.time() - started, status_code))
+        i += 1
+
+def _slaves_config(slave_ids, register_count, update_interval, profile_count=1):
+    """ Slaves config of the benchmark. With more than one profile the slaves are spread over profile_count 
+        register map profiles, each with its own register names
+    """
+    slaves = [{config.CONFIG_KEY_DEVICE_ID: 'benchslave{}'.format(i), config.CONFIG_KEY_SLAVE_ID: slave_id} 
+        for i, slave_id in enumerate(slave_ids)]
+    slaves_config = {
+        config.CONFIG_KEY_MODEL_ID: 'benchmark',
+        config.CONFIG_KEY_UPDATE_INTERVAL: update_interval,
+        config.CONFIG_KEY_SLAVES: slaves
+    }
+    if profile_count <= 1:
+        slaves_config[config.CONFIG_KEY_ACTIVE_REGISTERS] = _registers(register_count)
+        return slaves_config
+    slaves_config[config.CONFIG_KEY_PROFILES] = dict(('model{}'.format(j), 
+        {config.CONFIG_KEY_ACTIVE_REGISTERS: _registers(register_count, 'model{}_register'.format(j))}) 
+        for j in range(profile_count))
+    for i, slave in enumerate(slaves):
+        slave[config.CONFIG_KEY_PROFILE] = 'model{}'.format(i % profile_count)
+    return slaves_config
+
+def run_once(args, slave_count, register_count, logger):
+    """ Runs the gateway against slave_count simulated slaves for args.duration seconds and returns the results
+    """
+    from devices.master_device import MasterDevice
+    from devices.slave_device import SlaveDevice
+
+    if args.replay != None:
+        farm = None
+        slave_ids = read_trace(args.replay).slaves[:slave_count]
+        config.MODBUS_MODE = 3
+        config.MODBUS_REPLAY_PATH = args.replay
+        config.MODBUS_REPLAY_SPEED = args.replay_speed
+    else:
+        faults = FaultInjection(args.latency, args.error_rate, args.timeout_rate, args.timeout * 2)
+        farm = SlaveFarm(args.transport, slave_count, faults, args.baudrate, args.tcp_port)
+        farm.start()
+        slave_ids = farm.slave_ids + farm.unanswered_slave_ids(args.dead_slaves)
+        config.MODBUS_MODE = 2 if args.transport == 'tcp' else 1
+        config.SERIAL_PORT = farm.serial_port
+    config.MODBUS_TRACE_PATH = args.record
+    config.MODBUS_TCP_PORT = args.tcp_port
+    config.BAUD_RATE = args.baudrate
+    config.MODBUS_CLIENT_TIMEOUT = args.timeout
+    config.DEVICE_LOOP_MODE = args.loop_mode
+    config.TELEMETRY_BATCH_INTERVAL = args.batch_interval
+    config.TELEMETRY_COMPRESSION = args.compress
+    config.PROVISIONING_CACHE_PATH = None
+    config.TELEMETRY_BUFFER_PATH = None
+    CloudStub.reset()
+    CloudStub.connect_latency = args.connect_latency
+    config.CONNECT_WORKERS = args.connect_workers
+
+    interval = args.interval
+    warmup = args.warmup
+    if args.idle:
+        # first deadlines are spread over the interval, so hardly any of them falls within the run
+        interval = IDLE_INTERVAL
+        # leave time for the slaves to connect
+        warmup = max(warmup, 5)
+
+    # time every poll cycle of every slave
+    cycle_times = []
+    read_register_values = SlaveDevice.read_register_values
+    def timed_read_register_values(self, register_names, plan=None, *args, **kwargs):
+        started = time.time()
+        values = read_register_values(self, register_names, plan, *args, **kwargs)
+        cycle_times.append(time.time() - started)
+        return values
+    SlaveDevice.read_register_values = timed_read_register_values
+
+    master = MasterDevice('benchmark', 'YmVuY2htYXJr', 'benchmark', 'benchmaster', logger)
+    try:
+        master.start()
+        pushed = time.time()
+        CloudStub.devices['benchmaster'].push_setting(config.KEY_CONFIG, 
+            json.dumps(_slaves_config(slave_ids, register_count, interval, args.profiles)))
+        time.sleep(warmup)
+
+        cpu_start = sum(os.times()[:2])
+        cycles_start = len(cycle_times)
+        messages_start = len(CloudStub.messages)
+        requests_start = _request_counts(farm, master)
+        properties_start = len(CloudStub.properties)
+        writes_start = farm.write_count() if farm != None else 0
+        updates = []
+        stop_settings = threading.Event()
+        if args.settings:
+            settings_thread = threading.Thread(target=_push_settings, args=(args.settings, slave_count, 
+                min(SETTING_REGISTERS, register_count), args.profiles, stop_settings, updates))
+            settings_thread.daemon = True
+            settings_thread.start()
+        reads = []
+        stop_reads = threading.Event()
+        if args.read_now:
+            reads_thread = threading.Thread(target=_invoke_reads, args=(args.read_now, slave_count, args.profiles, 
+                stop_reads, reads))
+            reads_thread.daemon = True
+            reads_thread.start()
+        started = time.time()
+        time.sleep(args.duration)
+        elapsed = time.time() - started
+        cpu = sum(os.times()[:2]) - cpu_start
+        cycles = cycle_times[cycles_start:]
+        messages = len(CloudStub.messages) - messages_start
+        requests, errors, timeouts = [end - start for start, end in zip(requests_start, _request_counts(farm, master))]
+        # seconds from the config push to the first telemetry message of every slave that sent one
+        first_messages = {}
+        for sent, device_id, _ in CloudStub.messages:
+            first_messages.setdefault(device_id, sent - pushed)
+        first_telemetry = list(first_messages.values())
+        # seconds between two telemetry messages of the same answering slave
+        live_ids = set('benchslave{}'.format(i) for i in range(slave_count))
+        last_messages = {}
+        live_intervals = []
+        for sent, device_id, _ in CloudStub.messages[messages_start:]:
+            if device_id in live_ids:
+                if device_id in last_messages:
+                    live_intervals.append(sent - last_messages[device_id])
+                last_messages[device_id] = sent
+        if args.read_now:
+            stop_reads.set()
+            reads_thread.join()
+        read_times = dict((source, [seconds for s, seconds, status_code in reads if s == source and status_code == 200]) 
+            for source in ['bus', 'cache'])
+        if args.settings:
+            stop_settings.set()
+            settings_thread.join()
+            time.sleep(SETTINGS_GRACE)
+        setting_latencies, settings_failed = _setting_acks(updates, CloudStub.properties[properties_start:])
+        bus_writes = farm.write_count() - writes_start if farm != None else 0
+        quarantined = len([slave_id for slave_id in slave_ids[slave_count:] 
+            if master.modbus_client.health_state(slave_id) != HEALTH_HEALTHY])
+    finally:
+        master.stop()
+        if farm != None:
+            farm.stop()
+        SlaveDevice.read_register_values = read_register_values
+
+    return {
+        'slaves': slave_count,
+        'registers': register_count,
+        'polls_per_sec': len(cycles) / elapsed,
+        'requests_per_sec': requests / elapsed,
+        'messages_per_sec': messages / elapsed,
+        'p50_ms': _percentile(cycles, 50) * 1000,
+        'p95_ms': _percentile(cycles, 95) * 1000,
+        'p99_ms': _percentile(cycles, 99) * 1000,
+        'cpu_percent': 100.0 * cpu / elapsed,
+        # ru_maxrss is in KB on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'errors': errors,
+        'timeouts': timeouts,
+        'first_telemetry_p50_s': _percentile(first_telemetry, 50),
+        'first_telemetry_max_s': max(first_telemetry) if first_telemetry else 0.0,
+        'slaves_reporting': len(first_telemetry),
+        'live_interval_p50_s': _percentile(live_intervals, 50),
+        'live_interval_max_s': max(live_intervals) if live_intervals else 0.0,
+        'quarantined': quarantined,
+        'settings_pushed': len(updates),
+        'settings_acked': len(setting_latencies),
+        'settings_failed': settings_failed,
+        'ack_p50_ms': _percentile(setting_latencies, 50) * 1000,
+        'ack_max_ms': max(setting_latencies) * 1000 if setting_latencies else 0.0,
+        'bus_writes': bus_writes,
+        'reads': len(reads),
+        'read_cache_p50_ms': _percentile(read_times['cache'], 50) * 1000,
+        'read_bus_p50_ms': _percentile(read_times['bus'], 50) * 1000,
+        'read_bus_max_ms': max(read_times['bus']) * 1000 if read_times['bus'] else 0.0,
+        'reads_failed': len([status_code for _, _, status_code in reads if status_code != 200])
+    }
+
+def _request_counts(farm, master):
+    """ Requests, errors and timeouts answered so far by the slave farm, or by the replayed trace
+        whose errors are not told apart
+    """
+    if farm != None:
+        return farm.request_counts()
+    return master.modbus_client.requests, master.modbus_client.errors, 0
+
+COLUMNS = ['slaves', 'registers', 'polls_per_sec', 'requests_per_sec', 'messages_per_sec', 'p50_ms', 'p95_ms', 
+    'p99_ms', 'cpu_percent', 'max_rss_mb', 'errors', 'timeouts', 'first_telemetry_p50_s', 'first_telemetry_max_s', 'slaves_reporting']
+
+# columns of runs with --dead-slaves, the interval columns only cover the slaves that answer
+DEAD_SLAVE_COLUMNS = ['live_interval_p50_s', 'live_interval_max_s', 'quarantined']
+
+# columns of runs with --settings, updates superseded within WRITE_DEBOUNCE are neither written nor acknowledged
+SETTINGS_COLUMNS = ['settings_pushed', 'settings_acked', 'settings_failed', 'ack_p50_ms', 'ack_max_ms', 'bus_writes']
+
+# columns of runs with --read-now, the read times are those of the commands answered with 200
+READ_NOW_COLUMNS = ['reads', 'read_cache_p50_ms', 'read_bus_p50_ms', 'read_bus_max_ms', 'reads_failed']
+
+def _columns(args):
+    return (COLUMNS + (DEAD_SLAVE_COLUMNS if args.dead_slaves else []) + (SETTINGS_COLUMNS if args.settings else []) + 
+        (READ_NOW_COLUMNS if args.read_now else []))
+
+def _format_row(result, columns):
+    return '\t'.join('{0:.1f}'.format(result[c]) if isinstance(result[c], float) else str(result[c]) for c in columns)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=['tcp', 'rtu'], default='rtu')
+    parser.add_argument('--slaves', default='1,10,50', help='comma separated slave counts')
+    parser.add_argument('--registers', default='10,50', help='comma separated register counts per slave')
+    parser.add_argument('--duration', type=float, default=20, help='seconds measured per run')
+    parser.add_argument('--interval', type=float, default=1, help='updateInterval pushed to the slaves')
+    parser.add_argument('--warmup', type=float, default=0, help='seconds between the config push and the measurement')
+    parser.add_argument('--idle', action='store_true', 
+        help='measure while no poll is due, at least 5s after the config push')
+    parser.add_argument('--profiles', type=int, default=1, help='number of register map profiles the slaves are spread over')
+    parser.add_argument('--loop-mode', type=int, default=config.DEVICE_LOOP_MODE, help='DEVICE_LOOP_MODE')
+    parser.add_argument('--batch-interval', type=float, default=config.TELEMETRY_BATCH_INTERVAL, 
+        help='TELEMETRY_BATCH_INTERVAL')
+    parser.add_argument('--compress', action='store_true', help='TELEMETRY_COMPRESSION')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--tcp-port', type=int, default=5020)
+    parser.add_argument('--timeout', type=float, default=0.5, help='Modbus client timeout in seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.0, 
+        help='seconds every IoT Central connection takes, as provisioning would')
+    parser.add_argument('--connect-workers', type=int, default=config.CONNECT_WORKERS, 
+        help='CONNECT_WORKERS, 1 connects the slaves one after another')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every slave response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with an exception')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction of requests left unanswered')
+    parser.add_argument('--dead-slaves', type=int, default=0, 
+        help='slaves added to the config that never answer, to check they are quarantined')
+    parser.add_argument('--settings', type=float, default=0, 
+        help='setting updates pushed per second during the run, to the first 5 registers of the slaves in turn')
+    parser.add_argument('--read-now', type=float, default=0, 
+        help='readNow commands invoked per second during the run, every other one read from the bus')
+    parser.add_argument('--record', help='file recording the Modbus traffic of the last run, MODBUS_TRACE_PATH')
+    parser.add_argument('--replay', help='Modbus trace answering the requests instead of the slave farm')
+    parser.add_argument('--replay-speed', type=float, default=1.0, 
+        help='speed factor of the replayed response times, 0 answers right away')
+    args = parser.parse_args()
+
+    logger = logging.getLogger()
+    logging.basicConfig(format=config.LOGGING_FORMAT)
+    logger.setLevel(logging.WARNING)
+    # injected failures are expected, keep the slave servers quiet
+    logging.getLogger('pymodbus').setLevel(logging.CRITICAL)
+    iotc.Device = CloudStub
+
+    columns = _columns(args)
+    print('\t'.join(columns))
+    for slave_count in [int(n) for n in args.slaves.split(',')]:
+        for register_count in [int(n) for n in args.registers.split(',')]:
+            print(_format_row(run_once(args, slave_count, register_count, logger), columns))
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import os
+import random
+import select
+import threading
+import time
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from pymodbus.server.sync import ModbusTcpServer, ModbusSerialServer
+from pymodbus.transaction import ModbusRtuFramer
+
+# Number of addresses of each register type served by a simulated slave
+BLOCK_SIZE = 10000
+
+class FaultInjection(object):
+    """ Response latency and failures applied to every request a simulated slave serves
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, timeout_rate=0.0, timeout=2.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+
+class SimulatedSlaveContext(ModbusSlaveContext):
+    """ Slave datastore that counts requests and writes, and injects latency, exception responses and timeouts
+    """
+
+    def __init__(self, faults, register_values=None):
+        register_values = register_values or {}
+        super(SimulatedSlaveContext, self).__init__(
+            di=ModbusSequentialDataBlock(0, register_values.get('di', [0] * BLOCK_SIZE)),
+            co=ModbusSequentialDataBlock(0, register_values.get('co', [0] * BLOCK_SIZE)),
+            hr=ModbusSequentialDataBlock(0, register_values.get('hr', [0] * BLOCK_SIZE)),
+            ir=ModbusSequentialDataBlock(0, register_values.get('ir', [0] * BLOCK_SIZE)))
+        self.faults = faults
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.writes = 0
+
+    def setValues(self, fx, address, values):
+        self.writes += 1
+        super(SimulatedSlaveContext, self).setValues(fx, address, values)
+
+    def getValues(self, fx, address, count=1):
+        self.requests += 1
+        if self.faults.latency:
+            time.sleep(self.faults.latency)
+        roll = random.random()
+        if roll < self.faults.timeout_rate:
+            self.timeouts += 1
+            time.sleep(self.faults.timeout)
+        elif roll < self.faults.timeout_rate + self.faults.error_rate:
+            self.errors += 1
+            # raised errors are answered with a slave failure exception response
+            raise IOError('Injected slave failure')
+        return super(SimulatedSlaveContext, self).getValues(fx, address, count)
+
+class _PtyBridge(object):
+    """ Two pseudo terminals whose master ends are connected, so a serial server and a serial client 
+        can each open one of the slave ends as if they were the two sides of an RS-485 line
+    """
+
+    def __init__(self):
+        self._server_master, server_slave = os.openpty()
+        self._client_master, client_slave = os.openpty()
+        self.server_port = os.ttyname(server_slave)
+        self.client_port = os.ttyname(client_slave)
+        self._fds = [server_slave, client_slave]
+        self._active = True
+        self._thread = threading.Thread(target=self._pump)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._active = False
+        self._thread.join(1)
+        for fd in self._fds + [self._server_master, self._client_master]:
+            os.close(fd)
+
+    def _pump(self):
+        peers = {self._server_master: self._client_master, self._client_master: self._server_master}
+        while self._active:
+            readable, _, _ = select.select(list(peers.keys()), [], [], 0.1)
+            for fd in readable:
+                os.write(peers[fd], os.read(fd, 4096))
+
+class SlaveFarm(object):
+    """ Local Modbus slaves for benchmarks: one TCP server per slave on its own loopback address, 
+        or all slaves on one RTU server behind a pseudo terminal
+    """
+
+    def __init__(self, transport, slave_count, faults=None, baudrate=115200, tcp_port=5020):
+        self.transport = transport
+        self.slave_count = slave_count
+        self.faults = faults or FaultInjection()
+        self.baudrate = baudrate
+        self.tcp_port = tcp_port
+        self.contexts = []
+        self.slave_ids = []
+        self.serial_port = None
+
+        self._servers = []
+        self._threads = []
+        self._bridge = None
+
+    def start(self):
+        if self.transport == 'tcp':
+            for i in range(self.slave_count):
+                context = SimulatedSlaveContext(self.faults)
+                # every 127.0.0.x address is local on Linux, so each slave gets its own host
+                host = '127.0.{0}.{1}'.format(i // 250, i % 250 + 1)
+                server = ModbusTcpServer(ModbusServerContext(slaves=context, single=True), address=(host, self.tcp_port))
+                self._serve(server, context)
+                self.slave_ids.append(host)
+        else:
+            self._bridge = _PtyBridge()
+            slaves = {}
+            for i in range(self.slave_count):
+                context = SimulatedSlaveContext(self.faults)
+                slaves[i + 1] = context
+                self.contexts.append(context)
+                self.slave_ids.append(i + 1)
+            server = ModbusSerialServer(ModbusServerContext(slaves=slaves, single=False), 
+                framer=ModbusRtuFramer, port=self._bridge.server_port, baudrate=self.baudrate, timeout=0.005)
+            self._serve(server, None)
+            self.serial_port = self._bridge.client_port
+
+    def stop(self):
+        for server in self._servers:
+            if hasattr(server, 'shutdown') and self.transport == 'tcp':
+                server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join(1)
+        if self._bridge != None:
+            self._bridge.close()
+
+    def unanswered_slave_ids(self, count):
+        """ Returns count slave ids on the bus of the farm that no slave answers for
+        """
+        if self.transport == 'tcp':
+            return ['127.0.{0}.{1}'.format(i // 250, i % 250 + 1) for i in range(self.slave_count, self.slave_count + count)]
+        return list(range(self.slave_count + 1, self.slave_count + count + 1))
+
+    def request_counts(self):
+        """ Returns the total number of requests, injected errors and injected timeouts served
+        """
+        return (sum(c.requests for c in self.contexts), sum(c.errors for c in self.contexts), 
+            sum(c.timeouts for c in self.contexts))
+
+    def write_count(self):
+        """ Returns the total number of write requests served
+        """
+        return sum(c.writes for c in self.contexts)
+
+    def _serve(self, server, context):
+        if context != None:
+            self.contexts.append(context)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._servers.append(server)
+        self._threads.append(thread)
@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import heapq
+import itertools
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from metrics import REGISTRY
+
+# Transaction priorities, lower values are served first
+PRIORITY_WRITE = 0
+PRIORITY_ON_DEMAND = 1
+PRIORITY_POLL = 2
+
+BusStats = namedtuple('BusStats', 'queue_depth transactions average_wait max_wait busy_time')
+
+_ARBITERS = weakref.WeakSet()
+
+BUS_WAIT_SECONDS = REGISTRY.histogram('modbus_bus_wait_seconds', 'Time transactions waited for the bus', ['bus'])
+BUS_QUEUE_DEPTH = REGISTRY.gauge('modbus_bus_queue_depth', 'Transactions waiting for the bus', ['bus'], 
+    collect=lambda: dict(((arbiter.name,), arbiter.queue_depth()) for arbiter in list(_ARBITERS)))
+BUS_BUSY_SECONDS = REGISTRY.gauge('modbus_bus_busy_seconds', 'Total time the bus spent on transactions', ['bus'], 
+    collect=lambda: dict(((arbiter.name,), arbiter.stats().busy_time) for arbiter in list(_ARBITERS)))
+
+class BusArbiterStoppedException(Exception):
+    def __init__(self):
+        super(BusArbiterStoppedException, self).__init__('Bus arbiter is stopped')
+
+def silent_interval(baudrate):
+    """ Modbus RTU inter-frame delay: 3.5 character times of 11 bits, fixed at 1.75ms above 19200 baud
+    """
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11.0 / baudrate
+
+class _Transaction(object):
+    __slots__ = ['function', 'args', 'queued_at', 'done', 'result', 'error']
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.queued_at = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class BusArbiter(object):
+    """ Owns a shared bus and serialises every transaction on it through a priority queue, 
+        so concurrent slave loops never interleave frames on the line and writes do not queue 
+        behind a full telemetry sweep.
+    """
+
+    logger = None
+
+    _active = False
+
+    def __init__(self, logger, baudrate, name='serial'):
+        self.logger = logger
+        self.name = name
+        self.interval = silent_interval(baudrate)
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._last_frame_end = 0
+
+        self._transactions = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._busy_time = 0.0
+        _ARBITERS.add(self)
+
+    def start(self):
+        """ Starts the thread that owns the bus
+        """
+        self._active = True
+        self._thread = threading.Thread(target=self._work, name='BusArbiter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the bus thread, queued transactions fail with an exception
+        """
+        with self._condition:
+            self._active = False
+            pending = [entry[2] for entry in self._queue]
+            self._queue = []
+            self._condition.notify_all()
+        for transaction in pending:
+            transaction.error = BusArbiterStoppedException()
+            transaction.done.set()
+        if self._thread != None:
+            self._thread.join(1)
+            self._thread = None
+
+    def submit(self, priority, function, *args):
+        """ Queues function(*args) to run on the bus and blocks until it has run. 
+            Returns the result of the function or raises its exception
+        """
+        transaction = _Transaction(function, args)
+        with self._condition:
+            if not self._active:
+                raise BusArbiterStoppedException()
+            heapq.heappush(self._queue, (priority, next(self._counter), transaction))
+            self._condition.notify()
+        transaction.done.wait()
+        if transaction.error != None:
+            raise transaction.error
+        return transaction.result
+
+    def queue_depth(self):
+        """ Number of transactions waiting for the bus
+        """
+        return len(self._queue)
+
+    def stats(self):
+        """ Returns the queue depth and wait times (in seconds) of transactions served so far
+        """
+        with self._condition:
+            average_wait = self._total_wait / self._transactions if self._transactions else 0.0
+            return BusStats(len(self._queue), self._transactions, average_wait, self._max_wait, self._busy_time)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._active and not self._queue:
+                    self._condition.wait()
+                if not self._active:
+                    return
+                transaction = heapq.heappop(self._queue)[2]
+
+            # keep the line silent between frames
+            idle = self._last_frame_end + self.interval - time.time()
+            if idle > 0:
+                time.sleep(idle)
+
+            started = time.time()
+            try:
+                transaction.result = transaction.function(*transaction.args)
+            except Exception as e:
+                transaction.error = e
+            self._last_frame_end = time.time()
+
+            with self._condition:
+                wait = started - transaction.queued_at
+                self._transactions += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                self._busy_time += self._last_frame_end - started
+            BUS_WAIT_SECONDS.observe(wait, (self.name,))
+            transaction.done.set()
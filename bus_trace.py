@@ -0,0 +1,259 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from pymodbus.bit_read_message import ReadCoilsResponse, ReadDiscreteInputsResponse
+from pymodbus.bit_write_message import WriteSingleCoilResponse, WriteMultipleCoilsResponse
+from pymodbus.exceptions import ModbusException, ModbusIOException, ConnectionException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.register_read_message import ReadHoldingRegistersResponse, ReadInputRegistersResponse
+from pymodbus.register_write_message import WriteSingleRegisterResponse, WriteMultipleRegistersResponse
+
+TRACE_MAGIC = 'MBTR'
+TRACE_VERSION = 1
+
+# File header: magic, version, MODBUS_MODE and baud rate of the recording, wall clock time it started
+HEADER = struct.Struct('<4sBBId')
+# Record header: function code, ms from the start of the recording to the request, duration in us, slave index,
+# address, count, status and length of the payload that follows
+RECORD = struct.Struct('<BIIHHHBH')
+
+# Function code of the records naming a slave, their payload is the slave id and their slave field its index
+FUNCTION_SLAVE = 0
+
+# pymodbus client methods by function code
+FUNCTIONS = {
+    1: 'read_coils',
+    2: 'read_discrete_inputs',
+    3: 'read_holding_registers',
+    4: 'read_input_registers',
+    5: 'write_coil',
+    6: 'write_register',
+    15: 'write_coils',
+    16: 'write_registers'
+}
+FUNCTION_CODES = dict((name, function_code) for function_code, name in FUNCTIONS.items())
+READ_FUNCTIONS = [1, 2, 3, 4]
+BIT_FUNCTIONS = [1, 2, 5, 15]
+
+# Outcome of a request: the values of a response, a Modbus exception response (the payload being the exception
+# code), or a pymodbus exception (the payload being its message). STATUS_RAISED is set when the exception was
+# raised by the client rather than returned
+STATUS_OK = 0
+STATUS_EXCEPTION_RESPONSE = 1
+STATUS_IO_ERROR = 2
+STATUS_CONNECTION_ERROR = 3
+STATUS_ERROR = 4
+STATUS_RAISED = 0x80
+
+_ERROR_TYPES = {STATUS_IO_ERROR: ModbusIOException, STATUS_CONNECTION_ERROR: ConnectionException, STATUS_ERROR: ModbusException}
+
+_RESPONSES = {
+    1: lambda address, values: ReadCoilsResponse(values),
+    2: lambda address, values: ReadDiscreteInputsResponse(values),
+    3: lambda address, values: ReadHoldingRegistersResponse(values),
+    4: lambda address, values: ReadInputRegistersResponse(values),
+    5: lambda address, values: WriteSingleCoilResponse(address, values[0]),
+    6: lambda address, values: WriteSingleRegisterResponse(address, values[0]),
+    15: lambda address, values: WriteMultipleCoilsResponse(address, len(values)),
+    16: lambda address, values: WriteMultipleRegistersResponse(address, len(values))
+}
+
+Trace = namedtuple('Trace', 'mode baudrate started slaves records')
+TraceRecord = namedtuple('TraceRecord', 'function_code offset duration slave address count status payload')
+
+def encode_values(function_code, values):
+    """ Packs register values as 16 bit words, bits 8 to a byte
+    """
+    if function_code in BIT_FUNCTIONS:
+        packed = bytearray((len(values) + 7) // 8)
+        for i, bit in enumerate(values):
+            if bit:
+                packed[i // 8] |= 1 << (i % 8)
+        return bytes(packed)
+    return struct.pack('<{}H'.format(len(values)), *[int(value) & 0xffff for value in values])
+
+def decode_values(function_code, payload):
+    if function_code in BIT_FUNCTIONS:
+        return [bool(ord(payload[i // 8]) & (1 << (i % 8))) for i in range(len(payload) * 8)]
+    return list(struct.unpack('<{}H'.format(len(payload) // 2), payload))
+
+def read_trace(path):
+    """ Reads a trace file, a truncated last record (e.g. after a power cut) is ignored.
+        Raises ValueError if the file is not a trace
+    """
+    with open(path, 'rb') as trace_file:
+        data = trace_file.read()
+    if len(data) < HEADER.size:
+        raise ValueError('{} is not a Modbus trace'.format(path))
+    magic, version, mode, baudrate, started = HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError('{} is not a Modbus trace of version {}'.format(path, TRACE_VERSION))
+
+    slaves = []
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        function_code, start, duration, slave, address, count, status, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            break
+        payload = data[offset:offset + length]
+        offset += length
+        if function_code == FUNCTION_SLAVE:
+            slaves.append(payload.decode('utf8'))
+        else:
+            records.append(TraceRecord(function_code, start / 1000.0, duration / 1000000.0, slaves[slave],
+                address, count, status, payload))
+    return Trace(mode, baudrate, started, slaves, records)
+
+def replay_response(record):
+    """ Returns the pymodbus response of a record, raises the exception of records that raised one
+    """
+    status = record.status & ~STATUS_RAISED
+    if status == STATUS_OK:
+        return _RESPONSES[record.function_code](record.address, decode_values(record.function_code, record.payload))
+    if status == STATUS_EXCEPTION_RESPONSE:
+        return ExceptionResponse(record.function_code, ord(record.payload[0]))
+    error = _ERROR_TYPES.get(status, ModbusException)('')
+    error.string = record.payload.decode('utf8')
+    error.args = (error.string,)
+    if record.status & STATUS_RAISED:
+        raise error
+    return error
+
+class TraceRecorder(object):
+    """ Appends the Modbus requests of a client and their responses to a compact binary trace file:
+        18 bytes per request plus its values. Recording stops once the file reaches max_bytes
+    """
+
+    logger = None
+
+    def __init__(self, path, mode, baudrate, logger, max_bytes):
+        self.path = path
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.started = time.time()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, mode, baudrate, self.started))
+        self._size = HEADER.size
+        # slave id -> index in the trace
+        self._slaves = {}
+        self._lock = threading.Lock()
+        self.logger.info('Recording Modbus traffic to %s', path)
+
+    def bus(self, client, slave_id=None):
+        """ Returns client wrapped to record its requests, under slave_id or when None the unit they are sent to
+        """
+        return TracingBus(client, self, slave_id)
+
+    def record(self, function_code, started, duration, slave_id, address, count, status, payload):
+        with self._lock:
+            if self._file == None:
+                return
+            slave = self._slaves.get(slave_id)
+            data = ''
+            if slave == None:
+                slave = self._slaves[slave_id] = len(self._slaves)
+                name = slave_id.encode('utf8')
+                data = RECORD.pack(FUNCTION_SLAVE, 0, 0, slave, 0, 0, STATUS_OK, len(name)) + name
+            data += RECORD.pack(function_code, max(0, int((started - self.started) * 1000)), int(duration * 1000000),
+                slave, address & 0xffff, count & 0xffff, status, len(payload)) + payload
+            if self._size + len(data) > self.max_bytes:
+                self.logger.warning('Modbus trace %s reached %s bytes, recording stopped', self.path, self.max_bytes)
+                self._close()
+                return
+            self._file.write(data)
+            # keep the trace readable if the gateway dies
+            self._file.flush()
+            self._size += len(data)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+class TracingBus(object):
+    """ Stands in for a pymodbus client and records the requests sent through it. Sits below retries,
+        bus arbitration and health tracking, so every attempt on the bus is recorded as it happened
+    """
+
+    def __init__(self, client, recorder, slave_id=None):
+        self.client = client
+        self.recorder = recorder
+        self.slave_id = slave_id
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        function_code = FUNCTION_CODES.get(name)
+        if function_code == None:
+            return attribute
+        return lambda address, value, **kwargs: self._request(function_code, attribute, address, value, kwargs)
+
+    def _request(self, function_code, function, address, value, kwargs):
+        slave_id = '{}'.format(kwargs.get('unit', 0) if self.slave_id == None else self.slave_id)
+        if function_code in READ_FUNCTIONS:
+            count = value
+        else:
+            values = value if isinstance(value, (list, tuple)) else [value]
+            count = len(values)
+        started = time.time()
+        try:
+            result = function(address, value, **kwargs)
+        except Exception as e:
+            status, payload = self._error(function_code, e)
+            self.recorder.record(function_code, started, time.time() - started, slave_id, address, count,
+                status | STATUS_RAISED, payload)
+            raise
+        duration = time.time() - started
+        if result.isError():
+            status, payload = self._error(function_code, result)
+        elif function_code in READ_FUNCTIONS:
+            status = STATUS_OK
+            payload = encode_values(function_code, result.bits if function_code in BIT_FUNCTIONS else result.registers)
+        else:
+            status, payload = STATUS_OK, encode_values(function_code, values)
+        self.recorder.record(function_code, started, duration, slave_id, address, count, status, payload)
+        return result
+
+    def _error(self, function_code, error):
+        if isinstance(error, ExceptionResponse):
+            return STATUS_EXCEPTION_RESPONSE, chr(error.exception_code)
+        if isinstance(error, ConnectionException):
+            status = STATUS_CONNECTION_ERROR
+        elif isinstance(error, ModbusIOException):
+            status = STATUS_IO_ERROR
+        else:
+            status = STATUS_ERROR
+        message = error.string if isinstance(error, ModbusException) else '{}'.format(error)
+        return status, message.encode('utf8')
+
+class ReplayBus(object):
+    """ Stands in for a pymodbus client and answers requests from a trace, for the slave slave_id or when
+        None the unit they are sent to
+    """
+
+    def __init__(self, replay, slave_id=None):
+        self.replay = replay
+        self.slave_id = slave_id
+
+    def __getattr__(self, name):
+        function_code = FUNCTION_CODES.get(name)
+        if function_code == None:
+            raise AttributeError(name)
+        return lambda address, value, **kwargs: self.replay.respond(
+            kwargs.get('unit', 0) if self.slave_id == None else self.slave_id, function_code, address,
+            value if function_code in READ_FUNCTIONS else len(value) if isinstance(value, (list, tuple)) else 1)
@@ -19,6 +19,91 @@ MASTER_MODEL_ID = '<MODELID>'
 # Master DeviceId
 MASTER_DEVICE_ID = 'modbusmastertests'
 
+# File caching derived device keys and the last accepted slaves config across restarts, None to disable
+PROVISIONING_CACHE_PATH = 'provisioning_cache.json'
+# Directory buffering telemetry that could not be sent while offline, None to disable
+TELEMETRY_BUFFER_PATH = 'telemetry_buffer'
+# Size in bytes of a single telemetry buffer segment file
+TELEMETRY_BUFFER_SEGMENT_BYTES = 1024 * 1024
+# Max bytes of buffered telemetry per device, the oldest segments are dropped beyond this
+TELEMETRY_BUFFER_MAX_BYTES = 32 * 1024 * 1024
+# Max age in seconds of buffered telemetry, older messages are dropped instead of sent
+TELEMETRY_BUFFER_MAX_AGE = 7 * 24 * 3600
+# Max number of buffered messages sent per drain interval after reconnecting
+TELEMETRY_DRAIN_BATCH = 10
+# Seconds between two batches of buffered messages
+TELEMETRY_DRAIN_INTERVAL = 1
+# Max telemetry messages per device whose poll time is kept until the client reports them sent, messages 
+# that fail are buffered again with it
+TELEMETRY_IN_FLIGHT_MESSAGES = 1000
+# Max size in bytes of a telemetry message, the IoT Hub limit is 256 KB
+TELEMETRY_MAX_MESSAGE_BYTES = 256 * 1024
+# Seconds of snapshots of a slave batched into one message as a JSON array of timestamped objects, 
+# 0 sends every snapshot right away as a JSON object. Ignored in multiplexed mode
+TELEMETRY_BATCH_INTERVAL = 0
+# Send telemetry messages gzip compressed and base64 encoded in a {"contentEncoding": "gzip", "data": ...} envelope
+TELEMETRY_COMPRESSION = False
+# Seconds to wait before retrying a lost IoT Central connection
+RECONNECT_WAIT = 3
+# Number of threads connecting slaves to IoT Central in parallel, every connection provisions the device with DPS first
+CONNECT_WORKERS = 8
+# Max slave connection attempts started per second, and attempts that may start at once, to stay within DPS throttling
+CONNECT_RATE = 3
+CONNECT_BURST = 10
+# Max telemetry messages a device keeps in memory until it is connected for the first time, when TELEMETRY_BUFFER_PATH is None
+CONNECT_BUFFER_MESSAGES = 60
+
+# Multiplexed mode: slaves send telemetry and receive settings through the master connection 
+# instead of opening their own IoT Central connection
+# The slaves then only exist as members of the master's telemetry, without their own device, template or acknowledgements
+MULTIPLEX_SLAVES = False
+# Seconds between two batched telemetry messages of the master in multiplexed mode
+MULTIPLEX_FLUSH_INTERVAL = 1
+# Separator between device id and register name of slave settings on the master in multiplexed mode
+MULTIPLEX_SETTING_SEPARATOR = '__'
+
+# Supervisor mode: None polls every slave in this process. Otherwise a list of shards, each polled by its own 
+# worker process while this process holds the IoT Central connections. A shard is a serial bus, e.g.
+#   {'name': 'bus1', 'mode': 1, 'serialPort': '/dev/ttyUSB0', 'baudRate': 9600}
+# or Modbus TCP slaves spread over a number of processes, e.g. {'name': 'tcp', 'mode': 2, 'processes': 2}
+# Unset shard settings (mode, serialPort, baudRate, method, timeout, tcpPort, tracePath, replayPath) default to the 
+# Modbus parameters below, each worker records its trace to MODBUS_TRACE_PATH.<name>
+SHARDS = None
+# Min and max seconds before restarting a worker process that exited, the wait doubles after every quick exit
+SHARD_RESTART_BACKOFF_MIN = 1
+SHARD_RESTART_BACKOFF_MAX = 60
+
+"""
+Device loop parameters
+"""
+# Max seconds a device loop sleeps between two passes of the IoT Central client when nothing is due
+DEVICE_IDLE_INTERVAL = 1
+# Device loop mode:
+#   0: One thread per device
+#   1: Shared polling engine, all devices are scheduled on a small pool of worker threads
+DEVICE_LOOP_MODE = 0
+# Number of worker threads of the shared polling engine
+POLLING_ENGINE_WORKERS = 2
+# Min seconds between two loop passes of a device on the shared polling engine
+POLLING_ENGINE_IDLE = 0.1
+# Default max age in seconds of a cached register value served by readNow, older values are read from the bus first
+ON_DEMAND_MAX_AGE = 5
+# Seconds the main process waits for a worker to answer an on-demand read in supervisor mode
+ON_DEMAND_TIMEOUT = 10
+# Max samples per register kept for the percentiles of an aggregation window, older samples of the window are overwritten
+AGGREGATION_MAX_SAMPLES = 1024
+
+"""
+Metrics parameters
+"""
+# Port of the local metrics endpoint (Prometheus format on /metrics), None to disable. Avoid 9100, the port of 
+# node_exporter. Workers of supervisor mode use the ports following it
+METRICS_PORT = None
+# Address the metrics endpoint listens on
+METRICS_HOST = '127.0.0.1'
+# Seconds between two stack samples of the profiler, switched on with /profiler/start
+PROFILER_INTERVAL = 0.01
+
 """
 Modbus parameters
 """
@@ -26,6 +111,7 @@ Modbus parameters
 #   0: Simulated
 #   1: Serial
 #   2: TCP/IP
+#   3: Replay of a trace recorded with MODBUS_TRACE_PATH
 MODBUS_MODE = 0
 # Modbus baud rate
 BAUD_RATE = 4800
@@ -39,6 +125,52 @@ MODBUS_METHOD = 'rtu'
 MODBUS_RETRY_WAIT = 20
 # Max number of retry attempts
 MODBUS_RETRY_ATTEMPTS = 3
+# Modbus TCP port of the slaves
+MODBUS_TCP_PORT = 502
+# Modbus unit id of the TCP slaves
+MODBUS_TCP_UNIT_ID = 1
+# Max number of open connections to a single Modbus TCP slave
+TCP_POOL_MAX_CONNECTIONS = 2
+# Seconds after which an unused Modbus TCP connection is closed
+TCP_POOL_IDLE_TIMEOUT = 60
+# Min and max seconds to wait before reconnecting to an unreachable Modbus TCP slave
+TCP_RECONNECT_BACKOFF_MIN = 1
+TCP_RECONNECT_BACKOFF_MAX = 60
+# Consecutive failed requests (after retries) after which a slave or Modbus TCP host is quarantined
+SLAVE_FAILURE_THRESHOLD = 3
+# Min and max seconds between two probes of a quarantined slave, the wait doubles after every failed probe
+SLAVE_PROBE_BACKOFF_MIN = 5
+SLAVE_PROBE_BACKOFF_MAX = 300
+# Seconds a slave takes to start answering a request, used to estimate bus load
+MODBUS_TURNAROUND = 0.01
+# Max fraction of the serial bus time the configured polling may use before low priority registers are slowed down
+BUS_MAX_UTILISATION = 0.8
+# Max factor by which the poll interval of a low priority register is stretched on an overloaded bus
+BUS_MAX_STRETCH = 10
+# Max number of unused addresses allowed between two registers merged into one block read
+MODBUS_READ_MAX_GAP = 4
+# Protocol limit for registers in a single FC03/FC04 read
+MODBUS_MAX_READ_REGISTERS = 125
+# Protocol limit for bits in a single FC01/FC02 read
+MODBUS_MAX_READ_BITS = 2000
+# Protocol limit for registers in a single FC16 write
+MODBUS_MAX_WRITE_REGISTERS = 123
+# Protocol limit for coils in a single FC15 write
+MODBUS_MAX_WRITE_BITS = 1968
+# File recording every Modbus request on the serial or TCP bus with its response and timing, None to disable
+MODBUS_TRACE_PATH = None
+# Max size in bytes of the trace file, recording stops beyond
+MODBUS_TRACE_MAX_BYTES = 100 * 1024 * 1024
+# Trace file answering the requests of MODBUS_MODE 3
+MODBUS_REPLAY_PATH = None
+# Speed factor of replayed response times: 1 for the recorded timing, 2 for twice as fast, 0 to answer right away
+MODBUS_REPLAY_SPEED = 1.0
+# Seconds setting writes are held so rapid updates of a register and writes to adjacent registers are sent together
+WRITE_DEBOUNCE = 0.2
+# Merge writes to adjacent registers into a single FC15/FC16 request, disable for slaves without FC15/FC16 support
+WRITE_MERGE_ADJACENT = True
+# Read written registers back and fail the setting if they do not hold the written values
+WRITE_VERIFY = False
 
 """
 JSON Keys
@@ -52,7 +184,17 @@ KEY_IS_GATEWAY = 'iotcIsGateway'
 # Payload key s
 KEY_VERSION = '$version'
 KEY_VERSION = 'value'
+KEY_DESIRED_VERSION = '$version'
 KEY_CONFIG = 'slavesconfig'
+# Telemetry field of the slave health state: healthy, quarantined or probing
+KEY_HEALTH = 'health'
+# Message property holding the time buffered telemetry was polled, IoT Central uses it as the message timestamp
+KEY_CREATION_TIME = 'iothub-creation-time-utc'
+
+# Commands
+COMMAND_READ_NOW = 'readNow'
+COMMAND_KEY_REGISTERS = 'registers'
+COMMAND_KEY_MAX_AGE = 'maxAge'
 
 # Slave config keys
 CONFIG_KEY_SLAVES = "slaves"
@@ -63,11 +205,28 @@ CONFIG_KEY_MODEL_ID = 'modelId'
 CONFIG_KEY_UPDATE_INTERVAL = 'updateInterval'
 CONFIG_KEY_SLAVE_ID = 'slaveId'
 CONFIG_KEY_ACTIVE_REGISTERS = 'activeRegisters'
+CONFIG_KEY_READ_GAP = 'readGap'
+CONFIG_KEY_SHARD = 'shard'
+CONFIG_KEY_PROFILES = 'profiles'
+CONFIG_KEY_PROFILE = 'profile'
 
 # Active Registers
 ACTIVE_REGISTERS_KEY_REGISTER_NAME = 'registerName'
 ACTIVE_REGISTERS_KEY_ADDRESS = 'address'
 ACTIVE_REGISTERS_KEY_TYPE = 'type'
+ACTIVE_REGISTERS_KEY_DEADBAND = 'deadband'
+ACTIVE_REGISTERS_KEY_DEADBAND_PERCENT = 'deadbandPercent'
+ACTIVE_REGISTERS_KEY_MIN_PUBLISH_INTERVAL = 'minPublishInterval'
+ACTIVE_REGISTERS_KEY_MAX_SILENCE = 'maxSilence'
+ACTIVE_REGISTERS_KEY_DATA_TYPE = 'dataType'
+ACTIVE_REGISTERS_KEY_WORD_ORDER = 'wordOrder'
+ACTIVE_REGISTERS_KEY_BYTE_ORDER = 'byteOrder'
+ACTIVE_REGISTERS_KEY_SCALE = 'scale'
+ACTIVE_REGISTERS_KEY_OFFSET = 'offset'
+ACTIVE_REGISTERS_KEY_POLL_INTERVAL = 'pollInterval'
+ACTIVE_REGISTERS_KEY_PRIORITY = 'priority'
+ACTIVE_REGISTERS_KEY_AGGREGATION_WINDOW = 'aggregationWindow'
+ACTIVE_REGISTERS_KEY_AGGREGATION_PERCENTILES = 'aggregationPercentiles'
 ACTIVE_REGISTERS_TYPE_COIL = 'co'
 ACTIVE_REGISTERS_TYPE_DISCRETE_INPUT = 'di'
 ACTIVE_REGISTERS_TYPE_INPUT_REGISTER = 'ir'
@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import threading
+import time
+import weakref
+
+import config
+from metrics import REGISTRY
+from scheduler import Scheduler
+
+_CONNECTORS = weakref.WeakSet()
+
+# Buckets in seconds of connection and startup times, provisioning alone takes a few seconds
+STARTUP_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+CONNECT_SECONDS = REGISTRY.histogram('iotc_connect_seconds',
+    'Time taken by a connection attempt of a slave, including provisioning', buckets=STARTUP_BUCKETS)
+CONNECT_WAIT_SECONDS = REGISTRY.histogram('iotc_connect_wait_seconds',
+    'Time a connection attempt waited for the rate limit and a free connector thread', buckets=STARTUP_BUCKETS)
+CONNECT_PENDING = REGISTRY.gauge('iotc_connect_pending', 'Slaves waiting for their connection attempt or connecting',
+    collect=lambda: {(): sum(connector.pending() for connector in list(_CONNECTORS))})
+
+class Connector(object):
+    """ Connects the IoT Central clients of slaves on a bounded pool of threads, so hundreds of slaves
+        starting at once provision in parallel instead of one after another. Attempts are spaced 1/rate
+        seconds apart, up to burst of them starting at once after a quiet period, to stay within the
+        DPS registration throttling. A device is queued at most once
+    """
+
+    logger = None
+    scheduler = None
+
+    def __init__(self, logger, worker_count=None, rate=None, burst=None):
+        self.logger = logger
+        self.rate = float(config.CONNECT_RATE if rate == None else rate)
+        self.burst = config.CONNECT_BURST if burst == None else burst
+        worker_count = config.CONNECT_WORKERS if worker_count == None else worker_count
+        self.scheduler = Scheduler(logger, worker_count, 'Connector')
+
+        # ids of the devices queued or connecting
+        self._pending = set()
+        # theoretical arrival time of the rate limit, the earliest start of the next attempt without burst
+        self._next_attempt = 0
+        self._lock = threading.Lock()
+        _CONNECTORS.add(self)
+
+    def start(self):
+        self.scheduler.start()
+
+    def stop(self):
+        """ Stops the connector threads, queued attempts are dropped
+        """
+        self.scheduler.stop()
+        with self._lock:
+            self._pending = set()
+
+    def connect(self, device):
+        """ Queues a connection attempt of the client of device, does nothing if one is already queued
+        """
+        with self._lock:
+            if id(device) in self._pending:
+                return
+            self._pending.add(id(device))
+            delay = self._reserve(time.time())
+        self.scheduler.call_later(delay, self._connect, device, time.time())
+
+    def is_pending(self, device):
+        """ True while a connection attempt of the device is queued or running
+        """
+        with self._lock:
+            return id(device) in self._pending
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _reserve(self, now):
+        """ Returns the delay before the next attempt may start, as a generic cell rate algorithm
+        """
+        interval = 1.0 / self.rate
+        start = max(now, self._next_attempt - (self.burst - 1) * interval)
+        self._next_attempt = max(self._next_attempt, now) + interval
+        return start - now
+
+    def _connect(self, device, queued_at):
+        started = time.time()
+        CONNECT_WAIT_SECONDS.observe(started - queued_at)
+        try:
+            if device._active:
+                device.client.connect()
+        except Exception as e:
+            self.logger.error('Failed to connect %s: %s', device.device_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(id(device))
+        CONNECT_SECONDS.observe(time.time() - started)
+        device.wake()
@@ -0,0 +1,152 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import struct
+from collections import namedtuple
+
+from pymodbus.exceptions import ModbusException
+
+import config
+from read_planner import split_block
+
+# data type -> (struct format character, width in 16 bit registers)
+DATA_TYPES = {
+    'uint16': ('H', 1),
+    'int16': ('h', 1),
+    'uint32': ('I', 2),
+    'int32': ('i', 2),
+    'float32': ('f', 2),
+    'uint64': ('Q', 4),
+    'int64': ('q', 4),
+    'float64': ('d', 4)
+}
+ORDER_BIG = 'big'
+ORDER_LITTLE = 'little'
+
+RegisterFormat = namedtuple('RegisterFormat', 'data_type word_order byte_order scale offset')
+DEFAULT_FORMAT = RegisterFormat('uint16', ORDER_BIG, ORDER_BIG, 1, 0)
+
+class InvalidDataTypeException(Exception):
+    def __init__(self, data_type):
+        super(InvalidDataTypeException, self).__init__('Invalid data type {}.'.format(data_type))
+
+def parse_register_format(active_register):
+    """ Reads the data type, word and byte order, scale and offset of an activeRegisters entry
+    """
+    register_format = RegisterFormat(
+        active_register.get(config.ACTIVE_REGISTERS_KEY_DATA_TYPE, DEFAULT_FORMAT.data_type),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_WORD_ORDER, DEFAULT_FORMAT.word_order),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_BYTE_ORDER, DEFAULT_FORMAT.byte_order),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_SCALE, DEFAULT_FORMAT.scale),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_OFFSET, DEFAULT_FORMAT.offset))
+    if register_format.data_type not in DATA_TYPES:
+        raise InvalidDataTypeException(register_format.data_type)
+    return register_format
+
+def register_width(register_format):
+    """ Number of 16 bit registers a value of this format spans
+    """
+    return DATA_TYPES[register_format.data_type][1]
+
+def _byte_order(register_format):
+    """ Positions in the big endian value of each byte as it arrives on the wire
+    """
+    width = register_width(register_format)
+    words = list(range(width))
+    if register_format.word_order == ORDER_LITTLE:
+        words.reverse()
+    order = []
+    for word in words:
+        order.extend([2 * word + 1, 2 * word] if register_format.byte_order == ORDER_LITTLE else [2 * word, 2 * word + 1])
+    return order
+
+class ShortResponseException(ModbusException):
+    def __init__(self, block, count):
+        super(ShortResponseException, self).__init__(
+            'Read of {0} registers at {1} returned {2}'.format(block.count, block.address, count))
+
+class _Layout(object):
+    """ Values of a block that do not overlap each other, decoded by one struct format
+    """
+    __slots__ = ['names', 'scaling', 'struct', 'permutation', 'position', 'parts']
+
+    def __init__(self):
+        self.names = []
+        self.scaling = []
+        self.parts = []
+        self.position = 0
+        self.struct = None
+        self.permutation = None
+
+class BlockDecoder(object):
+    """ Decodes every value of a block read in one pass. The layout of the block is compiled once into 
+        a single struct format over the raw response bytes, with pad bytes for the unused registers. 
+        Blocks containing swapped word or byte orders also get a precomputed byte permutation. Registers 
+        overlapping an earlier one (e.g. a uint32 and its low word) go to a second layout over the same bytes
+    """
+    __slots__ = ['block', 'words', 'layouts']
+
+    def __init__(self, block, formats):
+        self.block = block
+        self.layouts = []
+
+        permutations = []
+        for name, offset in sorted(block.fields, key=lambda field: field[1]):
+            register_format = formats.get(name, DEFAULT_FORMAT)
+            index = 0
+            while index < len(self.layouts) and offset < self.layouts[index].position:
+                index += 1
+            if index == len(self.layouts):
+                self.layouts.append(_Layout())
+                permutations.append(list(range(2 * block.count)))
+            layout = self.layouts[index]
+            layout.parts.append('{0}x'.format(2 * (offset - layout.position)) if offset > layout.position else '')
+            layout.parts.append(DATA_TYPES[register_format.data_type][0])
+            for byte, source in enumerate(_byte_order(register_format)):
+                permutations[index][2 * offset + byte] = 2 * offset + source
+            layout.position = offset + register_width(register_format)
+            layout.names.append(name)
+            layout.scaling.append((register_format.scale, register_format.offset) 
+                if register_format.scale != 1 or register_format.offset != 0 else None)
+
+        self.words = struct.Struct('>{0}H'.format(block.count))
+        for layout, permutation in zip(self.layouts, permutations):
+            layout.parts.append('{0}x'.format(2 * (block.count - layout.position)) if block.count > layout.position else '')
+            layout.struct = struct.Struct('>' + ''.join(layout.parts))
+            layout.parts = None
+            if permutation != list(range(2 * block.count)):
+                layout.permutation = permutation
+
+    def decode(self, registers):
+        """ Returns a dict of register name to decoded value for the raw registers of the block. Raises
+            ShortResponseException if the slave returned fewer registers than the block holds
+        """
+        if len(registers) < self.block.count:
+            raise ShortResponseException(self.block, len(registers))
+        if self.block.type in config.ACTIVE_REGISTERS_BIT_TYPES:
+            return split_block(self.block, registers)
+        buffer = self.words.pack(*registers[:self.block.count])
+        decoded = {}
+        for layout in self.layouts:
+            data = buffer
+            if layout.permutation != None:
+                raw = bytearray(buffer)
+                data = bytes(bytearray(raw[i] for i in layout.permutation))
+            for name, value, scaling in zip(layout.names, layout.struct.unpack(data), layout.scaling):
+                decoded[name] = value if scaling == None else value * scaling[0] + scaling[1]
+        return decoded
+
+def encode_value(register_format, value):
+    """ Encodes a value to the list of 16 bit registers to write, applying the inverse of scale and offset
+    """
+    type_char, width = DATA_TYPES[register_format.data_type]
+    if register_format.scale != 1 or register_format.offset != 0:
+        value = (value - register_format.offset) / float(register_format.scale)
+    if type_char not in 'fd':
+        value = int(round(value))
+    buffer = bytearray(struct.pack('>' + type_char, value))
+    order = _byte_order(register_format)
+    wire = bytearray(len(buffer))
+    for index, source in enumerate(order):
+        wire[index] = buffer[source]
+    return list(struct.unpack('>{0}H'.format(width), bytes(wire)))
@@ -5,26 +5,46 @@ import base64
 import hashlib
 import hmac
 import json
+import os
 import threading
 import time
 from abc import ABCMeta, abstractmethod
-from collections import namedtuple
+from collections import OrderedDict, deque, namedtuple
 from time import sleep
 
 import iotc
 from iotc import IOTConnectType, IOTLogLevel
 
 import config
+from connector import STARTUP_BUCKETS
+from metrics import REGISTRY
 from modbus import ModbusDeviceClient
+from telemetry_buffer import TelemetryBuffer
+from telemetry_encoder import creation_time_properties
+from value_cache import encode_cached_values, parse_read_command
 
 ProcessDesiredTwinResponse = namedtuple('ProcessDesiredTwinResponse', 'status_code status_text')
 ProcessDesiredTwinResponse.__new__.__defaults__ = (200, 'completed')
+ProcessCommandResponse = namedtuple('ProcessCommandResponse', 'status_code payload')
+ProcessCommandResponse.__new__.__defaults__ = (200, '{}')
+
+TELEMETRY_SEND_SECONDS = REGISTRY.histogram('telemetry_send_seconds', 'Time spent handing telemetry to the client', ['device'])
+TELEMETRY_MESSAGES = REGISTRY.counter('telemetry_messages_total', 'Telemetry messages by outcome', ['device', 'result'])
+FIRST_TELEMETRY_SECONDS = REGISTRY.histogram('telemetry_first_message_seconds', 
+    'Time from starting a device to sending its first telemetry message', buckets=STARTUP_BUCKETS)
 
 class Device(object):
     logger = None
     client = None
     modbus_client = None    
     device_thread = None
+    engine = None
+    connector = None
+    telemetry_buffer = None
+    # False for devices whose telemetry is buffered elsewhere, they get no telemetry buffer
+    buffer_telemetry = True
+    # ProvisioningCache shared by the master and its slaves, set by the master
+    credential_cache = None
 
     scope_id = None
     appKey = None
@@ -32,16 +52,36 @@ class Device(object):
     model_data = None
 
     _active = False
+    _wake_event = None
+    _started_at = None
+    # (poll time, payload) of the telemetry polled before the first connection, when there is no telemetry buffer
+    _startup_telemetry = None
+    _startup_dropped = 0
+    # poll time of the telemetry handed to the client by payload, until the client reports the outcome
+    _in_flight = None
+    _in_flight_lock = None
+    _last_drain = 0
+    _last_reconnect = 0
     _last_updated_sas_token = None
 
-    def __init__(self, scope_id, app_key, device_id, model_data, logger):
+    def __init__(self, scope_id, app_key, device_id, model_data, logger, engine=None, client=None, connector=None):
         self.scope_id = scope_id
         self.app_key = app_key
         self.device_id = device_id
         self.logger = logger
+        self.engine = engine
+        self.connector = connector
+        self._wake_event = threading.Event()
+        self._in_flight = OrderedDict()
+        self._in_flight_lock = threading.Lock()
+        if self.buffer_telemetry and config.TELEMETRY_BUFFER_PATH != None:
+            self.telemetry_buffer = TelemetryBuffer(os.path.join(config.TELEMETRY_BUFFER_PATH, device_id), logger)
 
-        device_key = Device._compute_derived_symmetric_key(self.app_key, self.device_id)
-        self.client = iotc.Device(self.scope_id, device_key, self.device_id, IOTConnectType.IOTC_CONNECT_SYMM_KEY)
+        if client != None:
+            self.client = client
+        else:
+            device_key = self._get_device_key()
+            self.client = iotc.Device(self.scope_id, device_key, self.device_id, IOTConnectType.IOTC_CONNECT_SYMM_KEY)
         self.client.setLogLevel(IOTLogLevel.IOTC_LOGGING_API_ONLY)
         self.client.setModelData(model_data)
 
@@ -52,14 +92,23 @@ class Device(object):
         self.client.on('SettingsUpdated', self._on_settings_updated)
 
     def start(self):
-        """ Starts the loop thread
+        """ Starts the loop thread, or schedules the loop on the polling engine if one is set. With a connector 
+            the device connects in the background and starts polling right away, its telemetry is buffered 
+            until it is connected
         """
         self.logger.info('Starting loop for device %s', self.device_id)
-        self.client.connect()
-        thread = threading.Thread(target=self._loop)
+        self._started_at = time.time()
+        if self.telemetry_buffer == None:
+            self._startup_telemetry = deque(maxlen=config.CONNECT_BUFFER_MESSAGES)
+            self._startup_dropped = 0
         self._active = True
-        thread.start()
-        self.device_thread = thread
+        self._connect()
+        if self.engine != None:
+            self.engine.add(self)
+        else:
+            thread = threading.Thread(target=self._loop)
+            thread.start()
+            self.device_thread = thread
         self.logger.info('Started loop for device %s', self.device_id)
 
     def stop(self):
@@ -68,12 +117,46 @@ class Device(object):
         self.logger.info('Stopping loop for device %s', self.device_id)
         self._cleanup()
         self._active = False
+        if self.engine != None:
+            self.engine.remove(self)
+        self._wake_event.set()
         if self.device_thread != None:
             self.device_thread.join(1)
             self.device_thread = None
         self.client.disconnect()
         self.logger.info('Stopped loop for device %s', self.device_id)
 
+    def send_telemetry(self, payload, created=None):
+        """ Sends a telemetry payload, or stores it in the telemetry buffer while disconnected. created is the 
+            time the payload was polled if it was held back before, it is sent as the message creation time
+        """
+        if self.telemetry_buffer != None and not self.client.isConnected():
+            self.telemetry_buffer.append(payload, created)
+            TELEMETRY_MESSAGES.inc((self.device_id, 'buffered'))
+        elif self._startup_telemetry != None and not self.client.isConnected():
+            startup_telemetry = self._startup_telemetry
+            if len(startup_telemetry) == startup_telemetry.maxlen:
+                if not self._startup_dropped:
+                    self.logger.warning('%s is not connected yet and holds %s messages, dropping the oldest ones', 
+                        self.device_id, startup_telemetry.maxlen)
+                self._startup_dropped += 1
+                TELEMETRY_MESSAGES.inc((self.device_id, 'dropped'))
+            startup_telemetry.append((time.time() if created == None else created, payload))
+            TELEMETRY_MESSAGES.inc((self.device_id, 'buffered'))
+        else:
+            started = time.time()
+            self._send_message(payload, created)
+            TELEMETRY_SEND_SECONDS.observe(time.time() - started, (self.device_id,))
+            self._record_first_telemetry()
+
+    def wake(self):
+        """ Runs the device loop now instead of waiting for its next deadline
+        """
+        if self.engine != None:
+            self.engine.wake(self)
+        else:
+            self._wake_event.set()
+
     #region Callback Handlers
     def _on_connect(self, info):
         if not info.getStatusCode():
@@ -83,14 +166,23 @@ class Device(object):
                 info.getPayload())
         
     def _on_message_sent(self, info):
+        with self._in_flight_lock:
+            polled = self._in_flight.pop(info.getPayload(), None)
         if not info.getStatusCode():
-            self.logger.info('Sent message for %s successfully %s', self.device_id, info.getPayload())
+            TELEMETRY_MESSAGES.inc((self.device_id, 'sent'))
+            self.logger.debug('Sent message for %s successfully %s', self.device_id, info.getPayload())
         else:
+            TELEMETRY_MESSAGES.inc((self.device_id, 'failed'))
             self.logger.error('Failed to send message for %s with error %s: %s', self.device_id, info.getStatusCode(),
                 info.getPayload())
+            if self.telemetry_buffer != None:
+                # with the time it was polled, so it keeps its timestamp and ages from then
+                self.telemetry_buffer.append(info.getPayload(), polled)
     
     def _on_command(self, info):
         self.logger.info('Received command for %s: %s', self.device_id, info.getPayload())
+        response = self._process_command(info.getTag(), info.getPayload())
+        info.setResponse(response.status_code, response.payload)
 
     def _on_settings_updated(self, info):
         key = info.getTag()
@@ -102,34 +194,172 @@ class Device(object):
 
         self.logger.info('Settings updated for %s. %s: %s', self.device_id, key, setting)
         value = setting[config.KEY_VERSION]
-        self._process_setting(key, value)
+        version = setting.get(config.KEY_DESIRED_VERSION)
+        acknowledge = lambda response: self._acknowledge_setting(key, value, version, response)
+        response = self._process_setting(key, value, acknowledge)
+        if response != None:
+            acknowledge(response)
+        self.wake()
    #endregion
 
-    def _process_setting(self, key, setting):
-        """ Process a json object representing the desired twin
+    def _process_setting(self, key, setting, acknowledge=None):
+        """ Process a json object representing the desired twin. Returns the response to acknowledge the 
+            setting with, or None if acknowledge will be called with it once the setting has been applied
         """
         return ProcessDesiredTwinResponse()
+
+    def _process_command(self, name, payload):
+        """ Processes a command, returns the ProcessCommandResponse to respond with
+        """
+        if name != config.COMMAND_READ_NOW:
+            return ProcessCommandResponse()
+        try:
+            device_id, register_names, max_age = parse_read_command(payload)
+            return ProcessCommandResponse(200, encode_cached_values(self.read_values(register_names, max_age, device_id)))
+        except (ValueError, KeyError) as e:
+            status_code = 400
+            status_text = str(e.args[0]) if e.args else str(e)
+        except Exception as e:
+            status_code = 500
+            status_text = 'Error has occured for {} in reading registers: {}.'.format(self.device_id, e)
+        self.logger.error(status_text)
+        return ProcessCommandResponse(status_code, json.dumps({'status': status_text}))
+
+    def read_values(self, register_names=None, max_age=None, device_id=None):
+        """ Returns a dict of register name to the CachedValue of the registers of the device, or of its 
+            slave device_id, reading those older than max_age seconds first. Raises KeyError for unknown 
+            devices or registers
+        """
+        raise KeyError('Device {} has no registers'.format(self.device_id))
+
+    def _acknowledge_setting(self, key, value, version, response):
+        """ Reports the outcome of a setting update to IoT Central
+        """
+        if response.status_code != 200:
+            self.logger.warning('Setting %s of %s failed with %s: %s', key, self.device_id, response.status_code, 
+                response.status_text)
+        self.client.sendProperty(json.dumps({key: {
+            'value': value,
+            'statusCode': response.status_code,
+            'status': str(response.status_text),
+            'desiredVersion': version
+        }}))
         
     def _do_loop_actions(self):
         pass
 
+    def _next_loop_delay(self):
+        """ Seconds until the loop actions need to run again
+        """
+        return config.DEVICE_IDLE_INTERVAL
+
     def _loop(self):
-        """ Background loop for the device
+        """ Background loop for the device, sleeps until the next deadline, a twin update or stop
         """
         while self._active:
-            if self.client.isConnected():
+            try:
+                delay = self._loop_once()
+            except Exception as e:
+                # keep the thread alive, the next pass may well succeed
+                self.logger.error('Loop pass failed for %s: %s', self.device_id, e)
+                delay = config.DEVICE_IDLE_INTERVAL
+            if delay > 0:
+                self._wake_event.wait(delay)
+            self._wake_event.clear()
+
+    def _loop_once(self, idle_time=None):
+        """ Runs a single pass of the device loop and returns the number of seconds until the next pass is due.
+            idle_time is passed to the IoT Central client, None keeps the client default
+        """
+        if self.client.isConnected():
+            if idle_time == None:
                 self.client.doNext()
-                self._do_loop_actions()
             else:
+                self.client.doNext(idle_time)
+            if self._startup_telemetry != None:
+                self._send_startup_telemetry()
+            self._do_loop_actions()
+            if self.telemetry_buffer == None or self.telemetry_buffer.is_empty():
+                return self._next_loop_delay()
+            self._drain_telemetry_buffer()
+            return min(self._next_loop_delay(), config.TELEMETRY_DRAIN_INTERVAL)
+        else:
+            if time.time() - self._last_reconnect >= config.RECONNECT_WAIT and \
+               (self.connector == None or not self.connector.is_pending(self)):
                 self.logger.info('Connection was lost for %s. Reconnecting...', self.device_id)
-                self.client.connect()
-                time.sleep(3)
+                self._last_reconnect = time.time()
+                self._connect()
+            if self.telemetry_buffer == None and self._startup_telemetry == None:
+                return config.RECONNECT_WAIT
+            # keep polling while offline, telemetry goes to the buffer
+            self._do_loop_actions()
+            return min(self._next_loop_delay(), config.RECONNECT_WAIT)
+
+    def _connect(self):
+        """ Connects the IoT Central client, in the background when there is a connector
+        """
+        if self.connector != None:
+            self.connector.connect(self)
+        else:
+            self.client.connect()
+
+    def _send_startup_telemetry(self):
+        """ Sends the telemetry kept in memory while the device connected for the first time, with the time 
+            every message was polled
+        """
+        startup_telemetry = self._startup_telemetry
+        self._startup_telemetry = None
+        for created, payload in startup_telemetry:
+            self._send_message(payload, created)
+        if startup_telemetry:
+            self._record_first_telemetry()
+            self.logger.info('Sent %s messages of %s polled while connecting, %s older ones were dropped', 
+                len(startup_telemetry), self.device_id, self._startup_dropped)
+
+    def _send_message(self, payload, created=None):
+        """ Hands a telemetry message to the client, with its creation time for messages polled earlier
+        """
+        with self._in_flight_lock:
+            self._in_flight[payload] = time.time() if created == None else created
+            if len(self._in_flight) > config.TELEMETRY_IN_FLIGHT_MESSAGES:
+                self._in_flight.popitem(last=False)
+        if created == None:
+            self.client.sendTelemetry(payload)
+        else:
+            self.client.sendTelemetry(payload, creation_time_properties(created))
+
+    def _record_first_telemetry(self):
+        if self._started_at != None:
+            FIRST_TELEMETRY_SECONDS.observe(time.time() - self._started_at)
+            self._started_at = None
+
+    def _drain_telemetry_buffer(self):
+        """ Sends a batch of buffered telemetry, at most once per drain interval so catching up after 
+            an outage does not starve live telemetry or polling
+        """
+        if time.time() - self._last_drain < config.TELEMETRY_DRAIN_INTERVAL:
+            return
+        self._last_drain = time.time()
+        payloads, cursor = self.telemetry_buffer.read(config.TELEMETRY_DRAIN_BATCH)
+        for created, payload in payloads:
+            self._send_message(payload, created)
+        if payloads:
+            self._record_first_telemetry()
+        self.telemetry_buffer.commit(cursor)
+        self.logger.info('Sent %s buffered messages for %s', len(payloads), self.device_id)
 
     def _cleanup(self):
         """ Clean up on exit
         """
         pass
 
+    def _get_device_key(self):
+        """ Returns the device key, from the credential cache if there is one
+        """
+        if self.credential_cache != None:
+            return self.credential_cache.device_key(self.device_id, Device._compute_derived_symmetric_key)
+        return Device._compute_derived_symmetric_key(self.app_key, self.device_id)
+
     @staticmethod
     def _compute_derived_symmetric_key(app_key, deviceId):
         """ Compute a device key using the application key and the device identity
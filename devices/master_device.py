@@ -5,29 +5,53 @@ import json
 import time
 
 import config
+from connector import Connector
+from data_types import InvalidDataTypeException
 from device import Device, ProcessDesiredTwinResponse
-from modbus import SimulatedModbusDeviceClient, SerialModbusDeviceClient, TCPModbusDeviceClient
+from modbus import SimulatedModbusDeviceClient, SerialModbusDeviceClient, TCPModbusDeviceClient, ReplayModbusDeviceClient
+from multiplexer import TelemetryMultiplexer
+from poll_scheduler import apply_bus_budget
+from polling_engine import PollingEngine
+from provisioning_cache import ProvisioningCache
+from register_profiles import load_profiles, slave_profile
 from slave_device import SlaveDevice
 
 
 class MasterDevice(Device):
 
     slaves = []
+    profiles = None
+    multiplexer = None
+    slave_connector = None
 
-    def __init__(self, scope_id, app_key, model_id, device_id, logger):
+    def __init__(self, scope_id, app_key, model_id, device_id, logger, client=None):
         model_data = Device._create_model_data(model_id, None, True)
-        super(MasterDevice, self).__init__(scope_id, app_key, device_id, model_data, logger)
+        if config.PROVISIONING_CACHE_PATH != None:
+            Device.credential_cache = ProvisioningCache(config.PROVISIONING_CACHE_PATH, app_key, logger)
+        engine = PollingEngine(logger) if config.DEVICE_LOOP_MODE == 1 else None
+        super(MasterDevice, self).__init__(scope_id, app_key, device_id, model_data, logger, engine, client)
         
-        if config.MODBUS_MODE == 0:
-            self.modbus_client = SimulatedModbusDeviceClient(method='rtu', port=config.SERIAL_PORT, 
-            timeout=config.MODBUS_CLIENT_TIMEOUT, baudrate=config.BAUD_RATE)
-        elif config.MODBUS_MODE == 1:
-            self.modbus_client = SerialModbusDeviceClient(method=config.MODBUS_METHOD, port=config.SERIAL_PORT, 
-                timeout=config.MODBUS_CLIENT_TIMEOUT, baudrate=config.BAUD_RATE)
-        elif config.MODBUS_MODE == 2:
-            self.modbus_client = TCPModbusDeviceClient()
-        else:
-            raise 'Invalid Modbus Mode configuration'
+        self.modbus_client = self._create_modbus_client()
+        # slaves with their own connection connect on it, the master connects right away to get the slaves config
+        self.slave_connector = Connector(logger)
+        if config.MULTIPLEX_SLAVES:
+            self.multiplexer = TelemetryMultiplexer(self.client, logger)
+
+    def start(self):
+        if self.engine != None:
+            self.engine.start()
+        self.slave_connector.start()
+        # start polling the last known slaves while the master is still connecting
+        self._restore_slaves_config()
+        super(MasterDevice, self).start()
+
+    def stop(self):
+        super(MasterDevice, self).stop()
+        self.slave_connector.stop()
+        if self.engine != None:
+            self.engine.stop()
+        if self.modbus_client != None:
+            self.modbus_client.close()
 
     def kill_slaves(self):
         """ Disconnect and stop threads for all slave devices
@@ -37,7 +61,25 @@ class MasterDevice(Device):
             slave.stop()
         self.slaves = []
 
-    def _process_setting(self, key, value):
+    def get_slave(self, device_id):
+        """ Returns the running slave with the given device id, or None
+        """
+        for slave in self.slaves:
+            if slave.device_id == device_id:
+                return slave
+        return None
+
+    def read_values(self, register_names=None, max_age=None, device_id=None):
+        """ Returns the cached values of the registers of slave device_id, see SlaveDevice.read_values
+        """
+        if device_id == None:
+            raise KeyError('{} of the slave to read is missing'.format(config.CONFIG_KEY_DEVICE_ID))
+        slave = self.get_slave(device_id)
+        if slave == None:
+            raise KeyError('Unknown slave {}'.format(device_id))
+        return slave.read_values(register_names, max_age)
+
+    def _process_setting(self, key, value, acknowledge=None):
         """ Process provided config file
         """
         # Create slave devices if config file is sent
@@ -47,8 +89,10 @@ class MasterDevice(Device):
                 config_json = json.loads(value)
                 self._init_slaves(config_json)
                 self.logger.info('Initialized slaves: %s', [s.device_id for s in self.slaves])
+                if self.credential_cache != None:
+                    self.credential_cache.set_slaves_config(value)
                 return ProcessDesiredTwinResponse()
-            except (ValueError, KeyError) as e:
+            except (ValueError, KeyError, InvalidDataTypeException) as e:
                 status_text = 'ValueError or KeyError has occured while parsing JSON: {}'.format(e)
                 self.logger.error(status_text)
                 return ProcessDesiredTwinResponse(400, status_text)
@@ -56,32 +100,148 @@ class MasterDevice(Device):
                 status_text = 'Error has occured in processing config file: {}.'.format(e)
                 self.logger.error(status_text)
                 return ProcessDesiredTwinResponse(500, status_text)
+        elif self.multiplexer != None:
+            return self._route_slave_setting(key, value, acknowledge)
+        else:
+            return ProcessDesiredTwinResponse()
+
+    def _create_modbus_client(self):
+        """ Returns the Modbus client of MODBUS_MODE shared by the slaves
+        """
+        if config.MODBUS_MODE == 0:
+            return SimulatedModbusDeviceClient(method='rtu', port=config.SERIAL_PORT, 
+                timeout=config.MODBUS_CLIENT_TIMEOUT, baudrate=config.BAUD_RATE)
+        elif config.MODBUS_MODE == 1:
+            client = SerialModbusDeviceClient(method=config.MODBUS_METHOD, port=config.SERIAL_PORT, 
+                timeout=config.MODBUS_CLIENT_TIMEOUT, baudrate=config.BAUD_RATE, logger=self.logger)
+        elif config.MODBUS_MODE == 2:
+            client = TCPModbusDeviceClient(self.logger)
+        elif config.MODBUS_MODE == 3:
+            return ReplayModbusDeviceClient(config.MODBUS_REPLAY_PATH, self.logger)
         else:
+            raise ValueError('Invalid Modbus Mode configuration {}'.format(config.MODBUS_MODE))
+        if config.MODBUS_TRACE_PATH != None:
+            client.record(config.MODBUS_TRACE_PATH, config.MODBUS_MODE, config.BAUD_RATE, self.logger)
+        return client
+
+    def _create_slave_client(self, device_id):
+        """ Returns the IoT Central client of a new slave, None for its own connection
+        """
+        if self.multiplexer != None:
+            return self.multiplexer.child_client(device_id)
+        return None
+
+    def _slave_connector(self, client):
+        """ Returns the connector of a new slave with the given client, None if it does not connect on its own
+        """
+        return self.slave_connector if client == None else None
+
+    def _apply_bus_budget(self):
+        """ Stretches the poll intervals of low priority registers when the slaves would need more than 
+            the serial bus can carry. TCP slaves do not share a bus
+        """
+        mode, baudrate = config.MODBUS_MODE, config.BAUD_RATE
+        if mode == 3:
+            # replayed traces keep the bus they were recorded on
+            mode, baudrate = self.modbus_client.mode, self.modbus_client.baudrate
+        if mode != 1:
+            return
+        groups = [group for slave in self.slaves for group in slave.register_map.poll_groups]
+        configured, effective = apply_bus_budget(groups, baudrate)
+        if configured > effective:
+            self.logger.warning('Configured polling needs %.0f%% of the bus, low priority registers slowed down to %.0f%%', 
+                configured * 100, effective * 100)
+        else:
+            self.logger.info('Configured polling needs %.0f%% of the bus', configured * 100)
+
+    def _restore_slaves_config(self):
+        """ Starts the slaves of the last accepted config without waiting for the config twin
+        """
+        if self.credential_cache == None:
+            return
+        cached_config = self.credential_cache.get_slaves_config()
+        if cached_config != None:
+            self.logger.info('Restoring cached slaves config')
+            self._process_setting(config.KEY_CONFIG, cached_config)
+
+    def _route_slave_setting(self, key, value, acknowledge=None):
+        """ Forwards a setting of the form <deviceId><separator><registerName> to the slave in multiplexed mode
+        """
+        device_id, register_name = TelemetryMultiplexer.split_setting_key(key)
+        slave = self.get_slave(device_id) if device_id != None else None
+        if slave == None:
             return ProcessDesiredTwinResponse()
+        response = slave._process_setting(register_name, value, acknowledge)
+        slave.wake()
+        return response
 
     def _init_slaves(self, config_json):
-        """ Kills old slaves and replaces them with new slaves specified in the config 
+        """ Reconciles the running slaves with the config: slaves that were removed or whose slave id or 
+            model changed are stopped, new ones are started and the register map of the others is 
+            replaced in place, so they keep their connection and polling. Every register map profile is 
+            compiled once and shared by its slaves. The whole config is validated before any slave is 
+            touched, so an invalid config leaves the running slaves as they were
         """
-        new_slaves = []
+        profiles = load_profiles(config_json, self.profiles)
+
+        current = dict((s.device_id, s) for s in self.slaves)
+        kept_slaves = []
+        added_configs = []
         # TODO: validate config for address collisions
-        for slave in config_json[config.CONFIG_KEY_SLAVES]:
-            self.logger.info('Initializing slave %s', slave[config.CONFIG_KEY_DEVICE_ID])
-            slave = SlaveDevice(
+        for slave_config in config_json[config.CONFIG_KEY_SLAVES]:
+            device_id = slave_config[config.CONFIG_KEY_DEVICE_ID]
+            slave_id = slave_config[config.CONFIG_KEY_SLAVE_ID]
+            profile = slave_profile(slave_config, profiles)
+            slave = current.get(device_id)
+            if slave != None and slave.slave_id == slave_id and slave.model_id == profile.model_id:
+                del current[device_id]
+                kept_slaves.append((slave, profile))
+            else:
+                added_configs.append((device_id, slave_id, profile))
+
+        new_slaves = []
+        for device_id, slave_id, profile in added_configs:
+            self.logger.info('Initializing slave %s', device_id)
+            client = self._create_slave_client(device_id)
+            new_slaves.append(SlaveDevice(
                 self.scope_id,
                 self.app_key,
-                config_json.get(config.CONFIG_KEY_MODEL_ID, ''),
-                slave[config.CONFIG_KEY_DEVICE_ID],
+                device_id,
                 self.device_id,
-                slave[config.CONFIG_KEY_SLAVE_ID],
-                config_json[config.CONFIG_KEY_ACTIVE_REGISTERS],
-                config_json.get(config.CONFIG_KEY_UPDATE_INTERVAL),
+                slave_id,
+                profile,
                 self.modbus_client,
-                self.logger)
-            new_slaves.append(slave)
+                self.logger,
+                self.engine,
+                client,
+                self._slave_connector(client)))
 
-        self.kill_slaves()
-        self.slaves = new_slaves
+        removed_slaves = list(current.values())
+        self.logger.info('Reconciled slaves of %s: %s kept, %s added, %s removed', self.device_id, 
+            len(kept_slaves), len(new_slaves), len(removed_slaves))
+        for slave in removed_slaves:
+            slave.stop()
+        for slave, profile in kept_slaves:
+            slave.configure(profile)
+            slave.wake()
+        self.slaves = [slave for slave, _ in kept_slaves] + new_slaves
+        self.profiles = profiles
+        self._apply_bus_budget()
         [s.start() for s in new_slaves]
+        if self.credential_cache != None:
+            self.credential_cache.save()
+
+    def _do_loop_actions(self):
+        if self.multiplexer != None:
+            self.multiplexer.flush()
+
+    def _next_loop_delay(self):
+        if self.multiplexer != None:
+            return min(config.DEVICE_IDLE_INTERVAL, self.multiplexer.next_flush_delay())
+        return config.DEVICE_IDLE_INTERVAL
 
     def _cleanup(self):
         self.kill_slaves()
+        if self.multiplexer != None:
+            self.multiplexer.flush(force=True)
+
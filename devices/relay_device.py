@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import itertools
+import json
+import threading
+
+import config
+from device import Device, ProcessDesiredTwinResponse
+
+
+class RelayDevice(Device):
+    """ IoT Central connection of a slave polled by a worker process. Telemetry and setting
+        acknowledgements of the worker are sent through it, settings are forwarded to the worker
+    """
+
+    model_id = None
+    slave_id = None
+    shard = None
+    # the worker buffers telemetry while this connection is down
+    buffer_telemetry = False
+
+    _forwarded_connected = None
+
+    def __init__(self, scope_id, app_key, model_id, device_id, master_id, slave_id, shard, logger, engine=None, client=None, connector=None):
+        model_data = Device._create_model_data(model_id, master_id, False)
+        super(RelayDevice, self).__init__(scope_id, app_key, device_id, model_data, logger, engine, client, connector)
+        self.model_id = model_id
+        self.slave_id = slave_id
+        self.shard = shard
+        # setting name -> acknowledge callback waiting for the outcome reported by the worker
+        self._pending_acks = {}
+        # request id -> [event, values, error, is_key_error] of on-demand reads waiting for the worker
+        self._pending_reads = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def forward_connection_state(self, force=False):
+        """ Tells the worker whether this connection is up, so its slave polls or buffers accordingly
+        """
+        connected = self.client.isConnected()
+        if force or connected != self._forwarded_connected:
+            self.shard.send(('connected', self.device_id, connected))
+            self._forwarded_connected = connected
+
+    def on_worker_property(self, payload):
+        """ Handles a reported property sent by the worker: setting acknowledgements are reported through the
+            callback of the setting, other properties are sent as they are
+        """
+        properties = json.loads(payload)
+        for key, reported in properties.items():
+            with self._lock:
+                acknowledge = self._pending_acks.pop(key, None)
+            if acknowledge == None:
+                self.client.sendProperty(json.dumps({key: reported}))
+            else:
+                acknowledge(ProcessDesiredTwinResponse(reported.get('statusCode', 200), reported.get('status', 'completed')))
+
+    def on_worker_values(self, payload):
+        """ Hands the answer of the worker to the on-demand read waiting for it
+        """
+        request_id, values, error, is_key_error = payload
+        with self._lock:
+            pending = self._pending_reads.get(request_id)
+        if pending != None:
+            pending[1:] = [values, error, is_key_error]
+            pending[0].set()
+
+    def fail_pending_requests(self, status_text):
+        """ Acknowledges the settings and fails the on-demand reads still waiting for the worker, 
+            e.g. when it restarted
+        """
+        with self._lock:
+            pending = self._pending_acks
+            self._pending_acks = {}
+            reads = list(self._pending_reads.values())
+        for acknowledge in pending.values():
+            acknowledge(ProcessDesiredTwinResponse(500, status_text))
+        for read in reads:
+            read[1:] = [None, status_text, False]
+            read[0].set()
+
+    def read_values(self, register_names=None, max_age=None, device_id=None):
+        """ Reads the cached values of the slave from the worker, waiting at most ON_DEMAND_TIMEOUT seconds
+        """
+        if device_id != None and device_id != self.device_id:
+            raise KeyError('Unknown device {}'.format(device_id))
+        request_id = next(self._request_ids)
+        pending = [threading.Event(), None, None, False]
+        with self._lock:
+            self._pending_reads[request_id] = pending
+        try:
+            if not self.shard.send(('read', self.device_id, request_id, register_names, max_age)):
+                raise IOError('Shard {} is restarting'.format(self.shard.name))
+            if not pending[0].wait(config.ON_DEMAND_TIMEOUT):
+                raise IOError('Shard {0} did not answer within {1}s'.format(self.shard.name, config.ON_DEMAND_TIMEOUT))
+        finally:
+            with self._lock:
+                self._pending_reads.pop(request_id, None)
+        _, values, error, is_key_error = pending
+        if error != None:
+            raise KeyError(error) if is_key_error else IOError(error)
+        return values
+
+    def _process_setting(self, key, value, acknowledge=None):
+        """ Forwards a setting to the worker, it is acknowledged once the worker reports its outcome
+        """
+        if acknowledge == None:
+            self.shard.send(('setting', self.device_id, key, value))
+            return ProcessDesiredTwinResponse()
+        with self._lock:
+            self._pending_acks[key] = acknowledge
+        if not self.shard.send(('setting', self.device_id, key, value)):
+            with self._lock:
+                self._pending_acks.pop(key, None)
+            return ProcessDesiredTwinResponse(503, 'Shard {} is restarting'.format(self.shard.name))
+        return None
+
+    def _loop_once(self, idle_time=None):
+        delay = super(RelayDevice, self)._loop_once(idle_time)
+        self.forward_connection_state()
+        return min(delay, config.DEVICE_IDLE_INTERVAL)
@@ -0,0 +1,24 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+from device import Device
+from master_device import MasterDevice
+
+
+class ShardMasterDevice(MasterDevice):
+    """ Master of the slaves of one shard in a worker process. It owns the Modbus client of the shard, 
+        while the slaves config and the IoT Central connections of the slaves are in the uplink process
+    """
+
+    uplink = None
+
+    def __init__(self, device_id, uplink, logger):
+        self.uplink = uplink
+        # inherited from the uplink process, which owns the cache file
+        Device.credential_cache = None
+        super(ShardMasterDevice, self).__init__(None, None, None, device_id, logger, uplink.master_client(device_id))
+        # the uplink process multiplexes the telemetry of the slaves
+        self.multiplexer = None
+
+    def _create_slave_client(self, device_id):
+        return self.uplink.child_client(device_id)
@@ -2,101 +2,249 @@
 # Licensed under the MIT license.
 
 import json
+import struct
+import threading
 import time
 from collections import namedtuple
 
 from pymodbus.exceptions import ModbusException
 
 import config
+from aggregator import Aggregator
+from bus_arbiter import PRIORITY_ON_DEMAND, PRIORITY_POLL
 from device import Device, ProcessDesiredTwinResponse
+from metrics import REGISTRY
+from data_types import InvalidDataTypeException, encode_value
 from modbus import InvalidRegisterTypeException
+from slave_health import SlaveQuarantinedException
+from report_filter import ReportFilter
+from telemetry_encoder import TelemetryBatcher, encode_members
+from value_cache import ValueCache
+from write_pipeline import WritePipeline
 
-ActiveRegister = namedtuple('ActiveRegister', 'address type')
+MODBUS_READ_SECONDS = REGISTRY.histogram('modbus_read_seconds', 
+    'Latency of block reads, including retries', ['slave', 'type', 'address'])
+MODBUS_READ_ERRORS = REGISTRY.counter('modbus_read_errors_total', 'Block reads that failed after retries', ['slave', 'type', 'address'])
+ON_DEMAND_REGISTERS = REGISTRY.counter('on_demand_registers_total', 
+    'Registers requested on demand, by whether they were served from the cache or read from the bus', ['source'])
+
+# Profile of a slave with the poll groups planned from it. They are replaced together, so a polling pass never 
+# decodes the blocks of one profile with another
+SlaveRegisterMap = namedtuple('SlaveRegisterMap', 'profile poll_groups')
 
 class SlaveDevice(Device):
     
-    active_registers = None
-    read_registers = None
+    model_id = None
+    register_map = None
+    report_filter = None
+    aggregator = None
+    value_cache = None
+    telemetry_batcher = None
+    write_pipeline = None
     slave_id = None
-    update_interval = None
 
-    _last_telemetry_sent = None
+    _reported_health = None
+    _configure_lock = None
 
-    def __init__(self, scope_id, app_key, model_id, device_id, master_id, slave_id, active_registers, update_interval, modbus_client, logger):
-        model_data = Device._create_model_data(model_id, master_id, False)
-        super(SlaveDevice, self).__init__(scope_id, app_key, device_id, model_data, logger)
+    def __init__(self, scope_id, app_key, device_id, master_id, slave_id, profile, modbus_client, logger, engine=None, client=None, connector=None):
+        model_data = Device._create_model_data(profile.model_id, master_id, False)
+        super(SlaveDevice, self).__init__(scope_id, app_key, device_id, model_data, logger, engine, client, connector)
         
+        self.model_id = profile.model_id
         self.slave_id = slave_id
-        self.update_interval = 2 if update_interval == None else update_interval
-        self.active_registers = {}
-        self.read_registers = []
         self.modbus_client = modbus_client
+        self.write_pipeline = WritePipeline(modbus_client, slave_id, logger)
+        self.value_cache = ValueCache()
+        self._configure_lock = threading.Lock()
+        if config.MULTIPLEX_SLAVES:
+            # the multiplexer batches the telemetry of all slaves and expects plain JSON objects
+            self.telemetry_batcher = TelemetryBatcher(0, compress=False)
+        else:
+            self.telemetry_batcher = TelemetryBatcher()
+        self.configure(profile)
+
+    def configure(self, profile):
+        """ Applies the register map of a profile, replacing the current one in place while the device keeps 
+            running. Does nothing if the profile is unchanged
+        """
+        with self._configure_lock:
+            if self.register_map != None and profile is self.register_map.profile:
+                return
 
-        for active_register in active_registers:
-            name = active_register[config.ACTIVE_REGISTERS_KEY_REGISTER_NAME]
-            address = active_register[config.ACTIVE_REGISTERS_KEY_ADDRESS]
-            type = active_register[config.ACTIVE_REGISTERS_KEY_TYPE]
-            self.active_registers[name] = ActiveRegister(address, type)
+            poll_groups = profile.new_poll_groups()
+            for group in poll_groups:
+                group.start('{0}/{1}/{2}'.format(self.device_id, group.interval, group.priority))
 
-            if type == config.ACTIVE_REGISTERS_TYPE_DISCRETE_INPUT or \
-               type == config.ACTIVE_REGISTERS_TYPE_INPUT_REGISTER:
-                self.read_registers.append(name)
+            if self.report_filter == None:
+                self.report_filter = ReportFilter(profile.report_policies)
+            else:
+                self.report_filter.update_policies(profile.report_policies)
+            if self.aggregator == None:
+                self.aggregator = Aggregator(profile.aggregation_policies)
+            else:
+                self.aggregator.update_policies(profile.aggregation_policies)
+            self.value_cache.retain(profile.index)
+            self.register_map = SlaveRegisterMap(profile, tuple(poll_groups))
 
     def report_all_registers(self):
         """ Reports the value of all active registers to IoT Central
         """
-        self.report_registers(self.active_registers.keys())
+        self.report_registers(self.register_map.profile.names)
 
     def report_all_read_registers(self):
         """ Reports the value of all read registers to IoT Central
         """
-        self.report_registers(self.read_registers)
+        self.report_registers(self.register_map.profile.read_registers)
+
+    def report_registers(self, register_names, plan=None, profile=None):
+        """ Reports the value of specified registers to IoT Central. Registers with report-by-exception 
+            settings are only sent when they moved past their deadband or were silent for too long, 
+            registers with an aggregation window are only sent as a summary when their window ends
+        """
+        values, aggregates = self.aggregator.add(self.read_register_values(register_names, plan, profile=profile))
+        self._send_snapshot(self.report_filter.filter(values), aggregates)
 
-    def report_registers(self, register_names):
-        """ Reports the value of specified registers to IoT Central
+    def read_register_values(self, register_names, plan=None, priority=PRIORITY_POLL, profile=None):
+        """ Reads the specified registers using as few block reads as possible, or with the given read plan 
+            of profile (the current one by default), and records them in the value cache. Returns a dict of 
+            register name to value, registers in failed blocks are left out and flagged in the cache
         """
-        payload_components = [""]*len(register_names)
-        for index, name in enumerate(register_names):
+        if profile == None:
+            profile = self.register_map.profile
+        if plan == None:
+            plan = profile.plan(register_names)
+
+        values = {}
+        for index, block in enumerate(plan):
+            labels = (self.device_id, block.type, block.address)
+            started = time.time()
             try:
-                payload_components[index] = self._get_register_payload_component(name)
+                raw = self.modbus_client.read_registers(block.type, self.slave_id, block.address, block.count, priority)
+                decoded = profile.decoder(block).decode(raw)
+                self.value_cache.update(decoded)
+                values.update(decoded)
+            except SlaveQuarantinedException as e:
+                # the other blocks would be skipped as well
+                self.logger.debug(e)
+                self.value_cache.mark_bad([name for remaining in plan[index:] for name, _ in remaining.fields])
+                break
             except ModbusException as e:
+                MODBUS_READ_ERRORS.inc(labels)
                 self.logger.error('Modbus device read failed with %s', e)
-        payload = '{{{0}}}'.format(",".join(payload_components))
-        self.client.sendTelemetry(payload)
+                self.value_cache.mark_bad([name for name, _ in block.fields])
+            MODBUS_READ_SECONDS.observe(time.time() - started, labels)
+        return values
+
+    def read_values(self, register_names=None, max_age=None, device_id=None):
+        """ Returns a dict of register name to the CachedValue of the registers, all by default. Registers 
+            whose cached value is older than max_age seconds (ON_DEMAND_MAX_AGE by default) are read from 
+            the bus first, ahead of polling. Raises KeyError for unknown registers
+        """
+        if device_id != None and device_id != self.device_id:
+            raise KeyError('Unknown device {}'.format(device_id))
+        profile = self.register_map.profile
+        register_names = profile.names if register_names == None else register_names
+        for name in register_names:
+            if name not in profile:
+                raise KeyError('Unknown register {0} of {1}'.format(name, self.device_id))
+        max_age = config.ON_DEMAND_MAX_AGE if max_age == None else max_age
+
+        stale = self.value_cache.stale(register_names, max_age)
+        ON_DEMAND_REGISTERS.inc(('cache',), len(register_names) - len(stale))
+        if stale:
+            ON_DEMAND_REGISTERS.inc(('bus',), len(stale))
+            self.read_register_values(stale, profile.plan(stale), PRIORITY_ON_DEMAND, profile)
+        return self.value_cache.get(register_names)
 
     def write_register(self, register_name, value):
-        """ Writes to a coil or holding register
+        """ Writes to a coil or holding register right away. Holding register values are encoded with the 
+            data type, scale and offset of the register
         """
-        address = self.active_registers[register_name].address
-        type = self.active_registers[register_name].type
-        self.modbus_client.write_register(type, self.slave_id, address, value)
+        type, address, values = self._encode_write(register_name, value)
+        if len(values) == 1:
+            self.modbus_client.write_register(type, self.slave_id, address, values[0])
+        else:
+            self.modbus_client.write_registers(type, self.slave_id, address, values)
 
-    def _process_setting(self, key, value):
-        """ Writes the provided value to the specified register
+    def _encode_write(self, register_name, value):
+        """ Returns the (type, address, values) to write value to a register
         """
-        try:
-            if key in self.active_registers:
-                self.write_register(key, value)
+        register = self.register_map.profile.register(register_name)
+        if register.type in config.ACTIVE_REGISTERS_READONLY_TYPES:
+            raise InvalidRegisterTypeException(register.type)
+        if register.type == config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER:
+            return register.type, register.address, encode_value(register.format, value)
+        return register.type, register.address, [value]
+
+    def _process_setting(self, key, value, acknowledge=None):
+        """ Queues a write of the provided value to the specified register on the write pipeline, 
+            acknowledge is called with the outcome once written. Without acknowledge the write is done right away
+        """
+        if key not in self.register_map.profile:
             return ProcessDesiredTwinResponse()
-        except InvalidRegisterTypeException as e:
+        try:
+            type, address, values = self._encode_write(key, value)
+        except (InvalidRegisterTypeException, InvalidDataTypeException, struct.error, TypeError, ValueError) as e:
             self.logger.error(e)
-            return ProcessDesiredTwinResponse(400, e)
+            return ProcessDesiredTwinResponse(400, str(e))
+        if acknowledge != None:
+            self.write_pipeline.submit(type, address, values, lambda error: acknowledge(
+                ProcessDesiredTwinResponse() if error == None else ProcessDesiredTwinResponse(500, error)))
+            return None
+        try:
+            self.write_register(key, value)
+            return ProcessDesiredTwinResponse()
         except Exception as e:
             status_text = "Error has occured for {} in processing settings: {}.".format(self.device_id, e)
             self.logger.error(status_text)
             return ProcessDesiredTwinResponse(500, status_text)
  
-    def _get_register_payload_component(self, register_name):
-        """ Gets a payload component of the form: "register_name" : <value>
+    def _send_snapshot(self, values, aggregates):
+        """ Encodes the values and aggregates of one pass and sends them, or adds them to the pending batch
         """
-        address = self.active_registers[register_name].address
-        type = self.active_registers[register_name].type
-        value = self.modbus_client.read_register(type, self.slave_id, address)
-        return '"{0}":{1}'.format(register_name, value)
+        members = encode_members(values)
+        if aggregates:
+            members = ','.join(filter(None, [members, encode_members(dict(aggregates))]))
+        for payload in self.telemetry_batcher.add(members):
+            self.send_telemetry(payload)
 
     def _do_loop_actions(self):
-        if self._last_telemetry_sent == None:
-            self._last_telemetry_sent = int(time.time())
-        if int(time.time()) - self._last_telemetry_sent >= self.update_interval:
-            self.report_all_registers()
-            self._last_telemetry_sent = time.time()
+        """ Sends the writes that are due, polls and reports the groups that are due, earliest deadline first, 
+            then sends the aggregation windows that ended without a new sample
+        """
+        self.write_pipeline.flush()
+        register_map = self.register_map
+        now = time.time()
+        due = sorted((group for group in register_map.poll_groups if group.deadline <= now), key=lambda group: group.deadline)
+        for group in due:
+            self.report_registers(group.register_names, group.plan, register_map.profile)
+            group.advance()
+        self._send_snapshot({}, self.aggregator.collect())
+        self._report_health()
+        for payload in self.telemetry_batcher.flush():
+            self.send_telemetry(payload)
+
+    def _report_health(self):
+        """ Sends the health state of the slave when it changed since it was last sent
+        """
+        health = self.modbus_client.health_state(self.slave_id)
+        if health != self._reported_health:
+            self._send_snapshot({config.KEY_HEALTH: health}, [])
+            self._reported_health = health
+
+    def _cleanup(self):
+        self.write_pipeline.flush(force=True)
+        for payload in self.telemetry_batcher.flush(force=True):
+            self.send_telemetry(payload)
+
+    def _next_loop_delay(self):
+        deadlines = [group.deadline for group in self.register_map.poll_groups]
+        window_end = self.aggregator.next_window_end()
+        if window_end != None:
+            deadlines.append(window_end)
+        for delay in (self.telemetry_batcher.next_flush_delay(), self.write_pipeline.next_flush_delay()):
+            if delay != None:
+                deadlines.append(time.time() + delay)
+        if not deadlines:
+            return config.DEVICE_IDLE_INTERVAL
+        return max(0, min(deadlines) - time.time())
@@ -0,0 +1,152 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+
+import config
+from master_device import MasterDevice
+from register_profiles import load_profiles, slave_profile
+from relay_device import RelayDevice
+from shards import ShardProcess, expand_shards, partition_config
+
+
+class SupervisorDevice(MasterDevice):
+    """ Master of the supervisor mode: slaves are polled by one worker process per shard (a serial bus,
+        or a share of the Modbus TCP slaves), while this process holds every IoT Central connection.
+        The slaves config is split per shard and workers that exit are restarted
+    """
+
+    shards = None
+    relays = None
+
+    def __init__(self, scope_id, app_key, model_id, device_id, logger):
+        super(SupervisorDevice, self).__init__(scope_id, app_key, model_id, device_id, logger)
+        self.relays = {}
+        self.shard_configs = {}
+        self.shards = [ShardProcess(shard, device_id, logger, self._on_shard_message, self._on_shard_start)
+            for shard in expand_shards(config.SHARDS)]
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+        super(SupervisorDevice, self).start()
+
+    def stop(self):
+        # workers first, so the telemetry they send while stopping still has a connection to go to
+        for shard in self.shards:
+            shard.stop()
+        super(SupervisorDevice, self).stop()
+
+    def get_slave(self, device_id):
+        return self.relays.get(device_id)
+
+    def _create_modbus_client(self):
+        # the workers own the buses
+        return None
+
+    def _apply_bus_budget(self):
+        # every worker budgets its own bus
+        pass
+
+    def _init_slaves(self, config_json):
+        """ Reconciles the relays of the slaves with the config and sends every shard its share of the config.
+            The whole config is validated before any relay is touched. The workers acknowledge their share 
+            to this process, which logs the shards that failed to apply it
+        """
+        profiles = load_profiles(config_json, self.profiles)
+        shard_definitions = [shard.shard for shard in self.shards]
+        partitions = partition_config(config_json, shard_definitions)
+        shards = dict((shard.name, shard) for shard in self.shards)
+
+        current = dict((s.device_id, s) for s in self.slaves)
+        relays = []
+        added_configs = []
+        for shard_name, shard_config in partitions.items():
+            for slave_config in shard_config[config.CONFIG_KEY_SLAVES]:
+                device_id = slave_config[config.CONFIG_KEY_DEVICE_ID]
+                slave_id = slave_config[config.CONFIG_KEY_SLAVE_ID]
+                model_id = slave_profile(slave_config, profiles).model_id
+                relay = current.get(device_id)
+                if relay != None and relay.shard.name == shard_name and relay.model_id == model_id and \
+                   relay.slave_id == slave_id:
+                    del current[device_id]
+                    relays.append(relay)
+                else:
+                    added_configs.append((device_id, slave_id, model_id, shards[shard_name]))
+
+        new_relays = []
+        for device_id, slave_id, model_id, shard in added_configs:
+            client = self._create_slave_client(device_id)
+            new_relays.append(RelayDevice(
+                self.scope_id,
+                self.app_key,
+                model_id,
+                device_id,
+                self.device_id,
+                slave_id,
+                shard,
+                self.logger,
+                self.engine,
+                client,
+                self._slave_connector(client)))
+
+        removed_relays = list(current.values())
+        self.logger.info('Reconciled slaves of %s: %s kept, %s added, %s removed', self.device_id,
+            len(relays), len(new_relays), len(removed_relays))
+        for relay in removed_relays:
+            relay.stop()
+        self.slaves = relays + new_relays
+        self.relays = dict((relay.device_id, relay) for relay in self.slaves)
+        self.profiles = profiles
+        [relay.start() for relay in new_relays]
+        for shard in self.shards:
+            self.shard_configs[shard.name] = json.dumps(partitions[shard.name])
+            shard.send(('config', self.shard_configs[shard.name]))
+            self._forward_connection_states(shard)
+        if self.credential_cache != None:
+            self.credential_cache.save()
+
+    def _forward_connection_states(self, shard):
+        for relay in list(self.slaves):
+            if relay.shard is shard:
+                relay.forward_connection_state(force=True)
+
+    def _on_shard_start(self, shard):
+        """ Sends a (re)started worker its share of the config and the connection state of its slaves
+        """
+        for relay in list(self.slaves):
+            if relay.shard is shard:
+                relay.fail_pending_requests('Shard {} restarted'.format(shard.name))
+        shard_config = self.shard_configs.get(shard.name)
+        if shard_config != None:
+            shard.send(('config', shard_config))
+            self._forward_connection_states(shard)
+
+    def _on_shard_message(self, shard, message):
+        kind, device_id, payload = message
+        if kind == 'property' and device_id == self.device_id:
+            self._on_shard_config_acknowledged(shard, payload)
+            return
+        relay = self.get_slave(device_id)
+        if relay == None:
+            return
+        if kind == 'telemetry':
+            telemetry, created = payload
+            relay.send_telemetry(telemetry, created)
+        elif kind == 'property':
+            relay.on_worker_property(payload)
+        elif kind == 'values':
+            relay.on_worker_values(payload)
+
+    def _on_shard_config_acknowledged(self, shard, payload):
+        """ Logs the outcome of a worker applying its share of the slaves config. IoT Central got the 
+            acknowledgement of this process, which only covers splitting the config
+        """
+        reported = json.loads(payload).get(config.KEY_CONFIG)
+        if reported == None:
+            return
+        if reported.get('statusCode') != 200:
+            self.logger.error('Shard %s failed to apply the slaves config with %s: %s', shard.name, 
+                reported.get('statusCode'), reported.get('status'))
+        else:
+            self.logger.info('Shard %s applied the slaves config', shard.name)
@@ -3,28 +3,54 @@
 # full license information.
 
 import logging
+import signal
 import time
 import sys
 
 import config
 from devices.master_device import MasterDevice
+from devices.supervisor_device import SupervisorDevice
+from metrics_server import start_metrics_server
+
+_shutdown_requested = False
+
+def _on_shutdown_signal(signum, frame):
+    global _shutdown_requested
+    _shutdown_requested = True
+
+def _wait_for_shutdown():
+    """ Blocks the main thread until SIGINT or SIGTERM is received
+    """
+    signal.signal(signal.SIGINT, _on_shutdown_signal)
+    signal.signal(signal.SIGTERM, _on_shutdown_signal)
+    while not _shutdown_requested:
+        if hasattr(signal, 'pause'):
+            signal.pause()
+        else:
+            # signal.pause is not available on Windows
+            time.sleep(1)
 
 def main():
     logger = logging.getLogger()
     logging.basicConfig(format=config.LOGGING_FORMAT)
     logger.setLevel(config.GLOBAL_LOG_LEVEL)
 
-    master = MasterDevice(
+    master_class = SupervisorDevice if config.SHARDS else MasterDevice
+    master = master_class(
         config.CENTRAL_SCOPE_ID, 
         config.CENTRAL_APP_KEY, 
         config.MASTER_MODEL_ID,
         config.MASTER_DEVICE_ID,
         logger)
 
+    if config.METRICS_PORT != None:
+        start_metrics_server(logger, device=master)
+
     try:
         master.start()  
-        while True:
-            pass
+        _wait_for_shutdown()
+        logger.info('Shutdown requested, stopping gateway')
+        master.stop()
     except (Exception, KeyboardInterrupt) as e:
         logger.error('Error in IoT Edge runtime, exiting: %s', e)
         master.stop()
@@ -32,4 +58,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
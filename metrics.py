@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra != None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) 
+        for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value))
+
+class Counter(object):
+    """ Monotonic counter, one value per tuple of label values
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return ['{0}{1} {2}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(value)) 
+            for labels, value in values]
+
+class Gauge(Counter):
+    """ Value that can go up and down. With a collect function, the values are read from it on every 
+        scrape instead, collect returns a dict of label values tuple to value
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super(Gauge, self).__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.collect != None:
+            with self._lock:
+                self._values = dict(self.collect())
+        return super(Gauge, self).render()
+
+class Histogram(object):
+    """ Distribution of observed values in fixed buckets, one set of buckets per tuple of label values
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry == None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        with self._lock:
+            values = [(labels, list(entry)) for labels, entry in self._values.items()]
+        lines = []
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(self.name, 
+                    _format_labels(self.labelnames, labels, ('le', _format_value(bound))), cumulative))
+            lines.append('{0}_bucket{1} {2}'.format(self.name, 
+                _format_labels(self.labelnames, labels, ('le', '+Inf')), entry[-1]))
+            lines.append('{0}_sum{1} {2}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(entry[-2])))
+            lines.append('{0}_count{1} {2}'.format(self.name, _format_labels(self.labelnames, labels), entry[-1]))
+        return lines
+
+class MetricsRegistry(object):
+    """ Holds the metrics of the gateway and renders them in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """ Clears every metric and recreates the locks, for a process forked while other threads may have held them
+        """
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def _register(self, metric):
+        with self._lock:
+            # registering the same name again returns the existing metric so modules can be reloaded
+            existing = self._metrics.get(metric.name)
+            if existing != None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+REGISTRY = MetricsRegistry()
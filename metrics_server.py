@@ -0,0 +1,157 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import collections
+import socket
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+import config
+from metrics import REGISTRY
+from value_cache import encode_cached_values
+
+class SamplingProfiler(object):
+    """ Samples the stack of every thread at a fixed interval and counts identical stacks. 
+        Results are in the collapsed format read by flame graph tools
+    """
+
+    _active = False
+
+    def __init__(self, interval=None):
+        self.interval = config.PROFILER_INTERVAL if interval == None else interval
+        self._samples = collections.Counter()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._active:
+            return
+        with self._lock:
+            self._samples = collections.Counter()
+        self._active = True
+        self._thread = threading.Thread(target=self._sample, name='SamplingProfiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        if self._thread != None:
+            self._thread.join(1)
+            self._thread = None
+
+    def is_active(self):
+        return self._active
+
+    def collapsed(self):
+        """ Returns one line per distinct stack: frames separated by ; followed by the sample count
+        """
+        with self._lock:
+            samples = self._samples.most_common()
+        return '\n'.join('{0} {1}'.format(stack, count) for stack, count in samples) + '\n'
+
+    def _sample(self):
+        own_thread = threading.current_thread().ident
+        while self._active:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = ';'.join('{0}:{1}({2})'.format(entry[0].split('/')[-1], entry[2], entry[1]) 
+                    for entry in traceback.extract_stack(frame))
+                with self._lock:
+                    self._samples[stack] += 1
+            time.sleep(self.interval)
+
+PROFILER = SamplingProfiler()
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    # an on-demand read waiting for the bus must not hold up scrapes
+    daemon_threads = True
+    device = None
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """ GET /metrics: Prometheus metrics
+        GET /profiler/start, /profiler/stop: switches the sampling profiler on or off
+        GET /profiler: samples collected since the profiler was last started
+        GET /values/<deviceId>?registers=<name>,<name>&maxAge=<seconds>: last known values of the registers 
+        of a slave, all registers by default, see SlaveDevice.read_values
+    """
+
+    def do_GET(self):
+        if self.path.startswith('/values/'):
+            self._reply_values()
+        elif self.path == '/metrics':
+            self._reply(REGISTRY.render(), 'text/plain; version=0.0.4')
+        elif self.path == '/profiler/start':
+            PROFILER.start()
+            self._reply('profiler started\n')
+        elif self.path == '/profiler/stop':
+            PROFILER.stop()
+            self._reply('profiler stopped\n')
+        elif self.path == '/profiler':
+            self._reply(PROFILER.collapsed())
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        # scrapes are frequent, keep them out of the gateway log
+        pass
+
+    def _reply_values(self):
+        if self.server.device == None:
+            self.send_error(404)
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        device_id = url.path[len('/values/'):]
+        register_names = query['registers'][0].split(',') if 'registers' in query else None
+        try:
+            max_age = float(query['maxAge'][0]) if 'maxAge' in query else None
+            values = self.server.device.read_values(register_names, max_age, device_id)
+        except ValueError as e:
+            self._reply('{}\n'.format(e), status_code=400)
+            return
+        except KeyError as e:
+            self._reply('{}\n'.format(e.args[0] if e.args else e), status_code=404)
+            return
+        except Exception as e:
+            self._reply('{}\n'.format(e), status_code=500)
+            return
+        self._reply(encode_cached_values(values), 'application/json')
+
+    def _reply(self, body, content_type='text/plain', status_code=200):
+        body = body.encode('utf8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(logger, host=None, port=None, device=None):
+    """ Serves the metrics endpoint on a background thread, returns the server. The register values 
+        of the slaves of device, the master, are served on /values. Returns None if the port cannot be 
+        listened on, the gateway then runs without metrics
+    """
+    host = config.METRICS_HOST if host == None else host
+    port = config.METRICS_PORT if port == None else port
+    try:
+        server = _MetricsServer((host, port), _MetricsRequestHandler)
+    except socket.error as e:
+        logger.error('Cannot serve metrics on %s:%s, running without them: %s', host, port, e)
+        return None
+    server.device = device
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+    return server
@@ -4,21 +4,38 @@
 
 from random import randint
 import os
+import threading
+import time
 from pymodbus.client.sync import ModbusSerialClient
-from pymodbus.client.sync import ModbusTcpClient
-from pymodbus.exceptions import ModbusException
+from pymodbus.exceptions import ModbusException, ModbusIOException, ConnectionException, InvalidMessageReceivedException, \
+    TimeOutException
 from retrying import retry
 from abc import abstractmethod
 
 import config
+from metrics import REGISTRY
+from bus_arbiter import BusArbiter, PRIORITY_POLL, PRIORITY_WRITE
+from bus_trace import STATUS_OK, ReplayBus, TraceRecorder, read_trace, replay_response
+from slave_health import HEALTH_HEALTHY, HealthTracker
+from tcp_pool import TCPConnectionPool
 
 
+MODBUS_FAILED_ATTEMPTS = REGISTRY.counter('modbus_failed_attempts_total', 
+    'Failed Modbus request attempts, including the ones retried', ['error'])
+
 def _retry_if_modbus_exception(exception):
+    # called by retrying on every failed attempt
+    MODBUS_FAILED_ATTEMPTS.inc((type(exception).__name__,))
     return isinstance(exception, ModbusException)
 
+# Errors of a slave that did not answer or whose link is down, as opposed to exception responses. 
+# Only these count towards quarantining a slave
+LINK_ERRORS = (ModbusIOException, ConnectionException, InvalidMessageReceivedException, TimeOutException)
+
 class InvalidRegisterTypeException(Exception):
     def __init__(self, register_type):
         self.message = 'Invalid register type {}.'.format(register_type)
+        super(InvalidRegisterTypeException, self).__init__(self.message)
 
 class SimulatedModbusDeviceClient:
     """ Simulated Modbus client for testing, returns random values on reads and prints on writes
@@ -26,21 +43,37 @@ class SimulatedModbusDeviceClient:
     def __init__(self, method, port, timeout, baudrate):
         pass
     
-    def read_register(self, register_type, slave_id, address):
+    def read_register(self, register_type, slave_id, address, priority=PRIORITY_POLL):
         if register_type in config.ACTIVE_REGISTERS_BIT_TYPES:
             return randint(0, 1)
         else:
             return randint(0, 100)
 
+    def read_registers(self, register_type, slave_id, address, count, priority=PRIORITY_POLL):
+        return [self.read_register(register_type, slave_id, address + i) for i in range(count)]
+
     def write_register(self, register_type, slave_id, address, value):
         print 'simluate writing {} to slave {} address {}'.format(value, slave_id, address)
 
+    def write_registers(self, register_type, slave_id, address, values):
+        print 'simluate writing {} to slave {} from address {}'.format(values, slave_id, address)
+
+    def health_state(self, slave_id):
+        return HEALTH_HEALTHY
+
+    def close(self):
+        pass
+
 class ModbusDeviceClient(object):
     """ Static base class for common/read write methods
     """
 
+    health = None
+    # TraceRecorder of the requests sent on the bus, None when not recording
+    recorder = None
+
     @abstractmethod
-    def read_register(self, register_type, slave_id, address):
+    def read_register(self, register_type, slave_id, address, priority=PRIORITY_POLL):
         """ Read a register of specified type, slave id, address
         """
         pass
@@ -51,27 +84,85 @@ class ModbusDeviceClient(object):
         """
         pass
 
+    @abstractmethod
+    def read_registers(self, register_type, slave_id, address, count, priority=PRIORITY_POLL):
+        """ Read count consecutive registers of specified type, slave id, starting address
+        """
+        pass
+
+    @abstractmethod
+    def write_registers(self, register_type, slave_id, address, values):
+        """ Write values to consecutive coils (FC15) or holding registers (FC16) of specified slave id, starting address
+        """
+        pass
+
+    def close(self):
+        """ Release the underlying connections
+        """
+        pass
+
+    def record(self, path, mode, baudrate, logger):
+        """ Starts recording every request sent on the bus to the trace file path
+        """
+        self.recorder = TraceRecorder(path, mode, baudrate, logger, config.MODBUS_TRACE_MAX_BYTES)
+
+    def _bus(self, client, slave_id=None):
+        """ Returns the pymodbus client to send requests on, wrapped to record them while recording
+        """
+        return client if self.recorder == None else self.recorder.bus(client, slave_id)
+
+    def health_state(self, slave_id):
+        """ Returns the health state of a slave: healthy, quarantined after consecutive failures, or probing
+        """
+        return self.health.state(slave_id)
+
+    def _guard(self, slave_id, run, probe=None):
+        """ Returns run() unless slave_id is quarantined, in which case SlaveQuarantinedException is raised 
+            without touching the bus. When the next probe of a quarantined slave is due, probe() runs first 
+            and run() only if the probe succeeded
+        """
+        is_probe = self.health.acquire(slave_id)
+        try:
+            if is_probe and probe != None:
+                probe()
+            result = run()
+        except Exception as e:
+            if isinstance(e, LINK_ERRORS) or (is_probe and not isinstance(e, ModbusException)):
+                self.health.record_failure(slave_id)
+            elif isinstance(e, ModbusException):
+                # an exception response, e.g. for a misconfigured block, shows the slave is answering
+                self.health.record_success(slave_id)
+            raise
+        self.health.record_success(slave_id)
+        return result
+
     @staticmethod
     @retry(wait_fixed=config.MODBUS_RETRY_WAIT, retry_on_exception=_retry_if_modbus_exception, stop_max_attempt_number=config.MODBUS_RETRY_ATTEMPTS)
-    def _read_register(client, register_type, slave_id, address):
+    def _read_registers(client, register_type, slave_id, address, count):
+        return ModbusDeviceClient._read_registers_once(client, register_type, slave_id, address, count)
+
+    @staticmethod
+    def _read_registers_once(client, register_type, slave_id, address, count):
         if register_type == config.ACTIVE_REGISTERS_TYPE_COIL:
-            result = client.read_coils(address, unit=slave_id)
+            result = client.read_coils(address, count, unit=slave_id)
         elif register_type == config.ACTIVE_REGISTERS_TYPE_DISCRETE_INPUT:
-            result = client.read_discrete_inputs(address, unit=slave_id)
+            result = client.read_discrete_inputs(address, count, unit=slave_id)
         elif register_type == config.ACTIVE_REGISTERS_TYPE_INPUT_REGISTER:
-            result = client.read_input_registers(address, unit=slave_id)
+            result = client.read_input_registers(address, count, unit=slave_id)
         elif register_type == config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER:
-            result = client.read_holding_registers(address, unit=slave_id)
+            result = client.read_holding_registers(address, count, unit=slave_id)
         else: 
             raise InvalidRegisterTypeException(register_type)
 
         if result.isError():
-            raise result
+            # timeouts and connection errors are returned as exceptions, error responses are not
+            raise result if isinstance(result, ModbusException) else ModbusException('{}'.format(result))
         
+        # bit responses are padded to a whole number of bytes
         if register_type in config.ACTIVE_REGISTERS_BIT_TYPES:
-            return result.bits[0]
+            return result.bits[:count]
         else:
-            return result.registers[0]
+            return result.registers[:count]
 
     @staticmethod
     @retry(wait_fixed=config.MODBUS_RETRY_WAIT, retry_on_exception=_retry_if_modbus_exception, stop_max_attempt_number=config.MODBUS_RETRY_ATTEMPTS)
@@ -87,44 +178,201 @@ class ModbusDeviceClient(object):
             raise InvalidRegisterTypeException(register_type)
         
         if result.isError():
-            raise result
+            # timeouts and connection errors are returned as exceptions, error responses are not
+            raise result if isinstance(result, ModbusException) else ModbusException('{}'.format(result))
+
+    @staticmethod
+    @retry(wait_fixed=config.MODBUS_RETRY_WAIT, retry_on_exception=_retry_if_modbus_exception, stop_max_attempt_number=config.MODBUS_RETRY_ATTEMPTS)
+    def _write_registers(client, register_type, slave_id, address, values):
+        if register_type == config.ACTIVE_REGISTERS_TYPE_COIL:
+            result = client.write_coils(address, [bool(value) for value in values], unit=slave_id)
+        elif register_type == config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER:
+            result = client.write_registers(address, values, unit=slave_id)
+        else:
+            raise InvalidRegisterTypeException(register_type)
+
+        if result.isError():
+            raise result if isinstance(result, ModbusException) else ModbusException('{}'.format(result))
 
 class TCPModbusDeviceClient(ModbusDeviceClient):
-    """ Client for Modbus over TCP/IP. Creates connection on the first time 
-        communicating with a slave. Slave ID in this case is the IP address.
+    """ Client for Modbus over TCP/IP. Connections are taken from a pool with a few connections 
+        per slave, created on first use. Slave ID in this case is the IP address, requests are sent 
+        to unit MODBUS_TCP_UNIT_ID. Hosts that keep failing are quarantined and probed with single reads.
     """
 
-    cache = None
-    def __init__(self):
-        self.cache = dict()
+    pool = None
+    def __init__(self, logger):
+        self.pool = TCPConnectionPool(logger)
+        self.health = HealthTracker(logger)
         
-    def read_register(self, register_type, slave_id, address):
-        if slave_id not in self.cache:
-            self.cache[slave_id] = ModbusTcpClient(host=slave_id)
-            if not self.cache[slave_id].connect():
-                raise "Connection failed to {}".format(slave_id)
+    def read_register(self, register_type, slave_id, address, priority=PRIORITY_POLL):
+        return self.read_registers(register_type, slave_id, address, 1, priority)[0]
+
+    def read_registers(self, register_type, slave_id, address, count, priority=PRIORITY_POLL):
+        return self._guard(slave_id, 
+            lambda: self._call(slave_id, ModbusDeviceClient._read_registers, register_type, config.MODBUS_TCP_UNIT_ID, 
+                int(address), int(count)),
+            lambda: self._call(slave_id, ModbusDeviceClient._read_registers_once, register_type, config.MODBUS_TCP_UNIT_ID, 
+                int(address), 1))
+
+    def write_register(self, register_type, slave_id, address, value):
+        self._guard(slave_id, lambda: self._call(slave_id, ModbusDeviceClient._write_register, register_type, 
+            config.MODBUS_TCP_UNIT_ID, int(address), int(value)))
 
-        return ModbusDeviceClient._read_register(self.cache[slave_id], register_type, slave_id, address)
+    def write_registers(self, register_type, slave_id, address, values):
+        self._guard(slave_id, lambda: self._call(slave_id, ModbusDeviceClient._write_registers, register_type, 
+            config.MODBUS_TCP_UNIT_ID, int(address), [int(value) for value in values]))
 
-    def write_register(self, register_type, address, slave_id, value):
-        if slave_id not in self.cache:
-            self.cache[slave_id] = ModbusTcpClient(host=slave_id)
-            if not self.cache[slave_id].connect():
-                raise "Connection failed to {}".format(slave_id)
+    def close(self):
+        self.pool.close()
+        if self.recorder != None:
+            self.recorder.close()
 
-        ModbusDeviceClient._write_register(self.cache[slave_id], register_type, slave_id, address, value)
+    def _call(self, slave_id, function, *args):
+        """ Runs function on a pooled connection to slave_id, the connection is dropped on socket errors
+        """
+        client = self.pool.acquire(slave_id)
+        healthy = False
+        try:
+            result = function(self._bus(client, slave_id), *args)
+            healthy = True
+            return result
+        except ModbusException as e:
+            # protocol errors leave the connection usable
+            healthy = not isinstance(e, ConnectionException)
+            raise
+        finally:
+            self.pool.release(slave_id, client, healthy)
 
 class SerialModbusDeviceClient(ModbusDeviceClient):
-    """ Client for Modbus over Serial
+    """ Client for Modbus over Serial. All slaves share one line, so every transaction goes through 
+        a BusArbiter that serialises them by priority: writes, then on-demand reads, then polls. 
+        Slaves that keep failing are quarantined so they do not hold the bus with timeouts and retries.
     """
 
-    def __init__(self, method, port, timeout, baudrate):
+    def __init__(self, method, port, timeout, baudrate, logger):
         self.client = ModbusSerialClient(method=method, port=port, timeout=timeout, 
             baudrate=baudrate)
         self.client.connect()
+        self.arbiter = BusArbiter(logger, baudrate, port)
+        self.arbiter.start()
+        self.health = HealthTracker(logger)
+
+    def read_register(self, register_type, slave_id, address, priority=PRIORITY_POLL):
+        return self.read_registers(register_type, slave_id, address, 1, priority)[0]
 
-    def read_register(self, register_type, slave_id, address):
-        return ModbusDeviceClient._read_register(self.client, register_type, int(slave_id), int(address))
+    def read_registers(self, register_type, slave_id, address, count, priority=PRIORITY_POLL):
+        return self._guard(int(slave_id), 
+            lambda: self.arbiter.submit(priority, ModbusDeviceClient._read_registers, 
+                self._bus(self.client), register_type, int(slave_id), int(address), int(count)),
+            lambda: self.arbiter.submit(priority, ModbusDeviceClient._read_registers_once, 
+                self._bus(self.client), register_type, int(slave_id), int(address), 1))
     
     def write_register(self, register_type, slave_id, address, value):
-        ModbusDeviceClient._write_register(self.client, register_type, int(slave_id), int(address), int(value))
+        self._guard(int(slave_id), lambda: self.arbiter.submit(PRIORITY_WRITE, ModbusDeviceClient._write_register, 
+            self._bus(self.client), register_type, int(slave_id), int(address), int(value)))
+
+    def write_registers(self, register_type, slave_id, address, values):
+        self._guard(int(slave_id), lambda: self.arbiter.submit(PRIORITY_WRITE, ModbusDeviceClient._write_registers, 
+            self._bus(self.client), register_type, int(slave_id), int(address), [int(value) for value in values]))
+
+    def health_state(self, slave_id):
+        return self.health.state(int(slave_id))
+
+    def close(self):
+        self.arbiter.stop()
+        self.client.close()
+        if self.recorder != None:
+            self.recorder.close()
+
+class ReplayModbusDeviceClient(ModbusDeviceClient):
+    """ Client answering requests from a trace recorded with MODBUS_TRACE_PATH, with the recorded response times 
+        divided by speed (0 answers right away). Requests of a slave, function, address and count get the 
+        responses recorded for them in order, starting over once they run out. Retries, health tracking and, 
+        for traces of a serial bus, bus arbitration run as they do on a real bus
+    """
+
+    logger = None
+    arbiter = None
+
+    def __init__(self, path, logger, speed=None):
+        self.logger = logger
+        self.speed = float(config.MODBUS_REPLAY_SPEED if speed == None else speed)
+        trace = read_trace(path)
+        self.mode = trace.mode
+        self.baudrate = trace.baudrate
+        self.slave_ids = trace.slaves
+        self.health = HealthTracker(logger)
+        if self.mode == 1:
+            self.arbiter = BusArbiter(logger, trace.baudrate, 'replay')
+            self.arbiter.start()
+
+        # (slave id, function code, address, count) -> recorded responses, in order
+        self._responses = {}
+        for record in trace.records:
+            self._responses.setdefault((record.slave, record.function_code, record.address, record.count), []).append(record)
+        self._cursors = {}
+        self._missing = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        logger.info('Replaying %s requests to %s slaves from %s', len(trace.records), len(trace.slaves), path)
+
+    def read_register(self, register_type, slave_id, address, priority=PRIORITY_POLL):
+        return self.read_registers(register_type, slave_id, address, 1, priority)[0]
+
+    def read_registers(self, register_type, slave_id, address, count, priority=PRIORITY_POLL):
+        return self._guard(self._slave(slave_id), 
+            lambda: self._submit(priority, slave_id, ModbusDeviceClient._read_registers, register_type, 
+                self._unit(slave_id), int(address), int(count)),
+            lambda: self._submit(priority, slave_id, ModbusDeviceClient._read_registers_once, register_type, 
+                self._unit(slave_id), int(address), 1))
+
+    def write_register(self, register_type, slave_id, address, value):
+        self._guard(self._slave(slave_id), lambda: self._submit(PRIORITY_WRITE, slave_id, ModbusDeviceClient._write_register, 
+            register_type, self._unit(slave_id), int(address), int(value)))
+
+    def write_registers(self, register_type, slave_id, address, values):
+        self._guard(self._slave(slave_id), lambda: self._submit(PRIORITY_WRITE, slave_id, ModbusDeviceClient._write_registers, 
+            register_type, self._unit(slave_id), int(address), [int(value) for value in values]))
+
+    def health_state(self, slave_id):
+        return self.health.state(self._slave(slave_id))
+
+    def close(self):
+        if self.arbiter != None:
+            self.arbiter.stop()
+
+    def respond(self, slave_id, function_code, address, count):
+        """ Returns the next recorded response to a request after its recorded response time
+        """
+        key = ('{}'.format(slave_id), function_code, address, count)
+        with self._lock:
+            self.requests += 1
+            responses = self._responses.get(key)
+            if responses == None:
+                self.errors += 1
+                if key not in self._missing:
+                    self._missing.add(key)
+                    self.logger.warning('No recorded response of slave %s to function %s at %s count %s', *key)
+                return ModbusIOException('No recorded response')
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            record = responses[cursor % len(responses)]
+            if record.status != STATUS_OK:
+                self.errors += 1
+        if self.speed > 0:
+            time.sleep(record.duration / self.speed)
+        return replay_response(record)
+
+    def _slave(self, slave_id):
+        return int(slave_id) if self.mode == 1 else slave_id
+
+    def _unit(self, slave_id):
+        return int(slave_id) if self.mode == 1 else config.MODBUS_TCP_UNIT_ID
+
+    def _submit(self, priority, slave_id, function, *args):
+        if self.arbiter != None:
+            # serial slaves are told apart by their unit
+            return self.arbiter.submit(priority, function, ReplayBus(self), *args)
+        return function(ReplayBus(self, slave_id), *args)
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import threading
+import time
+
+import config
+from telemetry_encoder import compress_payload, creation_time_properties, message_creation_time, pack_fragments
+
+
+class MultiplexedClient(object):
+    """ Stands in for an iotc.Device of a slave in multiplexed mode. Telemetry is handed to the 
+        TelemetryMultiplexer and the connection state is the one of the gateway
+    """
+
+    def __init__(self, multiplexer, device_id):
+        self.multiplexer = multiplexer
+        self.device_id = device_id
+        self.callbacks = {}
+
+    def setLogLevel(self, log_level):
+        pass
+
+    def setModelData(self, model_data):
+        pass
+
+    def on(self, event, callback):
+        self.callbacks[event] = callback
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def isConnected(self):
+        return self.multiplexer.gateway_client.isConnected()
+
+    def doNext(self, idle_time=None):
+        pass
+
+    def sendTelemetry(self, payload, properties=None):
+        self.multiplexer.enqueue(self.device_id, payload, message_creation_time(properties))
+
+class TelemetryMultiplexer(object):
+    """ Carries the telemetry of every slave over the gateway's own IoT Central connection. 
+        Telemetry queued during a flush interval is sent as one message keyed by slave device id, 
+        later values of a register replacing earlier ones within the same interval. Slaves are split 
+        over several messages when they do not fit in TELEMETRY_MAX_MESSAGE_BYTES.
+    """
+
+    gateway_client = None
+    logger = None
+
+    def __init__(self, gateway_client, logger, flush_interval=None):
+        self.gateway_client = gateway_client
+        self.logger = logger
+        self.flush_interval = config.MULTIPLEX_FLUSH_INTERVAL if flush_interval == None else flush_interval
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def child_client(self, device_id):
+        """ Returns the client a slave device uses in place of its own IoT Central connection
+        """
+        return MultiplexedClient(self, device_id)
+
+    def enqueue(self, device_id, payload, created=None):
+        """ Queues a JSON telemetry payload of a slave until the next flush. Payloads polled earlier, at
+            created, are sent right away on their own with their creation time
+        """
+        if created != None:
+            message = '{{{0}:{1}}}'.format(json.dumps(device_id), payload)
+            self.gateway_client.sendTelemetry(compress_payload(message) if config.TELEMETRY_COMPRESSION else message,
+                creation_time_properties(created))
+            return
+        values = json.loads(payload)
+        with self._lock:
+            self._pending.setdefault(device_id, {}).update(values)
+
+    def next_flush_delay(self):
+        """ Seconds until the next flush is due
+        """
+        return max(0, self._last_flush + self.flush_interval - time.time())
+
+    def flush(self, force=False):
+        """ Sends the telemetry queued since the last flush if the flush interval has elapsed
+        """
+        if not force and self.next_flush_delay() > 0:
+            return
+        if not self.gateway_client.isConnected():
+            # slaves buffer their own telemetry while the gateway is offline
+            return
+        self._last_flush = time.time()
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        fragments = ['{0}:{1}'.format(json.dumps(device_id), json.dumps(values)) for device_id, values in pending.items()]
+        for message in pack_fragments(fragments, config.TELEMETRY_MAX_MESSAGE_BYTES, '{', '}'):
+            self.gateway_client.sendTelemetry(compress_payload(message) if config.TELEMETRY_COMPRESSION else message)
+
+    @staticmethod
+    def split_setting_key(key):
+        """ Splits a gateway setting name of the form <deviceId><separator><registerName>. 
+            Returns (None, key) if the setting is not routed to a slave
+        """
+        if config.MULTIPLEX_SETTING_SEPARATOR not in key:
+            return None, key
+        return tuple(key.split(config.MULTIPLEX_SETTING_SEPARATOR, 1))
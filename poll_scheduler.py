@@ -0,0 +1,106 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import math
+import time
+import zlib
+
+import config
+from bus_arbiter import silent_interval
+from read_planner import plan_reads
+
+# Size in bytes of an RTU read request: unit, function, address, count, CRC
+READ_REQUEST_BYTES = 8
+# Size in bytes of an RTU read response without data: unit, function, byte count, CRC
+READ_RESPONSE_OVERHEAD_BYTES = 5
+
+class PollGroup(object):
+    """ Registers of a slave polled together at the same interval. Each group keeps its own deadline, 
+        the interval is multiplied by stretch when the bus cannot keep up with every group
+    """
+    __slots__ = ['interval', 'priority', 'register_names', 'plan', 'deadline', 'stretch']
+
+    def __init__(self, interval, priority, register_names, plan):
+        self.interval = interval
+        self.priority = priority
+        self.register_names = register_names
+        self.plan = plan
+        self.deadline = None
+        self.stretch = 1.0
+
+    def period(self):
+        return self.interval * self.stretch
+
+    def start(self, key, now=None):
+        """ Sets the first deadline at a phase offset derived from key, so groups of different slaves 
+            with the same interval are spread over the interval instead of firing together
+        """
+        now = time.time() if now == None else now
+        phase = (zlib.crc32(key.encode('utf8')) & 0xffffffff) % 1000 / 1000.0
+        self.deadline = now + phase * self.period()
+
+    def advance(self, now=None):
+        """ Moves the deadline one period on, skipping periods that were missed entirely
+        """
+        now = time.time() if now == None else now
+        period = self.period()
+        self.deadline += period
+        if self.deadline <= now:
+            self.deadline += math.ceil((now - self.deadline) / period) * period
+
+def build_poll_groups(registers, default_interval, read_gap=None):
+    """ Groups registers by poll interval and priority. 
+        registers is an iterable of (register_name, address, register_type, width, poll_interval, priority) 
+        tuples, poll_interval None meaning default_interval
+    """
+    members = {}
+    for name, address, register_type, width, poll_interval, priority in registers:
+        interval = default_interval if poll_interval == None else poll_interval
+        members.setdefault((interval, priority or 0), []).append((name, address, register_type, width))
+    return [PollGroup(interval, priority, [entry[0] for entry in group], plan_reads(group, read_gap)) 
+        for (interval, priority), group in sorted(members.items())]
+
+def transaction_time(block, baudrate):
+    """ Estimated bus time in seconds of one RTU block read: both frames at 11 bits per character, 
+        the silent interval after each frame and the slave turnaround time
+    """
+    if block.type in config.ACTIVE_REGISTERS_BIT_TYPES:
+        data_bytes = (block.count + 7) // 8
+    else:
+        data_bytes = 2 * block.count
+    frame_bytes = READ_REQUEST_BYTES + READ_RESPONSE_OVERHEAD_BYTES + data_bytes
+    return frame_bytes * 11.0 / baudrate + 2 * silent_interval(baudrate) + config.MODBUS_TURNAROUND
+
+def group_load(group, baudrate):
+    """ Fraction of the bus the group uses when polled at its configured interval
+    """
+    return sum(transaction_time(block, baudrate) for block in group.plan) / group.interval
+
+def apply_bus_budget(groups, baudrate, max_utilisation=None):
+    """ Fits the poll groups of every slave on a bus within max_utilisation of its capacity. 
+        Priority levels are served in order, 0 first. The first level that does not fit and every 
+        level after it have their intervals stretched, up to BUS_MAX_STRETCH, instead of letting 
+        every deadline slip. Returns (configured load, load after stretching)
+    """
+    max_utilisation = config.BUS_MAX_UTILISATION if max_utilisation == None else max_utilisation
+    levels = {}
+    for group in groups:
+        levels.setdefault(group.priority, []).append(group)
+
+    budget = max_utilisation
+    configured = 0.0
+    effective = 0.0
+    for priority in sorted(levels.keys()):
+        load = sum(group_load(group, baudrate) for group in levels[priority])
+        configured += load
+        if load <= budget:
+            stretch = 1.0
+        elif budget > 0:
+            stretch = min(load / budget, config.BUS_MAX_STRETCH)
+        else:
+            stretch = config.BUS_MAX_STRETCH
+        for group in levels[priority]:
+            group.stretch = stretch
+        budget = max(0.0, budget - load / stretch)
+        effective += load / stretch
+    return configured, effective
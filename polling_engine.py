@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import itertools
+import threading
+
+import config
+from scheduler import Scheduler
+
+
+class PollingEngine(object):
+    """ Runs the loop of many devices on a small, fixed pool of worker threads. 
+        Each device loop pass is a call on the Scheduler, due when the device next needs to run, 
+        so idle devices cost nothing and poll timing does not depend on how many devices are running.
+    """
+
+    logger = None
+    scheduler = None
+
+    def __init__(self, logger, worker_count=None, idle_time=None):
+        self.logger = logger
+        self.idle_time = config.POLLING_ENGINE_IDLE if idle_time == None else idle_time
+        worker_count = config.POLLING_ENGINE_WORKERS if worker_count == None else worker_count
+        self.scheduler = Scheduler(logger, worker_count, 'PollingEngine')
+
+        # device id -> (token, ScheduledCall) of its single pending loop pass
+        self._calls = {}
+        self._tokens = itertools.count()
+        self._running = set()
+        self._wake_requested = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts the worker threads
+        """
+        self.logger.info('Starting polling engine with %s workers', self.scheduler.worker_count)
+        self.scheduler.start()
+
+    def stop(self):
+        """ Stops the worker threads, devices still scheduled are dropped
+        """
+        self.logger.info('Stopping polling engine')
+        self.scheduler.stop()
+        with self._lock:
+            self._calls = {}
+
+    def add(self, device, delay=0):
+        """ Schedules the device loop to run after delay seconds
+        """
+        with self._lock:
+            self._schedule(device, delay)
+
+    def remove(self, device):
+        """ Removes the device from the schedule, a loop pass already running is allowed to finish
+        """
+        with self._lock:
+            entry = self._calls.pop(id(device), None)
+            self._wake_requested.discard(id(device))
+        if entry != None:
+            entry[1].cancel()
+
+    def wake(self, device):
+        """ Runs the device loop as soon as possible instead of waiting for its next deadline
+        """
+        with self._lock:
+            if id(device) in self._running:
+                # reschedule immediately when the running loop pass completes
+                self._wake_requested.add(id(device))
+                return
+            entry = self._calls.get(id(device))
+            if entry == None:
+                return
+            entry[1].cancel()
+            self._schedule(device, 0)
+
+    def _schedule(self, device, delay):
+        token = next(self._tokens)
+        call = self.scheduler.call_later(delay, self._run, device, token)
+        self._calls[id(device)] = (token, call)
+
+    def _run(self, device, token):
+        with self._lock:
+            entry = self._calls.get(id(device))
+            if entry == None or entry[0] != token:
+                # removed or superseded by a wake up after this call was already due
+                return
+            del self._calls[id(device)]
+            self._running.add(id(device))
+        try:
+            delay = max(device._loop_once(0), self.idle_time)
+        except Exception as e:
+            self.logger.error('Loop pass failed for %s: %s', device.device_id, e)
+            delay = self.idle_time
+        with self._lock:
+            self._running.discard(id(device))
+            if id(device) in self._wake_requested:
+                self._wake_requested.discard(id(device))
+                delay = 0
+            if device._active:
+                self._schedule(device, delay)
@@ -0,0 +1,99 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+CACHE_VERSION = 1
+
+class ProvisioningCache(object):
+    """ On-disk cache of derived device keys and the last accepted slaves config, so a restarted 
+        gateway can resume polling without waiting for the config twin. The file is signed with the 
+        app key: a corrupted or tampered file, or one written for another app key, is discarded.
+    """
+
+    logger = None
+
+    def __init__(self, path, app_key, logger):
+        self.path = path
+        self.app_key = app_key
+        self.logger = logger
+
+        self._device_keys = {}
+        self._slaves_config = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def device_key(self, device_id, compute):
+        """ Returns the cached key of device_id, computing it with compute(app_key, device_id) on a miss
+        """
+        with self._lock:
+            key = self._device_keys.get(device_id)
+            if key == None:
+                key = compute(self.app_key, device_id)
+                self._device_keys[device_id] = key
+                self._dirty = True
+            return str(key)
+
+    def get_slaves_config(self):
+        """ Returns the last accepted slaves config string, or None
+        """
+        return self._slaves_config
+
+    def set_slaves_config(self, value):
+        """ Records an accepted slaves config and writes the cache to disk
+        """
+        with self._lock:
+            self._slaves_config = value
+            self._dirty = True
+        self.save()
+
+    def save(self):
+        """ Writes the cache to disk if it changed, replacing the previous file atomically
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            body = {
+                'version': CACHE_VERSION,
+                'deviceKeys': self._device_keys,
+                'slavesConfig': self._slaves_config
+            }
+            self._dirty = False
+        content = {'body': body, 'signature': self._sign(body)}
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(content, cache_file)
+            if os.name == 'nt' and os.path.exists(self.path):
+                # rename does not replace existing files on Windows
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            self.logger.error('Failed to write provisioning cache %s: %s', self.path, e)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as cache_file:
+                content = json.load(cache_file)
+            body = content['body']
+            if not hmac.compare_digest(str(content['signature']), self._sign(body)):
+                self.logger.info('Discarding provisioning cache %s, signature does not match the app key', self.path)
+                return
+            if body.get('version') != CACHE_VERSION:
+                return
+            self._device_keys = body.get('deviceKeys') or {}
+            self._slaves_config = body.get('slavesConfig')
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.error('Discarding unreadable provisioning cache %s: %s', self.path, e)
+
+    def _sign(self, body):
+        canonical = json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf8')
+        return hmac.new(base64.b64decode(self.app_key), msg=canonical, digestmod=hashlib.sha256).hexdigest()
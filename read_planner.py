@@ -0,0 +1,57 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+from collections import namedtuple
+
+import config
+
+# A single Modbus request covering count registers/bits starting at address. 
+# fields is a tuple of (register_name, offset) pairs to split the response back into named values.
+ReadBlock = namedtuple('ReadBlock', 'type address count fields')
+
+def max_read_count(register_type):
+    """ Returns the protocol limit for a single read of the given register type
+    """
+    if register_type in config.ACTIVE_REGISTERS_BIT_TYPES:
+        return config.MODBUS_MAX_READ_BITS
+    return config.MODBUS_MAX_READ_REGISTERS
+
+def plan_reads(registers, max_gap=None):
+    """ Groups registers into as few block reads as possible.
+
+        registers is an iterable of (register_name, address, register_type, width) tuples, width being the 
+        number of consecutive addresses the value spans. Registers of the same type are merged into one 
+        block when the hole between them is at most max_gap addresses and the block stays within the 
+        protocol limit for that type.
+    """
+    max_gap = config.MODBUS_READ_MAX_GAP if max_gap == None else int(max_gap)
+
+    by_type = {}
+    for name, address, register_type, width in registers:
+        by_type.setdefault(register_type, []).append((int(address), int(width), name))
+
+    blocks = []
+    for register_type in sorted(by_type.keys()):
+        limit = max_read_count(register_type)
+        start = None
+        end = None
+        fields = []
+        for address, width, name in sorted(by_type[register_type]):
+            last = address + width - 1
+            if start != None and address - end - 1 <= max_gap and last - start < limit:
+                end = max(end, last)
+                fields.append((name, address - start))
+                continue
+            if start != None:
+                blocks.append(ReadBlock(register_type, start, end - start + 1, tuple(fields)))
+            start = address
+            end = last
+            fields = [(name, 0)]
+        if start != None:
+            blocks.append(ReadBlock(register_type, start, end - start + 1, tuple(fields)))
+    return blocks
+
+def split_block(block, values):
+    """ Maps the raw values returned for a block read back to register names
+    """
+    return dict((name, values[offset]) for name, offset in block.fields)
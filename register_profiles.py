@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+from array import array
+from collections import namedtuple
+
+import config
+from aggregator import parse_aggregation_policy
+from data_types import BlockDecoder, parse_register_format, register_width
+from poll_scheduler import PollGroup, build_poll_groups
+from read_planner import plan_reads
+from report_filter import parse_report_policy
+
+# Name of the profile holding the top level register map of a slaves config, used by slaves without a profile
+DEFAULT_PROFILE = ''
+
+# Settings of a profile, those it does not set are taken from the top level of the slaves config
+PROFILE_KEYS = [config.CONFIG_KEY_MODEL_ID, config.CONFIG_KEY_UPDATE_INTERVAL, config.CONFIG_KEY_READ_GAP,
+    config.CONFIG_KEY_ACTIVE_REGISTERS]
+
+ActiveRegister = namedtuple('ActiveRegister', 'address type format')
+
+class RegisterProfile(object):
+    """ Register map of a device model, compiled once and shared by every slave using it. Registers are
+        kept in tables indexed by position, equal formats share a single object, and the read plans of
+        the whole map and of every poll group are planned with their block decoders up front.
+        Slaves only keep their own poll deadlines, last published values and aggregation windows
+    """
+    __slots__ = ['name', 'key', 'model_id', 'update_interval', 'read_gap', 'names', 'index', 'addresses', 'types',
+        'formats', 'widths', 'read_registers', 'report_policies', 'aggregation_policies', 'read_plan', 'poll_groups',
+        '_decoders']
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.key = json.dumps(definition, sort_keys=True)
+        self.model_id = definition[config.CONFIG_KEY_MODEL_ID] or ''
+        update_interval = definition[config.CONFIG_KEY_UPDATE_INTERVAL]
+        self.update_interval = 2 if update_interval == None else update_interval
+        self.read_gap = definition[config.CONFIG_KEY_READ_GAP]
+        active_registers = definition[config.CONFIG_KEY_ACTIVE_REGISTERS]
+        if active_registers == None:
+            raise KeyError('Profile {0} has no {1}'.format(name, config.CONFIG_KEY_ACTIVE_REGISTERS))
+
+        names = []
+        types = []
+        formats = []
+        shared = {}
+        self.addresses = array('l')
+        self.widths = array('B')
+        self.report_policies = {}
+        self.aggregation_policies = {}
+        poll_registers = []
+        for active_register in active_registers:
+            register_name = active_register[config.ACTIVE_REGISTERS_KEY_REGISTER_NAME]
+            address = int(active_register[config.ACTIVE_REGISTERS_KEY_ADDRESS])
+            type = active_register[config.ACTIVE_REGISTERS_KEY_TYPE]
+            type = shared.setdefault(type, type)
+            register_format = parse_register_format(active_register)
+            register_format = shared.setdefault(register_format, register_format)
+            width = 1 if type in config.ACTIVE_REGISTERS_BIT_TYPES else register_width(register_format)
+            names.append(register_name)
+            types.append(type)
+            formats.append(register_format)
+            self.addresses.append(address)
+            self.widths.append(width)
+            report_policy = parse_report_policy(active_register)
+            if report_policy != None:
+                self.report_policies[register_name] = report_policy
+            aggregation_policy = parse_aggregation_policy(active_register)
+            if aggregation_policy != None:
+                self.aggregation_policies[register_name] = aggregation_policy
+            poll_registers.append((register_name, address, type, width, active_register.get(config.ACTIVE_REGISTERS_KEY_POLL_INTERVAL),
+                active_register.get(config.ACTIVE_REGISTERS_KEY_PRIORITY)))
+
+        self.names = tuple(names)
+        self.index = dict((name, position) for position, name in enumerate(names))
+        self.types = tuple(types)
+        self.formats = tuple(formats)
+        self.read_registers = tuple(name for name, type in zip(names, types)
+            if type in config.ACTIVE_REGISTERS_READONLY_TYPES)
+        self.read_plan = plan_reads([entry[:4] for entry in poll_registers], self.read_gap)
+        self.poll_groups = build_poll_groups(poll_registers, self.update_interval, self.read_gap)
+        self._decoders = {}
+        for block in self.read_plan + [block for group in self.poll_groups for block in group.plan]:
+            self._decoders[block] = self._compile_decoder(block)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.names)
+
+    def register(self, name):
+        """ Returns the ActiveRegister of a register name, raises KeyError for unknown names
+        """
+        position = self.index[name]
+        return ActiveRegister(self.addresses[position], self.types[position], self.formats[position])
+
+    def plan(self, register_names):
+        """ Returns the read plan of the given registers, the precomputed one for the whole register map
+        """
+        if len(register_names) == len(self.names) and set(register_names) == set(self.names):
+            return self.read_plan
+        registers = []
+        for name in register_names:
+            position = self.index[name]
+            registers.append((name, self.addresses[position], self.types[position], self.widths[position]))
+        return plan_reads(registers, self.read_gap)
+
+    def decoder(self, block):
+        """ Returns the decoder of a block of this register map. Blocks of the read plans of the profile have 
+            theirs compiled up front, blocks of other plans (on-demand reads of arbitrary registers) get one 
+            compiled for the read, which is not kept
+        """
+        decoder = self._decoders.get(block)
+        if decoder == None:
+            decoder = self._compile_decoder(block)
+        return decoder
+
+    def _compile_decoder(self, block):
+        return BlockDecoder(block, dict((name, self.formats[self.index[name]]) for name, _ in block.fields))
+
+    def new_poll_groups(self):
+        """ Returns poll groups of a slave: they share the register names and plans of the profile
+            and have their own deadlines
+        """
+        return [PollGroup(group.interval, group.priority, group.register_names, group.plan) for group in self.poll_groups]
+
+def load_profiles(config_json, previous=None):
+    """ Compiles the register map profiles used by the slaves of a config: entries of profiles, and the
+        top level register map as DEFAULT_PROFILE. Returns a dict of profile name to profile. Profiles of
+        previous whose definition did not change are reused as they are. Raises KeyError for unknown profiles
+    """
+    definitions = config_json.get(config.CONFIG_KEY_PROFILES) or {}
+    previous = previous or {}
+    profiles = {}
+    for slave_config in config_json[config.CONFIG_KEY_SLAVES]:
+        name = slave_config.get(config.CONFIG_KEY_PROFILE, DEFAULT_PROFILE)
+        if name in profiles:
+            continue
+        if name == DEFAULT_PROFILE:
+            definition = {}
+        elif name in definitions:
+            definition = definitions[name]
+        else:
+            raise KeyError('Unknown profile {0} of slave {1}'.format(name, slave_config[config.CONFIG_KEY_DEVICE_ID]))
+        definition = dict((key, definition.get(key, config_json.get(key))) for key in PROFILE_KEYS)
+        profile = previous.get(name)
+        if profile == None or profile.key != json.dumps(definition, sort_keys=True):
+            profile = RegisterProfile(name, definition)
+        profiles[name] = profile
+    return profiles
+
+def slave_profile(slave_config, profiles):
+    """ Returns the profile of a slave config among the profiles loaded from its config
+    """
+    return profiles[slave_config.get(config.CONFIG_KEY_PROFILE, DEFAULT_PROFILE)]
@@ -0,0 +1,84 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import threading
+import time
+from collections import namedtuple
+
+import config
+
+# Per register report-by-exception settings, None disables the corresponding check
+ReportPolicy = namedtuple('ReportPolicy', 'deadband deadband_percent min_interval max_silence')
+
+def parse_report_policy(active_register):
+    """ Reads the report-by-exception settings of an activeRegisters entry. 
+        Returns None when none are set, in which case the register is reported on every update
+    """
+    policy = ReportPolicy(
+        active_register.get(config.ACTIVE_REGISTERS_KEY_DEADBAND),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_DEADBAND_PERCENT),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_MIN_PUBLISH_INTERVAL),
+        active_register.get(config.ACTIVE_REGISTERS_KEY_MAX_SILENCE))
+    if all(setting == None for setting in policy):
+        return None
+    return policy
+
+class ReportFilter(object):
+    """ Last-value cache that decides which register values are worth publishing: 
+        values that moved past their deadband, or that have been silent for max_silence seconds
+    """
+
+    def __init__(self, policies):
+        self.policies = policies
+        # register name -> (last published value, time published)
+        self._last_published = {}
+        self._lock = threading.Lock()
+
+    def filter(self, values, now=None):
+        """ Returns the subset of the name to value dict that should be published and records it as published
+        """
+        now = time.time() if now == None else now
+        publish = {}
+        with self._lock:
+            for name, value in values.items():
+                if self._should_publish(name, value, now):
+                    publish[name] = value
+                    self._last_published[name] = (value, now)
+        return publish
+
+    def update_policies(self, policies):
+        """ Replaces the policies, keeping the last published values of registers that are still present
+        """
+        with self._lock:
+            self.policies = policies
+            for name in list(self._last_published.keys()):
+                if name not in policies:
+                    del self._last_published[name]
+
+    def reset(self):
+        """ Forgets the published values so the next update reports every register
+        """
+        with self._lock:
+            self._last_published = {}
+
+    def _should_publish(self, name, value, now):
+        policy = self.policies.get(name)
+        last = self._last_published.get(name)
+        if policy == None or last == None:
+            return True
+
+        last_value, last_time = last
+        elapsed = now - last_time
+        if policy.min_interval != None and elapsed < policy.min_interval:
+            return False
+        if policy.max_silence != None and elapsed >= policy.max_silence:
+            return True
+
+        if policy.deadband == None and policy.deadband_percent == None:
+            return value != last_value
+        change = abs(value - last_value)
+        if policy.deadband != None and change > policy.deadband:
+            return True
+        if policy.deadband_percent != None and change > abs(last_value) * policy.deadband_percent / 100.0:
+            return True
+        return False
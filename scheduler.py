@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+from metrics import REGISTRY
+
+_SCHEDULERS = weakref.WeakSet()
+
+SCHEDULER_PENDING = REGISTRY.gauge('scheduler_pending_calls', 'Calls waiting in the scheduler heap', ['scheduler'], 
+    collect=lambda: dict(((scheduler.name,), scheduler.pending()) for scheduler in list(_SCHEDULERS)))
+
+
+class ScheduledCall(object):
+    """ Handle for a callback scheduled on the Scheduler
+    """
+    __slots__ = ['deadline', 'sequence', 'callback', 'args', 'cancelled']
+
+    def __init__(self, deadline, sequence, callback, args):
+        self.deadline = deadline
+        self.sequence = sequence
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.sequence) < (other.deadline, other.sequence)
+
+    def cancel(self):
+        """ Prevents the callback from running if it has not started yet
+        """
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """ Timer subsystem built on a heap of deadlines. Worker threads sleep until the earliest 
+        deadline is due or a new, earlier call is scheduled, so an idle gateway does not burn CPU.
+    """
+
+    logger = None
+    workers = None
+
+    _active = False
+
+    def __init__(self, logger, worker_count=1, name='Scheduler'):
+        self.logger = logger
+        self.worker_count = worker_count
+        self.name = name
+        self.workers = []
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        _SCHEDULERS.add(self)
+
+    def start(self):
+        """ Starts the worker threads
+        """
+        self._active = True
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._work, name='{}-{}'.format(self.name, i))
+            thread.daemon = True
+            thread.start()
+            self.workers.append(thread)
+
+    def stop(self):
+        """ Stops the worker threads, pending calls are dropped
+        """
+        with self._condition:
+            self._active = False
+            self._heap = []
+            self._condition.notify_all()
+        for thread in self.workers:
+            if thread is not threading.current_thread():
+                thread.join(1)
+        self.workers = []
+
+    def call_at(self, deadline, callback, *args):
+        """ Schedules callback(*args) to run at the given time.time() deadline
+        """
+        with self._condition:
+            call = ScheduledCall(deadline, next(self._counter), callback, args)
+            heapq.heappush(self._heap, call)
+            # only the earliest deadline can shorten a worker's sleep
+            if self._heap[0] is call:
+                self._condition.notify()
+            return call
+
+    def call_later(self, delay, callback, *args):
+        """ Schedules callback(*args) to run after delay seconds
+        """
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def pending(self):
+        """ Number of calls waiting in the heap, including cancelled ones not yet discarded
+        """
+        return len(self._heap)
+
+    def _next_due(self):
+        """ Blocks until a call is due and returns it, or None when the scheduler is stopped
+        """
+        with self._condition:
+            while self._active:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                call = self._heap[0]
+                if call.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                wait = call.deadline - time.time()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                return heapq.heappop(self._heap)
+            return None
+
+    def _work(self):
+        while self._active:
+            call = self._next_due()
+            if call == None:
+                return
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                self.logger.error('Scheduled call %s failed: %s', call.callback, e)
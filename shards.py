@@ -0,0 +1,349 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+
+import config
+from metrics import REGISTRY
+from telemetry_encoder import message_creation_time
+
+# Settings of a shard applied to config in its worker process
+SHARD_SETTINGS = {
+    'mode': 'MODBUS_MODE',
+    'serialPort': 'SERIAL_PORT',
+    'baudRate': 'BAUD_RATE',
+    'method': 'MODBUS_METHOD',
+    'timeout': 'MODBUS_CLIENT_TIMEOUT',
+    'tcpPort': 'MODBUS_TCP_PORT',
+    'tracePath': 'MODBUS_TRACE_PATH',
+    'replayPath': 'MODBUS_REPLAY_PATH'
+}
+
+def expand_shards(shards):
+    """ Returns the shard definitions with every shard of N processes replaced by N shards named <name>-<index>.
+        Raises ValueError for serial shards of more than one process, as only one process can own a serial port
+    """
+    expanded = []
+    for shard in shards:
+        processes = shard.get('processes', 1)
+        if processes != 1 and shard.get('mode', config.MODBUS_MODE) != 2:
+            raise ValueError('Shard {0} is not a Modbus TCP shard and cannot run in {1} processes'.format(
+                shard['name'], processes))
+        if processes == 1:
+            expanded.append(dict(shard))
+            continue
+        for index in range(processes):
+            part = dict(shard)
+            part['name'] = '{0}-{1}'.format(shard['name'], index)
+            part['group'] = shard['name']
+            expanded.append(part)
+    for index, shard in enumerate(expanded):
+        shard['index'] = index
+    return expanded
+
+def assign_shard(slave_config, shards):
+    """ Returns the name of the shard polling a slave: the shard named by the slave config, or one of the
+        processes of that shard picked by a hash of the device id. Slaves without a shard go to the
+        Modbus TCP shards if there are any, else to the first shard. Raises KeyError for unknown shards
+    """
+    name = slave_config.get(config.CONFIG_KEY_SHARD)
+    if name != None:
+        candidates = [shard for shard in shards if shard['name'] == name or shard.get('group') == name]
+        if not candidates:
+            raise KeyError('Unknown shard {0} of slave {1}'.format(name, slave_config[config.CONFIG_KEY_DEVICE_ID]))
+    else:
+        candidates = [shard for shard in shards if shard.get('mode') == 2] or shards[:1]
+    key = slave_config[config.CONFIG_KEY_DEVICE_ID].encode('utf8')
+    return candidates[(zlib.crc32(key) & 0xffffffff) % len(candidates)]['name']
+
+def partition_config(config_json, shards):
+    """ Splits a slaves config in one config per shard holding the slaves of that shard.
+        Returns a dict of shard name to config
+    """
+    partitions = {}
+    for shard in shards:
+        partitions[shard['name']] = copy.deepcopy(config_json)
+        partitions[shard['name']][config.CONFIG_KEY_SLAVES] = []
+    for slave_config in config_json[config.CONFIG_KEY_SLAVES]:
+        partitions[assign_shard(slave_config, shards)][config.CONFIG_KEY_SLAVES].append(slave_config)
+    return partitions
+
+class SettingInfo(object):
+    """ Mirrors the callback info objects passed by iotc, for settings forwarded to a worker
+    """
+
+    def __init__(self, tag, payload):
+        self._tag = tag
+        self._payload = payload
+
+    def getTag(self):
+        return self._tag
+
+    def getPayload(self):
+        return self._payload
+
+    def getStatusCode(self):
+        return 0
+
+class ShardClient(object):
+    """ Stands in for an iotc.Device in a worker process. Telemetry and properties are sent to the
+        uplink process, which holds the IoT Central connections, and settings are received from it
+    """
+
+    def __init__(self, uplink, device_id):
+        self.uplink = uplink
+        self.device_id = device_id
+        self.callbacks = {}
+
+    def setLogLevel(self, log_level):
+        pass
+
+    def setModelData(self, model_data):
+        pass
+
+    def on(self, event, callback):
+        self.callbacks[event] = callback
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def isConnected(self):
+        return self.uplink.is_connected(self.device_id)
+
+    def doNext(self, idle_time=None):
+        pass
+
+    def sendTelemetry(self, payload, properties=None):
+        self.uplink.send(('telemetry', self.device_id, (payload, message_creation_time(properties))))
+
+    def sendProperty(self, payload):
+        self.uplink.send(('property', self.device_id, payload))
+
+    def fire(self, event, info):
+        callback = self.callbacks.get(event)
+        if callback != None:
+            callback(info)
+
+class ShardUplink(object):
+    """ Worker side of the pipe to the uplink process
+    """
+
+    logger = None
+
+    def __init__(self, connection, logger):
+        self.connection = connection
+        self.logger = logger
+        self.clients = {}
+        # device id -> connection state of its IoT Central connection in the uplink process
+        self._connected = {}
+        self._lock = threading.Lock()
+
+    def child_client(self, device_id):
+        """ Returns the client of a slave, connected while its connection in the uplink process is
+        """
+        client = ShardClient(self, device_id)
+        self.clients[device_id] = client
+        return client
+
+    def master_client(self, device_id):
+        """ Returns the client of the master of the worker, which receives the slaves config of the shard
+        """
+        self._connected[device_id] = True
+        return ShardClient(self, device_id)
+
+    def is_connected(self, device_id):
+        return self._connected.get(device_id, False)
+
+    def send(self, message):
+        with self._lock:
+            self.connection.send(message)
+
+    def serve(self, master):
+        """ Dispatches the messages of the uplink process until it asks to stop or goes away
+        """
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, IOError):
+                self.logger.warning('Uplink process went away')
+                return
+            kind = message[0]
+            if kind == 'stop':
+                return
+            elif kind == 'config':
+                master.client.fire('SettingsUpdated', SettingInfo(config.KEY_CONFIG,
+                    json.dumps({config.KEY_VERSION: message[1], config.KEY_DESIRED_VERSION: 0})))
+            elif kind == 'setting':
+                _, device_id, key, value = message
+                client = self.clients.get(device_id)
+                if client != None:
+                    client.fire('SettingsUpdated', SettingInfo(key,
+                        json.dumps({config.KEY_VERSION: value, config.KEY_DESIRED_VERSION: 0})))
+            elif kind == 'connected':
+                self._connected[message[1]] = message[2]
+            elif kind == 'read':
+                # on-demand reads wait for the bus, keep serving settings meanwhile
+                thread = threading.Thread(target=self._read_values, args=(master,) + tuple(message[1:]))
+                thread.daemon = True
+                thread.start()
+
+    def _read_values(self, master, device_id, request_id, register_names, max_age):
+        """ Answers an on-demand read of the uplink process
+        """
+        try:
+            values = master.read_values(register_names, max_age, device_id)
+            self.send(('values', device_id, (request_id, values, None, False)))
+        except Exception as e:
+            error = e.args[0] if e.args else str(e)
+            self.send(('values', device_id, (request_id, None, str(error), isinstance(e, KeyError))))
+
+def configure_worker(shard):
+    """ Applies the settings of a shard to config in its worker process
+    """
+    for key, name in SHARD_SETTINGS.items():
+        if key in shard:
+            setattr(config, name, shard[key])
+    config.DEVICE_LOOP_MODE = 1
+    # the uplink process caches keys and configs and acknowledges the slaves config
+    config.PROVISIONING_CACHE_PATH = None
+    if config.TELEMETRY_BUFFER_PATH != None:
+        # the master of the worker has the device id of the master of the uplink process, whose buffer it would drain
+        config.TELEMETRY_BUFFER_PATH = os.path.join(config.TELEMETRY_BUFFER_PATH, shard['name'])
+    if config.METRICS_PORT != None:
+        config.METRICS_PORT += 1 + shard['index']
+    if config.MODBUS_TRACE_PATH != None and 'tracePath' not in shard:
+        # every worker records its own bus
+        config.MODBUS_TRACE_PATH += '.' + shard['name']
+
+def run_shard(shard, connection, master_id):
+    """ Entry point of a worker process: polls the slaves of one shard on its own polling engine
+    """
+    # shutdown is driven by the uplink process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # other threads of the uplink process may have held these locks when it forked
+    for handler in logging.getLogger().handlers:
+        handler.createLock()
+    REGISTRY.reset()
+    configure_worker(shard)
+
+    logger = logging.getLogger()
+    from devices.shard_master_device import ShardMasterDevice
+    from metrics_server import start_metrics_server
+    if config.METRICS_PORT != None:
+        start_metrics_server(logger)
+    uplink = ShardUplink(connection, logger)
+    master = ShardMasterDevice(master_id, uplink, logger)
+    logger.info('Shard %s started', shard['name'])
+    master.start()
+    try:
+        uplink.serve(master)
+    finally:
+        master.stop()
+        logger.info('Shard %s stopped', shard['name'])
+
+class ShardProcess(object):
+    """ Uplink side of a worker process. A thread owns the process: it reads its messages and restarts
+        it with an exponential backoff when it dies
+    """
+
+    logger = None
+
+    def __init__(self, shard, master_id, logger, on_message, on_start):
+        self.shard = shard
+        self.name = shard['name']
+        self.master_id = master_id
+        self.logger = logger
+        self.on_message = on_message
+        self.on_start = on_start
+
+        self.process = None
+        self.restarts = 0
+        self._connection = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='shard-{}'.format(self.name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """ Asks the worker to stop its slaves, killing it if it does not exit within timeout seconds
+        """
+        self._stopping = True
+        self.send(('stop',))
+        process = self.process
+        if process != None:
+            process.join(timeout)
+            if process.is_alive():
+                self.logger.warning('Shard %s did not stop, terminating it', self.name)
+                process.terminate()
+        if self._thread != None:
+            self._thread.join(timeout)
+
+    def send(self, message):
+        """ Sends a message to the worker, messages sent while it is restarting are dropped
+        """
+        with self._lock:
+            if self._connection == None:
+                return False
+            try:
+                self._connection.send(message)
+                return True
+            except (IOError, EOFError, ValueError):
+                return False
+
+    def _run(self):
+        backoff = config.SHARD_RESTART_BACKOFF_MIN
+        while not self._stopping:
+            started = time.time()
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, name='shard-{}'.format(self.name),
+                args=(self.shard, child_connection, self.master_id))
+            process.daemon = True
+            process.start()
+            child_connection.close()
+            with self._lock:
+                self.process = process
+                self._connection = connection
+            self.logger.info('Started shard %s as process %s', self.name, process.pid)
+            self.on_start(self)
+
+            self._read(connection)
+            with self._lock:
+                self._connection = None
+            connection.close()
+            process.join()
+            if self._stopping:
+                break
+
+            # a worker that ran for a while starts over from the min backoff
+            if time.time() - started > config.SHARD_RESTART_BACKOFF_MAX:
+                backoff = config.SHARD_RESTART_BACKOFF_MIN
+            self.restarts += 1
+            self.logger.error('Shard %s exited with code %s, restarting in %ss', self.name, process.exitcode, backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, config.SHARD_RESTART_BACKOFF_MAX)
+
+    def _read(self, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, IOError):
+                return
+            try:
+                self.on_message(self, message)
+            except Exception as e:
+                self.logger.error('Failed to handle message of shard %s: %s', self.name, e)
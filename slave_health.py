@@ -0,0 +1,110 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import threading
+import time
+import weakref
+
+from pymodbus.exceptions import ModbusException
+
+import config
+from metrics import REGISTRY
+
+# Health states reported by the slaves
+HEALTH_HEALTHY = 'healthy'
+HEALTH_QUARANTINED = 'quarantined'
+HEALTH_PROBING = 'probing'
+
+_TRACKERS = weakref.WeakSet()
+
+SLAVE_HEALTH = REGISTRY.gauge('modbus_slave_quarantined', '1 while a slave is quarantined after consecutive failures', ['slave'],
+    collect=lambda: dict(((str(slave),), int(state != HEALTH_HEALTHY)) for tracker in list(_TRACKERS)
+        for slave, state in tracker.states().items()))
+SLAVE_REQUESTS_SKIPPED = REGISTRY.counter('modbus_requests_skipped_total', 'Requests not sent to quarantined slaves', ['slave'])
+
+class SlaveQuarantinedException(ModbusException):
+    def __init__(self, slave_id, retry_in):
+        super(SlaveQuarantinedException, self).__init__(
+            'Slave {0} is quarantined, next probe in {1:.1f}s'.format(slave_id, retry_in))
+
+class CircuitBreaker(object):
+    """ Health of a single slave: closed while it answers, open (quarantined) after failure_threshold
+        consecutive failures. Once the backoff has elapsed a single probe is let through, its success
+        closes the breaker and its failure doubles the backoff
+    """
+    __slots__ = ['state', 'failures', 'backoff', 'retry_at']
+
+    def __init__(self):
+        self.state = HEALTH_HEALTHY
+        self.failures = 0
+        self.backoff = 0
+        self.retry_at = 0
+
+class HealthTracker(object):
+    """ Circuit breakers of the slaves of a Modbus client, keyed by slave id (the host for Modbus TCP)
+    """
+
+    logger = None
+
+    def __init__(self, logger, failure_threshold=None, backoff_min=None, backoff_max=None):
+        self.logger = logger
+        self.failure_threshold = config.SLAVE_FAILURE_THRESHOLD if failure_threshold == None else failure_threshold
+        self.backoff_min = config.SLAVE_PROBE_BACKOFF_MIN if backoff_min == None else backoff_min
+        self.backoff_max = config.SLAVE_PROBE_BACKOFF_MAX if backoff_max == None else backoff_max
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+        _TRACKERS.add(self)
+
+    def acquire(self, slave_id, now=None):
+        """ Called before a request to slave_id. Returns True if the request is the probe of a quarantined
+            slave, False for a healthy slave. Raises SlaveQuarantinedException while the slave waits for its next probe
+        """
+        now = time.time() if now == None else now
+        with self._lock:
+            breaker = self._breakers.get(slave_id)
+            if breaker == None or breaker.state == HEALTH_HEALTHY:
+                return False
+            if breaker.state == HEALTH_QUARANTINED and now >= breaker.retry_at:
+                breaker.state = HEALTH_PROBING
+                return True
+            retry_in = max(0, breaker.retry_at - now)
+        SLAVE_REQUESTS_SKIPPED.inc((str(slave_id),))
+        raise SlaveQuarantinedException(slave_id, retry_in)
+
+    def record_success(self, slave_id):
+        with self._lock:
+            breaker = self._breakers.get(slave_id)
+            if breaker == None:
+                return
+            if breaker.state != HEALTH_HEALTHY:
+                self.logger.info('Slave %s answered its probe, resuming polling', slave_id)
+            del self._breakers[slave_id]
+
+    def record_failure(self, slave_id, now=None):
+        now = time.time() if now == None else now
+        with self._lock:
+            breaker = self._breakers.setdefault(slave_id, CircuitBreaker())
+            breaker.failures += 1
+            if breaker.state == HEALTH_HEALTHY and breaker.failures < self.failure_threshold:
+                return
+            if breaker.state == HEALTH_PROBING:
+                breaker.backoff = min(breaker.backoff * 2, self.backoff_max)
+            else:
+                breaker.backoff = self.backoff_min
+                self.logger.warning('Quarantining slave %s after %s consecutive failures', slave_id, breaker.failures)
+            breaker.state = HEALTH_QUARANTINED
+            breaker.retry_at = now + breaker.backoff
+
+    def state(self, slave_id):
+        """ Returns the health state of slave_id
+        """
+        with self._lock:
+            breaker = self._breakers.get(slave_id)
+            return HEALTH_HEALTHY if breaker == None else breaker.state
+
+    def states(self):
+        """ Returns a dict of slave id to health state of the slaves that failed since their last success
+        """
+        with self._lock:
+            return dict((slave_id, breaker.state) for slave_id, breaker in self._breakers.items())
@@ -0,0 +1,121 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import socket
+import threading
+import time
+
+from pymodbus.client.sync import ModbusTcpClient
+from pymodbus.exceptions import ConnectionException
+
+import config
+
+
+class _HostPool(object):
+    """ Connections and reconnect state of a single host
+    """
+    __slots__ = ['idle', 'in_use', 'failures', 'retry_at']
+
+    def __init__(self):
+        # (client, last used time) pairs, most recently used last
+        self.idle = []
+        self.in_use = 0
+        self.failures = 0
+        self.retry_at = 0
+
+class TCPConnectionPool(object):
+    """ Pool of Modbus TCP connections, up to max_connections per host so several transactions 
+        to the same host can be in flight at once. Idle connections are evicted, broken ones are 
+        discarded and reconnects to an unreachable host back off exponentially.
+    """
+
+    logger = None
+
+    def __init__(self, logger, max_connections=None, idle_timeout=None, port=None, timeout=None):
+        self.logger = logger
+        self.max_connections = config.TCP_POOL_MAX_CONNECTIONS if max_connections == None else max_connections
+        self.idle_timeout = config.TCP_POOL_IDLE_TIMEOUT if idle_timeout == None else idle_timeout
+        self.port = config.MODBUS_TCP_PORT if port == None else port
+        self.timeout = config.MODBUS_CLIENT_TIMEOUT if timeout == None else timeout
+
+        self._hosts = {}
+        self._condition = threading.Condition()
+        self._last_sweep = time.time()
+
+    def acquire(self, host):
+        """ Returns a connected client for host, blocks while all connections to host are in use. 
+            Raises ConnectionException if the host cannot be reached
+        """
+        with self._condition:
+            pool = self._hosts.setdefault(host, _HostPool())
+            while not pool.idle and pool.in_use >= self.max_connections:
+                self._condition.wait()
+            pool.in_use += 1
+            if pool.idle:
+                return pool.idle.pop()[0]
+            if time.time() < pool.retry_at:
+                pool.in_use -= 1
+                self._condition.notify()
+                raise ConnectionException('Backing off reconnect to {}'.format(host))
+
+        # connect outside the lock so one unreachable host does not stall the others
+        client = ModbusTcpClient(host=host, port=self.port, timeout=self.timeout)
+        connected = client.connect()
+        with self._condition:
+            if not connected:
+                pool.in_use -= 1
+                pool.failures += 1
+                backoff = min(config.TCP_RECONNECT_BACKOFF_MIN * 2 ** (pool.failures - 1), 
+                    config.TCP_RECONNECT_BACKOFF_MAX)
+                pool.retry_at = time.time() + backoff
+                self._condition.notify()
+                self.logger.error('Connection failed to %s, retrying in %ss', host, backoff)
+                raise ConnectionException('Connection failed to {}'.format(host))
+            pool.failures = 0
+            pool.retry_at = 0
+        self._set_keepalive(client)
+        return client
+
+    def release(self, host, client, healthy=True):
+        """ Returns a client to the pool, unhealthy clients are closed and discarded
+        """
+        with self._condition:
+            pool = self._hosts[host]
+            pool.in_use -= 1
+            if healthy:
+                pool.idle.append((client, time.time()))
+            else:
+                client.close()
+            self._evict_idle()
+            self._condition.notify()
+
+    def close(self):
+        """ Closes every idle connection, connections in use are closed when released
+        """
+        with self._condition:
+            for pool in self._hosts.values():
+                for client, _ in pool.idle:
+                    client.close()
+                pool.idle = []
+
+    def _evict_idle(self):
+        now = time.time()
+        if now - self._last_sweep < self.idle_timeout:
+            return
+        self._last_sweep = now
+        for host, pool in list(self._hosts.items()):
+            expired = [client for client, last_used in pool.idle if now - last_used >= self.idle_timeout]
+            pool.idle = [entry for entry in pool.idle if now - entry[1] < self.idle_timeout]
+            for client in expired:
+                client.close()
+            if not pool.idle and not pool.in_use and not pool.failures:
+                del self._hosts[host]
+
+    @staticmethod
+    def _set_keepalive(client):
+        sock = getattr(client, 'socket', None)
+        if sock != None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            except socket.error:
+                pass
@@ -0,0 +1,177 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import os
+import threading
+import time
+import weakref
+
+import config
+from metrics import REGISTRY
+
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+_BUFFERS = weakref.WeakSet()
+
+BUFFER_PENDING_BYTES = REGISTRY.gauge('telemetry_buffer_bytes', 'Bytes of telemetry buffered on disk', ['device'], 
+    collect=lambda: dict(((os.path.basename(b.directory),), b.pending_bytes()) for b in list(_BUFFERS)))
+
+class TelemetryBuffer(object):
+    """ Durable store-and-forward queue for telemetry that could not be sent. 
+        Payloads are appended as lines to segment files in a directory. Once the directory grows past 
+        max_bytes, whole segments are evicted oldest first. The read cursor is kept in a file so a 
+        restart resumes draining where it left off.
+    """
+
+    logger = None
+
+    def __init__(self, directory, logger, segment_bytes=None, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.logger = logger
+        self.segment_bytes = config.TELEMETRY_BUFFER_SEGMENT_BYTES if segment_bytes == None else segment_bytes
+        self.max_bytes = config.TELEMETRY_BUFFER_MAX_BYTES if max_bytes == None else max_bytes
+        self.max_age = config.TELEMETRY_BUFFER_MAX_AGE if max_age == None else max_age
+
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) 
+            if name.endswith(SEGMENT_SUFFIX))
+        self._truncate_partial_record()
+        self._sizes = dict((segment, os.path.getsize(self._segment_path(segment))) for segment in self._segments)
+        self._cursor = self._load_cursor()
+        _BUFFERS.add(self)
+
+    def is_empty(self):
+        """ True if there is nothing left to drain
+        """
+        with self._lock:
+            if not self._segments:
+                return True
+            segment, offset = self._cursor
+            return segment == self._segments[-1] and offset >= self._sizes[segment]
+
+    def pending_bytes(self):
+        """ Bytes of records not drained yet
+        """
+        with self._lock:
+            segment, offset = self._cursor
+            return sum(size for s, size in self._sizes.items() if s >= segment) - (offset if segment in self._sizes else 0)
+
+    def append(self, payload, timestamp=None):
+        """ Appends a payload polled at timestamp (now when None) to the newest segment, evicting the oldest 
+            segments when over max_bytes. The record is on disk when append returns
+        """
+        timestamp = time.time() if timestamp == None else timestamp
+        record = '{0:.3f}\t{1}\n'.format(timestamp, payload.replace('\n', ' '))
+        with self._lock:
+            if not self._segments or self._sizes[self._segments[-1]] >= self.segment_bytes:
+                segment = self._segments[-1] + 1 if self._segments else 0
+                self._segments.append(segment)
+                self._sizes[segment] = 0
+            segment = self._segments[-1]
+            with open(self._segment_path(segment), 'a') as segment_file:
+                segment_file.write(record)
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+            self._sizes[segment] += len(record)
+            self._evict()
+
+    def read(self, max_records):
+        """ Returns up to max_records (timestamp, payload) pairs from the read cursor and the cursor after them, 
+            timestamp being the time the payload was polled. Records older than max_age are skipped. 
+            Pass the returned cursor to commit once the payloads have been sent
+        """
+        payloads = []
+        with self._lock:
+            segment, offset = self._cursor
+            oldest = time.time() - self.max_age
+            while len(payloads) < max_records and segment in self._sizes:
+                if offset >= self._sizes[segment]:
+                    later = [s for s in self._segments if s > segment]
+                    if not later:
+                        break
+                    segment, offset = later[0], 0
+                    continue
+                with open(self._segment_path(segment)) as segment_file:
+                    segment_file.seek(offset)
+                    while len(payloads) < max_records:
+                        line = segment_file.readline()
+                        if not line.endswith('\n'):
+                            break
+                        offset += len(line)
+                        timestamp, payload = line.rstrip('\n').split('\t', 1)
+                        if float(timestamp) >= oldest:
+                            payloads.append((float(timestamp), payload))
+                if len(payloads) < max_records and offset < self._sizes[segment]:
+                    # a record cut short by a crash, skip it rather than read it again and again
+                    self.logger.warning('Skipping a partly written record of telemetry buffer %s', self.directory)
+                    offset = self._sizes[segment]
+        return payloads, (segment, offset)
+
+    def commit(self, cursor):
+        """ Advances the read cursor past sent records and deletes fully drained segments
+        """
+        with self._lock:
+            if cursor[0] not in self._sizes:
+                # the segment was evicted while its records were being sent
+                cursor = (self._segments[0], 0) if self._segments else (0, 0)
+            self._cursor = cursor
+            segment = cursor[0]
+            for drained in [s for s in self._segments if s < segment]:
+                self._delete_segment(drained)
+            self._save_cursor()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        while total > self.max_bytes and len(self._segments) > 1:
+            oldest = self._segments[0]
+            total -= self._sizes[oldest]
+            self.logger.error('Telemetry buffer %s is full, dropping segment %s', self.directory, oldest)
+            self._delete_segment(oldest)
+            if self._cursor[0] <= oldest:
+                self._cursor = (self._segments[0], 0)
+                self._save_cursor()
+
+    def _delete_segment(self, segment):
+        self._segments.remove(segment)
+        del self._sizes[segment]
+        try:
+            os.remove(self._segment_path(segment))
+        except OSError:
+            pass
+
+    def _truncate_partial_record(self):
+        """ Cuts a record left partly written by a crash off the newest segment, so appends start on a new line
+        """
+        if not self._segments:
+            return
+        with open(self._segment_path(self._segments[-1]), 'r+b') as segment_file:
+            data = segment_file.read()
+            if data and not data.endswith('\n'):
+                segment_file.truncate(data.rfind('\n') + 1)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, '{0:010d}{1}'.format(segment, SEGMENT_SUFFIX))
+
+    def _load_cursor(self):
+        default = (self._segments[0], 0) if self._segments else (0, 0)
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as cursor_file:
+                segment, offset = [int(part) for part in cursor_file.read().split()]
+        except (IOError, OSError, ValueError):
+            return default
+        if segment not in self._sizes:
+            return default
+        return segment, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as cursor_file:
+            cursor_file.write('{0} {1}'.format(self._cursor[0], self._cursor[1]))
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import base64
+import calendar
+import json
+import math
+import threading
+import time
+import zlib
+try:
+    from urllib import quote, unquote
+except ImportError:
+    from urllib.parse import quote, unquote
+
+import config
+
+def _encode_float(value):
+    if math.isnan(value) or math.isinf(value):
+        return 'null'
+    return repr(value)
+
+# Value types whose str() is not valid JSON, every other value is encoded with str()
+_ENCODERS = {
+    bool: lambda value: 'true' if value else 'false',
+    float: _encode_float,
+    type(None): lambda value: 'null',
+    str: json.dumps,
+    type(u''): json.dumps
+}
+
+# Raises ValueError for NaN and infinite floats, which encode_value sends as null
+_MEMBERS_ENCODER = json.JSONEncoder(allow_nan=False, separators=(',', ':'))
+
+def encode_value(value):
+    """ Returns the JSON text of a register value. NaN and infinite floats, which JSON cannot represent,
+        are encoded as null
+    """
+    return _ENCODERS.get(type(value), str)(value)
+
+def format_timestamp(timestamp):
+    """ ISO 8601 UTC text of a unix timestamp, with milliseconds
+    """
+    return '{0}.{1:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)),
+        int(timestamp * 1000) % 1000)
+
+def parse_timestamp(text):
+    """ Unix timestamp of an ISO 8601 UTC text written by format_timestamp
+    """
+    seconds, milliseconds = text.rstrip('Z').split('.')
+    return calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S')) + int(milliseconds) / 1000.0
+
+def creation_time_properties(created):
+    """ Message properties setting the creation time of a telemetry message polled at created. iotc appends
+        them to the MQTT topic as they are, so the value is URL encoded
+    """
+    return {config.KEY_CREATION_TIME: quote(format_timestamp(created), safe='')}
+
+def message_creation_time(properties):
+    """ Creation time of a message sent with the given properties, None if it has none
+    """
+    if not properties or config.KEY_CREATION_TIME not in properties:
+        return None
+    return parse_timestamp(unquote(properties[config.KEY_CREATION_TIME]))
+
+def compress_payload(payload):
+    """ Wraps a payload in a JSON envelope holding its base64 encoded gzip compression
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    data = compressor.compress(payload.encode('utf8')) + compressor.flush()
+    return '{{"contentEncoding":"gzip","data":"{0}"}}'.format(base64.b64encode(data).decode('ascii'))
+
+def pack_fragments(fragments, max_bytes, opening, closing):
+    """ Joins JSON fragments into as few messages of at most max_bytes as possible, each message being
+        the fragments between opening and closing. A fragment too large on its own is sent alone
+    """
+    messages = []
+    chunk = []
+    size = len(opening) + len(closing)
+    for fragment in fragments:
+        if chunk and size + len(fragment) + 1 > max_bytes:
+            messages.append(opening + ','.join(chunk) + closing)
+            chunk = []
+            size = len(opening) + len(closing)
+        chunk.append(fragment)
+        size += len(fragment) + 1
+    if chunk:
+        messages.append(opening + ','.join(chunk) + closing)
+    return messages
+
+def encode_members(values):
+    """ Returns the comma separated "name":value members of a dict of name to value, in no particular order. 
+        Encoded by the C JSON encoder, falling back to encode_value for the rare snapshots holding values 
+        JSON cannot represent
+    """
+    try:
+        return _MEMBERS_ENCODER.encode(values)[1:-1]
+    except ValueError:
+        return ','.join(json.dumps(name) + ':' + encode_value(value) for name, value in values.items())
+
+class TelemetryBatcher(object):
+    """ Turns the snapshots of a device into telemetry messages. With a batch interval, the snapshots
+        taken during the interval are sent as one JSON array of timestamped objects, split in several
+        messages beyond max_bytes. Without, every snapshot is sent right away as a JSON object
+    """
+
+    def __init__(self, batch_interval=None, max_bytes=None, compress=None):
+        self.batch_interval = config.TELEMETRY_BATCH_INTERVAL if batch_interval == None else batch_interval
+        self.max_bytes = config.TELEMETRY_MAX_MESSAGE_BYTES if max_bytes == None else max_bytes
+        self.compress = config.TELEMETRY_COMPRESSION if compress == None else compress
+
+        self._snapshots = []
+        self._size = 0
+        self._first = None
+        self._lock = threading.Lock()
+
+    def add(self, members, now=None):
+        """ Adds a snapshot given as the members of a JSON object. Returns the messages ready to be sent
+        """
+        if not members:
+            return []
+        if self.batch_interval <= 0:
+            return [self._finish('{' + members + '}')]
+
+        now = time.time() if now == None else now
+        snapshot = '{{"timestamp":"{0}",{1}}}'.format(format_timestamp(now), members)
+        with self._lock:
+            # a full batch is sent before the snapshot that would make it exceed max_bytes
+            messages = self._take() if self._size + len(snapshot) + 2 > self.max_bytes else []
+            if self._first == None:
+                self._first = now
+            self._snapshots.append(snapshot)
+            self._size += len(snapshot) + 1
+            return messages
+
+    def flush(self, now=None, force=False):
+        """ Returns the messages of the batch once the batch interval has elapsed, or right away with force
+        """
+        if not force and self.next_flush_delay(now) != 0:
+            return []
+        with self._lock:
+            return self._take()
+
+    def next_flush_delay(self, now=None):
+        """ Seconds until the pending batch is due, None if there is none
+        """
+        if self._first == None:
+            return None
+        now = time.time() if now == None else now
+        return max(0, self._first + self.batch_interval - now)
+
+    def _take(self):
+        if not self._snapshots:
+            return []
+        messages = pack_fragments(self._snapshots, self.max_bytes, '[', ']')
+        self._snapshots = []
+        self._size = 0
+        self._first = None
+        return [self._finish(message) for message in messages]
+
+    def _finish(self, message):
+        return compress_payload(message) if self.compress else message
@@ -0,0 +1,59 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+from aggregator import AggregationPolicy, Aggregator, parse_aggregation_policy
+
+class AggregatorTest(unittest.TestCase):
+
+    def test_samples_are_summarised_when_the_window_ends(self):
+        aggregator = Aggregator({'a': AggregationPolicy(10, ())})
+        self.assertEqual(({'b': 7}, []), aggregator.add({'a': 1, 'b': 7}, now=100))
+        aggregator.add({'a': 3}, now=105)
+        self.assertEqual(110, aggregator.next_window_end())
+        self.assertEqual([], aggregator.collect(now=109.9))
+        self.assertEqual([('a_min', 1), ('a_max', 3), ('a_mean', 2.0), ('a_last', 3), ('a_count', 2)], 
+            aggregator.collect(now=110))
+        # the next window starts with the next sample
+        self.assertEqual(None, aggregator.next_window_end())
+        self.assertEqual([], aggregator.collect(now=130))
+
+    def test_windows_are_aligned(self):
+        aggregator = Aggregator({'a': AggregationPolicy(60, ())})
+        aggregator.add({'a': 1}, now=1000)
+        self.assertEqual(1020, aggregator.next_window_end())
+
+    def test_ended_windows_are_emitted_with_the_next_sample(self):
+        aggregator = Aggregator({'a': AggregationPolicy(10, ())})
+        aggregator.add({'a': 1}, now=100)
+        passthrough, emitted = aggregator.add({'a': 5}, now=111)
+        self.assertEqual(('a_count', 1), emitted[-1])
+        self.assertEqual(120, aggregator.next_window_end())
+
+    def test_percentiles_of_the_most_recent_samples(self):
+        aggregator = Aggregator({'a': AggregationPolicy(10, (50, 100))}, max_samples=4)
+        for value in range(1, 7):
+            aggregator.add({'a': value}, now=100 + value)
+        summary = dict(aggregator.collect(now=110))
+        # count, min and mean cover every sample, percentiles the last four
+        self.assertEqual((6, 1, 3.5), (summary['a_count'], summary['a_min'], summary['a_mean']))
+        self.assertEqual((4, 6), (summary['a_p50'], summary['a_p100']))
+
+    def test_update_policies_keeps_unchanged_windows(self):
+        aggregator = Aggregator({'a': AggregationPolicy(10, ()), 'b': AggregationPolicy(10, ())})
+        aggregator.add({'a': 1, 'b': 1}, now=100)
+        aggregator.update_policies({'a': AggregationPolicy(10, ()), 'b': AggregationPolicy(20, ())})
+        self.assertEqual([('a_count', 1)], [field for field in aggregator.collect(now=110) if field[0].endswith('count')])
+        aggregator.update_policies({})
+        self.assertEqual(({'a': 2}, []), aggregator.add({'a': 2}, now=111))
+
+    def test_parse_aggregation_policy(self):
+        self.assertEqual(None, parse_aggregation_policy({'registerName': 'a'}))
+        self.assertEqual(AggregationPolicy(60, (95,)), 
+            parse_aggregation_policy({'aggregationWindow': 60, 'aggregationPercentiles': [95]}))
+        self.assertRaises(ValueError, parse_aggregation_policy, {'aggregationWindow': 0})
+        self.assertRaises(ValueError, parse_aggregation_policy, {'aggregationWindow': 60, 'aggregationPercentiles': [101]})
+
+if __name__ == '__main__':
+    unittest.main()
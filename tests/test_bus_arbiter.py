@@ -0,0 +1,101 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import threading
+import time
+import unittest
+
+from bus_arbiter import (BusArbiter, BusArbiterStoppedException, PRIORITY_ON_DEMAND, PRIORITY_POLL, PRIORITY_WRITE, 
+    silent_interval)
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class BusArbiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arbiter = BusArbiter(LOGGER, 115200, 'test')
+        self.arbiter.start()
+
+    def tearDown(self):
+        self.arbiter.stop()
+
+    def _submit_in_background(self, priority, function, *args):
+        thread = threading.Thread(target=self.arbiter.submit, args=(priority, function) + args)
+        thread.start()
+        return thread
+
+    def _wait_for_queue(self, depth):
+        deadline = time.time() + 2
+        while self.arbiter.queue_depth() < depth and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_submit_returns_the_result(self):
+        self.assertEqual(3, self.arbiter.submit(PRIORITY_POLL, lambda a, b: a + b, 1, 2))
+
+    def test_submit_raises_the_error(self):
+        def fail():
+            raise IOError('no answer')
+        self.assertRaises(IOError, self.arbiter.submit, PRIORITY_POLL, fail)
+        # the bus keeps serving
+        self.assertEqual(1, self.arbiter.submit(PRIORITY_POLL, lambda: 1))
+
+    def test_higher_priorities_are_served_first(self):
+        release = threading.Event()
+        order = []
+        threads = [self._submit_in_background(PRIORITY_POLL, release.wait)]
+        # the bus is busy, the others queue behind it
+        time.sleep(0.02)
+        for priority, name in [(PRIORITY_POLL, 'poll'), (PRIORITY_ON_DEMAND, 'on demand'), (PRIORITY_WRITE, 'write')]:
+            threads.append(self._submit_in_background(priority, order.append, name))
+            self._wait_for_queue(len(threads) - 1)
+        release.set()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(['write', 'on demand', 'poll'], order)
+        self.assertEqual(4, self.arbiter.stats().transactions)
+
+    def test_transactions_do_not_overlap(self):
+        running = []
+        overlaps = []
+        def transaction():
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(1)
+            time.sleep(0.001)
+            running.pop()
+        threads = [self._submit_in_background(PRIORITY_POLL, transaction) for _ in range(20)]
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual([], overlaps)
+        self.assertEqual(20, self.arbiter.stats().transactions)
+
+    def test_stop_fails_queued_transactions(self):
+        release = threading.Event()
+        errors = []
+        def submit():
+            try:
+                self.arbiter.submit(PRIORITY_POLL, lambda: None)
+            except BusArbiterStoppedException as e:
+                errors.append(e)
+        busy = self._submit_in_background(PRIORITY_POLL, release.wait)
+        time.sleep(0.02)
+        queued = threading.Thread(target=submit)
+        queued.start()
+        self._wait_for_queue(1)
+        stopper = threading.Thread(target=self.arbiter.stop)
+        stopper.start()
+        queued.join(2)
+        release.set()
+        busy.join(2)
+        stopper.join(2)
+        self.assertEqual(1, len(errors))
+        self.assertRaises(BusArbiterStoppedException, self.arbiter.submit, PRIORITY_POLL, lambda: None)
+
+    def test_silent_interval(self):
+        self.assertAlmostEqual(3.5 * 11 / 9600.0, silent_interval(9600))
+        self.assertEqual(0.00175, silent_interval(115200))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymodbus.bit_read_message import ReadCoilsResponse
+from pymodbus.exceptions import ModbusException, ModbusIOException, ConnectionException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.register_read_message import ReadHoldingRegistersResponse
+from pymodbus.register_write_message import WriteSingleRegisterResponse
+
+import config
+from bus_trace import STATUS_EXCEPTION_RESPONSE, STATUS_OK, STATUS_RAISED, STATUS_CONNECTION_ERROR, RECORD, \
+    TraceRecorder, read_trace
+from modbus import ModbusDeviceClient, ReplayModbusDeviceClient
+from slave_health import HEALTH_HEALTHY
+
+HOST = '192.168.1.10'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class FakeClient(object):
+    """ Stands in for a pymodbus client, answers (method name, address) with the response given for it,
+        raising it if it is an exception
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def __getattr__(self, name):
+        def request(address, value, **kwargs):
+            response = self.responses[(name, address)]
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return request
+
+class TraceRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = LOGGER
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bus.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self, mode=2, slave_id=HOST, unit=config.MODBUS_TCP_UNIT_ID):
+        """ Records a holding register read, a coil read, an exception response, a raised connection error
+            and a register write
+        """
+        client = FakeClient({
+            ('read_holding_registers', 0): ReadHoldingRegistersResponse([1, 2, 65535]),
+            ('read_coils', 10): ReadCoilsResponse([True, False, True, True, False, False, False, False]),
+            ('read_input_registers', 5): ExceptionResponse(4, 2),
+            ('read_discrete_inputs', 0): ConnectionException('link down'),
+            ('write_register', 20): WriteSingleRegisterResponse(20, 7)
+        })
+        recorder = TraceRecorder(self.path, mode, 9600, self.logger, 1024 * 1024)
+        bus = recorder.bus(client, slave_id)
+        self.assertEqual([1, 2, 65535], ModbusDeviceClient._read_registers_once(bus,
+            config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER, unit, 0, 3))
+        self.assertEqual([True, False, True, True, False], ModbusDeviceClient._read_registers_once(bus,
+            config.ACTIVE_REGISTERS_TYPE_COIL, unit, 10, 5))
+        self.assertRaises(ModbusException, ModbusDeviceClient._read_registers_once, bus,
+            config.ACTIVE_REGISTERS_TYPE_INPUT_REGISTER, unit, 5, 2)
+        self.assertRaises(ConnectionException, ModbusDeviceClient._read_registers_once, bus,
+            config.ACTIVE_REGISTERS_TYPE_DISCRETE_INPUT, unit, 0, 1)
+        bus.write_register(20, 7, unit=unit)
+        recorder.close()
+
+    def test_read_trace(self):
+        self._record()
+        trace = read_trace(self.path)
+        self.assertEqual((2, 9600, [HOST]), (trace.mode, trace.baudrate, trace.slaves))
+        self.assertEqual([(3, 0, 3, STATUS_OK), (1, 10, 5, STATUS_OK), (4, 5, 2, STATUS_EXCEPTION_RESPONSE),
+            (2, 0, 1, STATUS_CONNECTION_ERROR | STATUS_RAISED), (6, 20, 1, STATUS_OK)],
+            [(record.function_code, record.address, record.count, record.status) for record in trace.records])
+        self.assertTrue(all(record.slave == HOST for record in trace.records))
+
+    def test_serial_trace_names_slaves_by_unit(self):
+        self._record(mode=1, slave_id=None, unit=3)
+        trace = read_trace(self.path)
+        self.assertEqual((1, ['3']), (trace.mode, trace.slaves))
+
+    def test_replay(self):
+        self._record()
+        client = ReplayModbusDeviceClient(self.path, self.logger, speed=0)
+        try:
+            self.assertEqual([1, 2, 65535], client.read_registers(config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER, HOST, 0, 3))
+            self.assertEqual([True, False, True, True, False],
+                client.read_registers(config.ACTIVE_REGISTERS_TYPE_COIL, HOST, 10, 5))
+            client.write_register(config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER, HOST, 20, 7)
+
+            self.assertRaises(ModbusException, client.read_registers, config.ACTIVE_REGISTERS_TYPE_INPUT_REGISTER, HOST, 5, 2)
+            # an exception response shows the slave is answering
+            self.assertEqual(HEALTH_HEALTHY, client.health_state(HOST))
+            self.assertRaises(ConnectionException, client.read_registers,
+                config.ACTIVE_REGISTERS_TYPE_DISCRETE_INPUT, HOST, 0, 1)
+            # requests that were not recorded fail as if the slave did not answer
+            self.assertRaises(ModbusIOException, client.read_registers,
+                config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER, HOST, 100, 1)
+        finally:
+            client.close()
+
+    def test_truncated_last_record_is_ignored(self):
+        self._record()
+        size = os.path.getsize(self.path)
+        # cut the write record inside its payload, then inside its header
+        for length in [size - 1, size - RECORD.size]:
+            with open(self.path, 'r+b') as trace_file:
+                trace_file.truncate(length)
+            trace = read_trace(self.path)
+            self.assertEqual([3, 1, 4, 2], [record.function_code for record in trace.records])
+
+    def test_not_a_trace(self):
+        with open(self.path, 'wb') as trace_file:
+            trace_file.write('not a trace at all')
+        self.assertRaises(ValueError, read_trace, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
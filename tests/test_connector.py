@@ -0,0 +1,32 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import unittest
+
+from connector import Connector
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class ConnectorRateTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        connector = Connector(LOGGER, worker_count=1, rate=2, burst=3)
+        delays = [connector._reserve(100) for _ in range(5)]
+        self.assertEqual([0, 0, 0, 0.5, 1.0], delays)
+
+    def test_burst_refills_after_a_quiet_period(self):
+        connector = Connector(LOGGER, worker_count=1, rate=2, burst=3)
+        for _ in range(5):
+            connector._reserve(100)
+        self.assertEqual([0, 0, 0, 0.5], [connector._reserve(110) for _ in range(4)])
+
+    def test_rate_without_burst(self):
+        connector = Connector(LOGGER, worker_count=1, rate=4, burst=1)
+        self.assertEqual([0, 0.25, 0.5], [connector._reserve(100) for _ in range(3)])
+        # an attempt after the reserved ones waits only for what is left of their interval
+        self.assertEqual(0.65, round(connector._reserve(100.1), 6))
+
+if __name__ == '__main__':
+    unittest.main()
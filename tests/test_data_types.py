@@ -0,0 +1,56 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+import config
+from data_types import DEFAULT_FORMAT, ORDER_BIG, ORDER_LITTLE, BlockDecoder, RegisterFormat, ShortResponseException, \
+    encode_value
+from read_planner import ReadBlock
+
+HOLDING = config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER
+
+def _format(data_type, word_order=ORDER_BIG, byte_order=ORDER_BIG, scale=1, offset=0):
+    return RegisterFormat(data_type, word_order, byte_order, scale, offset)
+
+class BlockDecoderTest(unittest.TestCase):
+
+    def test_decodes_values_and_skips_unused_registers(self):
+        block = ReadBlock(HOLDING, 100, 5, (('a', 0), ('b', 2), ('c', 4)))
+        formats = {'b': _format('int32'), 'c': _format('int16', scale=0.5, offset=1)}
+        decoded = BlockDecoder(block, formats).decode([7, 0, 0xffff, 0xfffe, 10])
+        self.assertEqual({'a': 7, 'b': -2, 'c': 6.0}, decoded)
+
+    def test_word_and_byte_orders(self):
+        block = ReadBlock(HOLDING, 0, 6, (('big', 0), ('words', 2), ('bytes', 4)))
+        formats = {
+            'big': _format('uint32'),
+            'words': _format('uint32', word_order=ORDER_LITTLE),
+            'bytes': _format('uint32', byte_order=ORDER_LITTLE)
+        }
+        decoded = BlockDecoder(block, formats).decode([0x0102, 0x0304, 0x0304, 0x0102, 0x0201, 0x0403])
+        self.assertEqual({'big': 0x01020304, 'words': 0x01020304, 'bytes': 0x01020304}, decoded)
+
+    def test_overlapping_registers(self):
+        block = ReadBlock(HOLDING, 0, 3, (('wide', 0), ('low', 1), ('next', 2)))
+        decoded = BlockDecoder(block, {'wide': _format('uint32')}).decode([1, 2, 3])
+        self.assertEqual({'wide': 0x00010002, 'low': 2, 'next': 3}, decoded)
+
+    def test_short_response(self):
+        block = ReadBlock(HOLDING, 0, 3, (('a', 0), ('b', 2)))
+        self.assertRaises(ShortResponseException, BlockDecoder(block, {}).decode, [1, 2])
+
+    def test_bits_are_split(self):
+        block = ReadBlock(config.ACTIVE_REGISTERS_TYPE_COIL, 0, 3, (('a', 0), ('c', 2)))
+        self.assertEqual({'a': True, 'c': False}, BlockDecoder(block, {}).decode([True, True, False, False]))
+
+    def test_encode_value_round_trip(self):
+        for register_format, value in [(DEFAULT_FORMAT, 513), (_format('float32', ORDER_LITTLE, ORDER_LITTLE), 1.5),
+                (_format('int64', ORDER_LITTLE), -3), (_format('int16', scale=0.1, offset=-20), 5.0)]:
+            block = ReadBlock(HOLDING, 0, 4, (('v', 0),))
+            registers = encode_value(register_format, value)
+            decoded = BlockDecoder(block, {'v': register_format}).decode(registers + [0] * (4 - len(registers)))
+            self.assertAlmostEqual(value, decoded['v'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import shutil
+import tempfile
+import time
+import unittest
+
+import config
+from devices.device import Device
+from telemetry_encoder import message_creation_time
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class FakeClient(object):
+    """ Stands in for an iotc.Device, records the telemetry sent through it
+    """
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.callbacks = {}
+        self.sent = []
+
+    def setLogLevel(self, log_level):
+        pass
+
+    def setModelData(self, model_data):
+        pass
+
+    def on(self, event, callback):
+        self.callbacks[event] = callback
+
+    def isConnected(self):
+        return self.connected
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        self.connected = False
+
+    def doNext(self, idle_time=None):
+        pass
+
+    def sendTelemetry(self, payload, properties=None):
+        self.sent.append((payload, message_creation_time(properties)))
+
+class SentInfo(object):
+    def __init__(self, payload, status_code):
+        self.payload = payload
+        self.status_code = status_code
+
+    def getPayload(self):
+        return self.payload
+
+    def getStatusCode(self):
+        return self.status_code
+
+class BufferedTelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.buffer_path = config.TELEMETRY_BUFFER_PATH
+        config.TELEMETRY_BUFFER_PATH = self.directory
+        self.client = FakeClient()
+        self.device = Device(None, None, 'device', None, LOGGER, client=self.client)
+
+    def tearDown(self):
+        config.TELEMETRY_BUFFER_PATH = self.buffer_path
+        shutil.rmtree(self.directory)
+
+    def _assert_buffered(self, payload, polled):
+        payloads, _ = self.device.telemetry_buffer.read(10)
+        self.assertEqual([payload], [buffered for _, buffered in payloads])
+        self.assertAlmostEqual(polled, payloads[0][0], delta=0.01)
+
+    def test_disconnected_telemetry_is_buffered_with_its_poll_time(self):
+        self.client.connected = False
+        polled = time.time() - 60
+        self.device.send_telemetry('{"a":1}', polled)
+        self._assert_buffered('{"a":1}', polled)
+
+    def test_failed_message_is_buffered_with_its_poll_time(self):
+        polled = time.time() - 60
+        self.device.send_telemetry('{"a":1}', polled)
+        self.assertEqual(['{"a":1}'], [payload for payload, _ in self.client.sent])
+        self.assertAlmostEqual(polled, self.client.sent[0][1], delta=0.01)
+        self.client.callbacks['MessageSent'](SentInfo('{"a":1}', 1))
+        self._assert_buffered('{"a":1}', polled)
+
+    def test_failed_live_message_keeps_its_send_time(self):
+        sent = time.time()
+        self.device.send_telemetry('{"a":2}')
+        time.sleep(0.05)
+        self.client.callbacks['MessageSent'](SentInfo('{"a":2}', 1))
+        self._assert_buffered('{"a":2}', sent)
+
+    def test_sent_messages_are_forgotten(self):
+        self.device.send_telemetry('{"a":3}')
+        self.client.callbacks['MessageSent'](SentInfo('{"a":3}', 0))
+        self.assertEqual(0, len(self.device._in_flight))
+        self.assertTrue(self.device.telemetry_buffer.is_empty())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import unittest
+
+import config
+from devices.master_device import MasterDevice
+from test_device import FakeClient
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+REGISTERS = [{'registerName': 'temp', 'address': 0, 'type': 'ir'}]
+
+def _slaves_config(*slaves, **settings):
+    slaves_config = {config.CONFIG_KEY_UPDATE_INTERVAL: 60, config.CONFIG_KEY_ACTIVE_REGISTERS: REGISTERS,
+        config.CONFIG_KEY_SLAVES: [dict(deviceId=device_id, slaveId=slave_id) for device_id, slave_id in slaves]}
+    slaves_config.update(settings)
+    return slaves_config
+
+class FakeClientMaster(MasterDevice):
+    """ Master whose slaves connect through fake clients
+    """
+
+    def _create_slave_client(self, device_id):
+        return FakeClient()
+
+class ReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = config.PROVISIONING_CACHE_PATH, config.TELEMETRY_BUFFER_PATH, config.MODBUS_MODE
+        config.PROVISIONING_CACHE_PATH = None
+        config.TELEMETRY_BUFFER_PATH = None
+        config.MODBUS_MODE = 0
+        self.master = FakeClientMaster(None, None, 'model', 'master', LOGGER, client=FakeClient())
+
+    def tearDown(self):
+        self.master.kill_slaves()
+        config.PROVISIONING_CACHE_PATH, config.TELEMETRY_BUFFER_PATH, config.MODBUS_MODE = self.paths
+
+    def _slaves(self):
+        return dict((slave.device_id, slave) for slave in self.master.slaves)
+
+    def test_new_slaves_are_started(self):
+        self.master._init_slaves(_slaves_config(('meter', 1), ('plc', 2)))
+        slaves = self._slaves()
+        self.assertEqual(['meter', 'plc'], sorted(slaves))
+        self.assertTrue(all(slave._active for slave in slaves.values()))
+
+    def test_removed_slaves_are_stopped(self):
+        self.master._init_slaves(_slaves_config(('meter', 1), ('plc', 2)))
+        plc = self._slaves()['plc']
+        self.master._init_slaves(_slaves_config(('meter', 1)))
+        self.assertEqual(['meter'], sorted(self._slaves()))
+        self.assertFalse(plc._active)
+
+    def test_changed_register_map_is_applied_in_place(self):
+        self.master._init_slaves(_slaves_config(('meter', 1)))
+        meter = self._slaves()['meter']
+        self.master._init_slaves(_slaves_config(('meter', 1), activeRegisters=REGISTERS + 
+            [{'registerName': 'humidity', 'address': 1, 'type': 'ir'}]))
+        self.assertIs(meter, self._slaves()['meter'])
+        self.assertTrue(meter._active)
+        self.assertEqual(('temp', 'humidity'), meter.register_map.profile.names)
+
+    def test_changed_slave_id_restarts_the_slave(self):
+        self.master._init_slaves(_slaves_config(('meter', 1)))
+        meter = self._slaves()['meter']
+        self.master._init_slaves(_slaves_config(('meter', 2)))
+        self.assertIsNot(meter, self._slaves()['meter'])
+        self.assertEqual(2, self._slaves()['meter'].slave_id)
+        self.assertFalse(meter._active)
+
+    def test_unchanged_profiles_are_reused(self):
+        self.master._init_slaves(_slaves_config(('meter', 1), ('plc', 2)))
+        profile = self._slaves()['meter'].register_map.profile
+        self.assertIs(profile, self._slaves()['plc'].register_map.profile)
+        self.master._init_slaves(_slaves_config(('meter', 1), ('plc', 2)))
+        self.assertIs(profile, self._slaves()['meter'].register_map.profile)
+
+    def test_invalid_config_leaves_slaves_running(self):
+        self.master._init_slaves(_slaves_config(('meter', 1)))
+        meter = self._slaves()['meter']
+        response = self.master._process_setting(config.KEY_CONFIG, '{"slaves": [{"deviceId": "plc", "slaveId": 2, "profile": "unknown"}]}')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([meter], self.master.slaves)
+        self.assertTrue(meter._active)
+
+if __name__ == '__main__':
+    unittest.main()
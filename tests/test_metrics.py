@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import unittest
+import urllib2
+
+from metrics import REGISTRY, MetricsRegistry
+from metrics_server import start_metrics_server
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def _lines(self):
+        return self.registry.render().splitlines()
+
+    def test_counter(self):
+        counter = self.registry.counter('reads_total', 'Reads', ['slave'])
+        counter.inc(('meter',))
+        counter.inc(('meter',), 2)
+        self.assertEqual(['# HELP reads_total Reads', '# TYPE reads_total counter', 'reads_total{slave="meter"} 3.0'],
+            self._lines())
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter('reads_total', 'Reads', ['slave']).inc(('a "b" \\c',))
+        self.assertEqual('reads_total{slave="a \\"b\\" \\\\c"} 1.0', self._lines()[-1])
+
+    def test_gauge_collects_on_render(self):
+        depth = [3]
+        self.registry.gauge('queue_depth', 'Depth', ['bus'], collect=lambda: {('serial',): depth[0]})
+        self.assertEqual('queue_depth{bus="serial"} 3.0', self._lines()[-1])
+        depth[0] = 5
+        self.assertEqual('queue_depth{bus="serial"} 5.0', self._lines()[-1])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('read_seconds', 'Reads', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(['read_seconds_bucket{le="0.1"} 2', 'read_seconds_bucket{le="1.0"} 3', 
+            'read_seconds_bucket{le="+Inf"} 4', 'read_seconds_sum 3.65', 'read_seconds_count 4'], self._lines()[2:])
+
+    def test_registering_again_returns_the_existing_metric(self):
+        counter = self.registry.counter('reads_total', 'Reads')
+        self.assertIs(counter, self.registry.counter('reads_total', 'Reads'))
+
+    def test_reset_clears_the_values(self):
+        counter = self.registry.counter('reads_total', 'Reads')
+        counter.inc()
+        self.registry.reset()
+        self.assertEqual(['# HELP reads_total Reads', '# TYPE reads_total counter'], self._lines())
+
+class MetricsServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_metrics_server(LOGGER, '127.0.0.1', 0)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_metrics_endpoint(self):
+        response = urllib2.urlopen(self.url + '/metrics', timeout=5)
+        self.assertTrue(response.info()['Content-Type'].startswith('text/plain'))
+        # collected values may change between two scrapes, the metrics do not
+        headers = lambda text: [line for line in text.splitlines() if line.startswith('#')]
+        self.assertEqual(headers(REGISTRY.render()), headers(response.read()))
+
+    def test_unknown_path(self):
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            urllib2.urlopen(self.url + '/unknown', timeout=5)
+        self.assertEqual(404, raised.exception.code)
+
+if __name__ == '__main__':
+    unittest.main()
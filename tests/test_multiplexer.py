@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import logging
+import unittest
+
+import config
+from multiplexer import TelemetryMultiplexer
+from test_device import FakeClient
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class TelemetryMultiplexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway_client = FakeClient()
+        self.multiplexer = TelemetryMultiplexer(self.gateway_client, LOGGER, flush_interval=60)
+
+    def _sent(self):
+        return [(json.loads(payload), created) for payload, created in self.gateway_client.sent]
+
+    def test_slaves_are_sent_in_one_message(self):
+        self.multiplexer.child_client('meter').sendTelemetry('{"a":1,"b":2}')
+        self.multiplexer.child_client('plc').sendTelemetry('{"c":3}')
+        # later values of a register replace earlier ones
+        self.multiplexer.child_client('meter').sendTelemetry('{"a":4}')
+        self.multiplexer.flush()
+        self.assertEqual([], self.gateway_client.sent)
+        self.multiplexer.flush(force=True)
+        self.assertEqual([({'meter': {'a': 4, 'b': 2}, 'plc': {'c': 3}}, None)], self._sent())
+        self.multiplexer.flush(force=True)
+        self.assertEqual(1, len(self.gateway_client.sent))
+
+    def test_messages_are_split_beyond_max_message_bytes(self):
+        max_bytes = config.TELEMETRY_MAX_MESSAGE_BYTES
+        config.TELEMETRY_MAX_MESSAGE_BYTES = 60
+        try:
+            for i in range(6):
+                self.multiplexer.enqueue('slave{}'.format(i), '{"value":12345}')
+            self.multiplexer.flush(force=True)
+        finally:
+            config.TELEMETRY_MAX_MESSAGE_BYTES = max_bytes
+        self.assertTrue(len(self.gateway_client.sent) > 1)
+        self.assertTrue(all(len(payload) <= 60 for payload, _ in self.gateway_client.sent))
+        merged = {}
+        for values, _ in self._sent():
+            merged.update(values)
+        self.assertEqual(dict(('slave{}'.format(i), {'value': 12345}) for i in range(6)), merged)
+
+    def test_telemetry_polled_earlier_is_sent_on_its_own_with_its_time(self):
+        self.multiplexer.enqueue('meter', '{"a":1}', created=1000.5)
+        self.assertEqual([({'meter': {'a': 1}}, 1000.5)], self._sent())
+
+    def test_nothing_is_sent_while_the_gateway_is_offline(self):
+        client = self.multiplexer.child_client('meter')
+        self.gateway_client.connected = False
+        self.assertFalse(client.isConnected())
+        self.multiplexer.flush(force=True)
+        self.assertEqual([], self.gateway_client.sent)
+
+    def test_split_setting_key(self):
+        self.assertEqual(('meter', 'setpoint'), TelemetryMultiplexer.split_setting_key('meter__setpoint'))
+        self.assertEqual((None, 'config'), TelemetryMultiplexer.split_setting_key('config'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+import config
+from poll_scheduler import PollGroup, apply_bus_budget, build_poll_groups, group_load
+from read_planner import ReadBlock
+
+HOLDING = config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER
+BAUDRATE = 9600
+
+def _group(interval, priority, block_count=1):
+    return PollGroup(interval, priority, ['r'], [ReadBlock(HOLDING, i * 10, 10, (('r', 0),)) for i in range(block_count)])
+
+class BusBudgetTest(unittest.TestCase):
+
+    def test_groups_within_budget_keep_their_interval(self):
+        groups = [_group(10, 0), _group(10, 1)]
+        configured, effective = apply_bus_budget(groups, BAUDRATE, 0.8)
+        self.assertEqual([1.0, 1.0], [group.stretch for group in groups])
+        self.assertAlmostEqual(configured, effective)
+
+    def test_lower_priorities_are_stretched_first(self):
+        urgent = _group(1, 0)
+        background = _group(0.1, 1)
+        budget = 2 * group_load(urgent, BAUDRATE)
+        configured, effective = apply_bus_budget([urgent, background], BAUDRATE, budget)
+        self.assertEqual(1.0, urgent.stretch)
+        self.assertAlmostEqual(group_load(background, BAUDRATE) / (budget - group_load(urgent, BAUDRATE)), background.stretch)
+        self.assertAlmostEqual(budget, effective)
+        self.assertTrue(configured > effective)
+
+    def test_stretch_is_capped(self):
+        groups = [_group(0.001, 0, block_count=5)]
+        configured, effective = apply_bus_budget(groups, BAUDRATE, 0.8)
+        self.assertEqual(config.BUS_MAX_STRETCH, groups[0].stretch)
+        self.assertAlmostEqual(configured / config.BUS_MAX_STRETCH, effective)
+
+    def test_build_poll_groups(self):
+        groups = build_poll_groups([('a', 0, HOLDING, 1, None, None), ('b', 1, HOLDING, 1, 5, 1),
+            ('c', 2, HOLDING, 1, None, 0)], 10, 0)
+        self.assertEqual([(5, 1, ['b']), (10, 0, ['a', 'c'])],
+            [(group.interval, group.priority, group.register_names) for group in groups])
+        self.assertEqual([(0, 1), (2, 1)], [(block.address, block.count) for block in groups[1].plan])
+
+    def test_advance_skips_missed_periods(self):
+        group = _group(10, 0)
+        group.deadline = 100
+        group.advance(now=135)
+        self.assertEqual(140, group.deadline)
+
+if __name__ == '__main__':
+    unittest.main()
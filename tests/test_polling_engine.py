@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import threading
+import time
+import unittest
+
+from polling_engine import PollingEngine
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class LoopDevice(object):
+    """ Device whose loop passes return the next delay from a list and signal the test
+    """
+
+    def __init__(self, device_id, delays, error=None):
+        self.device_id = device_id
+        self.delays = list(delays)
+        self.error = error
+        self.passes = 0
+        self.condition = threading.Condition()
+        self._active = True
+
+    def _loop_once(self, idle_time=None):
+        with self.condition:
+            self.passes += 1
+            self.condition.notify_all()
+        if self.error != None:
+            raise self.error
+        return self.delays.pop(0) if self.delays else 60
+
+    def wait_for_passes(self, count, timeout=2):
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.passes < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.passes >= count
+
+class PollingEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = PollingEngine(LOGGER, worker_count=2, idle_time=0.01)
+        self.engine.start()
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def test_passes_run_when_due(self):
+        device = LoopDevice('meter', [0, 0, 60])
+        self.engine.add(device)
+        self.assertTrue(device.wait_for_passes(3))
+        self.assertFalse(device.wait_for_passes(4, timeout=0.1))
+
+    def test_wake_runs_the_next_pass_right_away(self):
+        device = LoopDevice('meter', [60])
+        self.engine.add(device)
+        self.assertTrue(device.wait_for_passes(1))
+        self.engine.wake(device)
+        self.assertTrue(device.wait_for_passes(2, timeout=1))
+
+    def test_removed_device_is_not_run_again(self):
+        device = LoopDevice('meter', [0.05])
+        self.engine.add(device)
+        self.assertTrue(device.wait_for_passes(1))
+        # as Device.stop does, a pass still running then does not schedule another one
+        device._active = False
+        self.engine.remove(device)
+        self.assertFalse(device.wait_for_passes(2, timeout=0.2))
+
+    def test_failed_pass_is_retried(self):
+        device = LoopDevice('meter', [], ValueError('bus gone'))
+        self.engine.add(device)
+        self.assertTrue(device.wait_for_passes(3))
+
+    def test_devices_share_the_workers(self):
+        devices = [LoopDevice('slave{}'.format(i), [0, 60]) for i in range(20)]
+        for device in devices:
+            self.engine.add(device)
+        self.assertTrue(all(device.wait_for_passes(2) for device in devices))
+        self.assertEqual(2, len(self.engine.scheduler.workers))
+
+if __name__ == '__main__':
+    unittest.main()
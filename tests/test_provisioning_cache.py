@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from provisioning_cache import ProvisioningCache
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+APP_KEY = base64.b64encode('app key')
+OTHER_APP_KEY = base64.b64encode('other app key')
+
+class ProvisioningCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'provisioning_cache.json')
+        self.computed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _compute(self, app_key, device_id):
+        self.computed.append(device_id)
+        return 'key of ' + device_id
+
+    def _saved_cache(self):
+        cache = ProvisioningCache(self.path, APP_KEY, LOGGER)
+        cache.device_key('meter', self._compute)
+        cache.set_slaves_config('{"slaves": []}')
+        return cache
+
+    def test_keys_and_config_survive_a_restart(self):
+        self._saved_cache()
+        cache = ProvisioningCache(self.path, APP_KEY, LOGGER)
+        self.assertEqual('key of meter', cache.device_key('meter', self._compute))
+        self.assertEqual(['meter'], self.computed)
+        self.assertEqual('{"slaves": []}', cache.get_slaves_config())
+
+    def test_cache_of_another_app_key_is_discarded(self):
+        self._saved_cache()
+        cache = ProvisioningCache(self.path, OTHER_APP_KEY, LOGGER)
+        self.assertEqual(None, cache.get_slaves_config())
+        cache.device_key('meter', self._compute)
+        self.assertEqual(['meter', 'meter'], self.computed)
+
+    def test_tampered_cache_is_discarded(self):
+        self._saved_cache()
+        with open(self.path) as cache_file:
+            content = json.load(cache_file)
+        content['body']['deviceKeys']['meter'] = 'forged key'
+        with open(self.path, 'w') as cache_file:
+            json.dump(content, cache_file)
+        cache = ProvisioningCache(self.path, APP_KEY, LOGGER)
+        self.assertEqual('key of meter', cache.device_key('meter', self._compute))
+        self.assertEqual(None, cache.get_slaves_config())
+
+    def test_corrupted_cache_is_discarded(self):
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{"body": {"deviceKeys"')
+        cache = ProvisioningCache(self.path, APP_KEY, LOGGER)
+        self.assertEqual(None, cache.get_slaves_config())
+
+    def test_save_writes_only_changes(self):
+        cache = self._saved_cache()
+        modified = os.path.getmtime(self.path)
+        os.utime(self.path, (modified - 10, modified - 10))
+        cache.device_key('meter', self._compute)
+        cache.save()
+        self.assertAlmostEqual(modified - 10, os.path.getmtime(self.path), places=3)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+import config
+from read_planner import ReadBlock, plan_reads, split_block
+
+HOLDING = config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER
+COIL = config.ACTIVE_REGISTERS_TYPE_COIL
+
+class PlanReadsTest(unittest.TestCase):
+
+    def test_merges_registers_within_max_gap(self):
+        blocks = plan_reads([('a', 0, HOLDING, 1), ('b', 3, HOLDING, 2), ('c', 10, HOLDING, 1)], max_gap=2)
+        self.assertEqual([ReadBlock(HOLDING, 0, 5, (('a', 0), ('b', 3))), ReadBlock(HOLDING, 10, 1, (('c', 0),))], blocks)
+
+    def test_gap_of_zero_merges_only_adjacent_registers(self):
+        blocks = plan_reads([('a', 0, HOLDING, 2), ('b', 2, HOLDING, 1), ('c', 4, HOLDING, 1)], max_gap=0)
+        self.assertEqual([(0, 3), (4, 1)], [(block.address, block.count) for block in blocks])
+
+    def test_register_types_are_read_apart(self):
+        blocks = plan_reads([('a', 0, HOLDING, 1), ('b', 1, COIL, 1)], max_gap=4)
+        self.assertEqual(set([(HOLDING, 0, 1), (COIL, 1, 1)]), set((block.type, block.address, block.count) for block in blocks))
+
+    def test_blocks_stay_within_protocol_limit(self):
+        registers = [('r{}'.format(i), i, HOLDING, 1) for i in range(config.MODBUS_MAX_READ_REGISTERS + 10)]
+        blocks = plan_reads(registers, max_gap=0)
+        self.assertEqual([config.MODBUS_MAX_READ_REGISTERS, 10], [block.count for block in blocks])
+        bits = [('b{}'.format(i), i, COIL, 1) for i in range(config.MODBUS_MAX_READ_BITS + 1)]
+        self.assertEqual([config.MODBUS_MAX_READ_BITS, 1], [block.count for block in plan_reads(bits, max_gap=0)])
+
+    def test_overlapping_registers_share_a_block(self):
+        blocks = plan_reads([('wide', 0, HOLDING, 2), ('low', 1, HOLDING, 1)], max_gap=0)
+        self.assertEqual([ReadBlock(HOLDING, 0, 2, (('wide', 0), ('low', 1)))], blocks)
+
+    def test_split_block(self):
+        block = ReadBlock(HOLDING, 10, 3, (('a', 0), ('c', 2)))
+        self.assertEqual({'a': 7, 'c': 9}, split_block(block, [7, 8, 9]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+import config
+from register_profiles import DEFAULT_PROFILE, load_profiles, slave_profile
+
+REGISTERS = [
+    {'registerName': 'temp', 'address': 0, 'type': 'ir'},
+    {'registerName': 'humidity', 'address': 1, 'type': 'ir'},
+    {'registerName': 'setpoint', 'address': 0, 'type': 'hr', 'dataType': 'float32', 'pollInterval': 10}
+]
+
+def _slaves_config(*slaves, **profiles):
+    return {config.CONFIG_KEY_MODEL_ID: 'model', config.CONFIG_KEY_UPDATE_INTERVAL: 5, 
+        config.CONFIG_KEY_ACTIVE_REGISTERS: REGISTERS, config.CONFIG_KEY_PROFILES: profiles,
+        config.CONFIG_KEY_SLAVES: [dict(deviceId=device_id, slaveId=1, **({'profile': profile} if profile else {})) 
+            for device_id, profile in slaves]}
+
+class RegisterProfileTest(unittest.TestCase):
+
+    def test_slaves_share_their_profile(self):
+        slaves_config = _slaves_config(('a', None), ('b', None), ('c', 'meter'), ('d', 'meter'), 
+            meter={'activeRegisters': REGISTERS[:1], 'modelId': 'meter model'})
+        profiles = load_profiles(slaves_config)
+        self.assertEqual(set([DEFAULT_PROFILE, 'meter']), set(profiles))
+        slaves = slaves_config[config.CONFIG_KEY_SLAVES]
+        self.assertIs(slave_profile(slaves[0], profiles), slave_profile(slaves[1], profiles))
+        meter = slave_profile(slaves[2], profiles)
+        # settings a profile does not set are the top level ones
+        self.assertEqual(('meter model', 5, ('temp',)), (meter.model_id, meter.update_interval, meter.names))
+
+    def test_unknown_profile(self):
+        self.assertRaises(KeyError, load_profiles, _slaves_config(('a', 'unknown')))
+
+    def test_unchanged_profiles_are_reused(self):
+        profiles = load_profiles(_slaves_config(('a', None), ('b', 'meter'), meter={'activeRegisters': REGISTERS[:1]}))
+        reloaded = load_profiles(_slaves_config(('a', None), ('b', 'meter'), meter={'activeRegisters': REGISTERS[:2]}), 
+            profiles)
+        self.assertIs(profiles[DEFAULT_PROFILE], reloaded[DEFAULT_PROFILE])
+        self.assertIsNot(profiles['meter'], reloaded['meter'])
+
+    def test_register_map(self):
+        profile = load_profiles(_slaves_config(('a', None)))[DEFAULT_PROFILE]
+        self.assertEqual(3, len(profile))
+        self.assertIn('setpoint', profile)
+        self.assertEqual((0, 'hr', 2), (profile.register('setpoint').address, profile.register('setpoint').type, 
+            profile.widths[profile.index['setpoint']]))
+        self.assertEqual(('temp', 'humidity'), profile.read_registers)
+        self.assertRaises(KeyError, profile.register, 'unknown')
+
+    def test_plans_and_poll_groups_are_precomputed(self):
+        profile = load_profiles(_slaves_config(('a', None)))[DEFAULT_PROFILE]
+        self.assertIs(profile.read_plan, profile.plan(['setpoint', 'humidity', 'temp']))
+        self.assertEqual([(5, ['temp', 'humidity']), (10, ['setpoint'])], 
+            [(group.interval, group.register_names) for group in profile.poll_groups])
+        for block in profile.read_plan + [block for group in profile.poll_groups for block in group.plan]:
+            self.assertIs(profile.decoder(block), profile.decoder(block))
+        # poll groups of slaves share the plans and have their own deadlines
+        groups = profile.new_poll_groups()
+        self.assertIs(profile.poll_groups[0].plan, groups[0].plan)
+        self.assertIsNot(profile.poll_groups[0], groups[0])
+
+    def test_ad_hoc_plans(self):
+        profile = load_profiles(_slaves_config(('a', None)))[DEFAULT_PROFILE]
+        plan = profile.plan(['humidity'])
+        self.assertEqual([('ir', 1, 1)], [(block.type, block.address, block.count) for block in plan])
+        self.assertEqual({'humidity': 7}, profile.decoder(plan[0]).decode([7]))
+
+if __name__ == '__main__':
+    unittest.main()
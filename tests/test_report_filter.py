@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import unittest
+
+from report_filter import ReportFilter, ReportPolicy, parse_report_policy
+
+def _policy(deadband=None, deadband_percent=None, min_interval=None, max_silence=None):
+    return ReportPolicy(deadband, deadband_percent, min_interval, max_silence)
+
+class ReportFilterTest(unittest.TestCase):
+
+    def test_registers_without_policy_are_always_published(self):
+        report_filter = ReportFilter({})
+        self.assertEqual({'a': 1}, report_filter.filter({'a': 1}, now=0))
+        self.assertEqual({'a': 1}, report_filter.filter({'a': 1}, now=1))
+
+    def test_deadband(self):
+        report_filter = ReportFilter({'a': _policy(deadband=0.5)})
+        self.assertEqual({'a': 10}, report_filter.filter({'a': 10}, now=0))
+        self.assertEqual({}, report_filter.filter({'a': 10.4}, now=1))
+        self.assertEqual({}, report_filter.filter({'a': 9.6}, now=2))
+        # the change is measured from the last published value, not the last polled one
+        self.assertEqual({'a': 10.6}, report_filter.filter({'a': 10.6}, now=3))
+        self.assertEqual({}, report_filter.filter({'a': 10.2}, now=4))
+
+    def test_deadband_percent(self):
+        report_filter = ReportFilter({'a': _policy(deadband_percent=10)})
+        report_filter.filter({'a': -200}, now=0)
+        self.assertEqual({}, report_filter.filter({'a': -181}, now=1))
+        self.assertEqual({'a': -179}, report_filter.filter({'a': -179}, now=2))
+
+    def test_max_silence_publishes_unchanged_values(self):
+        report_filter = ReportFilter({'a': _policy(deadband=1, max_silence=60)})
+        report_filter.filter({'a': 5}, now=0)
+        self.assertEqual({}, report_filter.filter({'a': 5}, now=59))
+        self.assertEqual({'a': 5}, report_filter.filter({'a': 5}, now=60))
+
+    def test_min_interval_holds_back_changes(self):
+        report_filter = ReportFilter({'a': _policy(min_interval=10)})
+        report_filter.filter({'a': 1}, now=0)
+        self.assertEqual({}, report_filter.filter({'a': 2}, now=5))
+        self.assertEqual({'a': 2}, report_filter.filter({'a': 2}, now=10))
+        # without a deadband unchanged values are not published
+        self.assertEqual({}, report_filter.filter({'a': 2}, now=20))
+
+    def test_update_policies_forgets_removed_registers(self):
+        report_filter = ReportFilter({'a': _policy(deadband=1), 'b': _policy(deadband=1)})
+        report_filter.filter({'a': 1, 'b': 1}, now=0)
+        report_filter.update_policies({'a': _policy(deadband=1)})
+        self.assertEqual({'b': 1}, report_filter.filter({'a': 1, 'b': 1}, now=1))
+        report_filter.reset()
+        self.assertEqual({'a': 1, 'b': 1}, report_filter.filter({'a': 1, 'b': 1}, now=2))
+
+    def test_parse_report_policy(self):
+        self.assertEqual(None, parse_report_policy({'registerName': 'a', 'address': 0, 'type': 'hr'}))
+        self.assertEqual(_policy(deadband=0.5, max_silence=300), 
+            parse_report_policy({'registerName': 'a', 'deadband': 0.5, 'maxSilence': 300}))
+
+if __name__ == '__main__':
+    unittest.main()
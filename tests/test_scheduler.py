@@ -0,0 +1,73 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import threading
+import time
+import unittest
+
+from scheduler import Scheduler
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(LOGGER)
+        self.calls = []
+        self.called = threading.Event()
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _call(self, name):
+        self.calls.append((name, time.time()))
+        self.called.set()
+
+    def test_calls_run_in_deadline_order(self):
+        now = time.time()
+        self.scheduler.call_at(now + 0.06, self._call, 'c')
+        self.scheduler.call_at(now + 0.02, self._call, 'a')
+        self.scheduler.call_at(now + 0.04, self._call, 'b')
+        self.scheduler.call_at(now + 0.1, self.called.set)
+        self.assertTrue(self.called.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(['a', 'b', 'c'], [name for name, _ in self.calls])
+        self.assertTrue(all(called >= now + 0.02 for _, called in self.calls))
+
+    def test_earlier_call_wakes_the_sleeping_worker(self):
+        self.scheduler.call_later(60, self._call, 'late')
+        # give the worker time to go to sleep until the late deadline
+        time.sleep(0.05)
+        scheduled = time.time()
+        self.scheduler.call_later(0, self._call, 'now')
+        self.assertTrue(self.called.wait(1))
+        self.assertEqual('now', self.calls[0][0])
+        self.assertTrue(self.calls[0][1] - scheduled < 0.5)
+
+    def test_cancelled_call_does_not_run(self):
+        call = self.scheduler.call_later(0.05, self._call, 'cancelled')
+        call.cancel()
+        self.scheduler.call_later(0.1, self._call, 'kept')
+        self.assertTrue(self.called.wait(1))
+        self.assertEqual(['kept'], [name for name, _ in self.calls])
+        self.assertEqual(0, self.scheduler.pending())
+
+    def test_failed_call_does_not_stop_the_worker(self):
+        def fail():
+            raise ValueError('failed')
+        self.scheduler.call_later(0, fail)
+        self.scheduler.call_later(0.01, self._call, 'after')
+        self.assertTrue(self.called.wait(1))
+        self.assertEqual(['after'], [name for name, _ in self.calls])
+
+    def test_stop_drops_pending_calls(self):
+        self.scheduler.call_later(60, self._call, 'late')
+        self.scheduler.stop()
+        self.assertEqual(0, self.scheduler.pending())
+        self.assertEqual([], self.scheduler.workers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+from devices.relay_device import RelayDevice
+from shards import SHARD_SETTINGS, assign_shard, configure_worker, expand_shards, partition_config
+from test_device import FakeClient
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+SHARDS = [
+    {'name': 'rs485', 'mode': 1, 'serialPort': '/dev/ttyUSB0'},
+    {'name': 'tcp', 'mode': 2, 'processes': 3}
+]
+
+def _slave(device_id, shard=None):
+    slave = {config.CONFIG_KEY_DEVICE_ID: device_id, config.CONFIG_KEY_SLAVE_ID: 1}
+    if shard != None:
+        slave[config.CONFIG_KEY_SHARD] = shard
+    return slave
+
+class ShardsTest(unittest.TestCase):
+
+    def test_expand_shards(self):
+        shards = expand_shards(SHARDS)
+        self.assertEqual([('rs485', None, 0), ('tcp-0', 'tcp', 1), ('tcp-1', 'tcp', 2), ('tcp-2', 'tcp', 3)],
+            [(shard['name'], shard.get('group'), shard['index']) for shard in shards])
+        # the definitions passed in are left as they are
+        self.assertNotIn('index', SHARDS[0])
+
+    def test_serial_shards_run_in_one_process(self):
+        self.assertRaises(ValueError, expand_shards, [{'name': 'rs485', 'mode': 1, 'processes': 2}])
+        self.assertEqual(1, len(expand_shards([{'name': 'rs485', 'mode': 1, 'processes': 1}])))
+
+    def test_assign_shard(self):
+        shards = expand_shards(SHARDS)
+        self.assertEqual('rs485', assign_shard(_slave('meter', 'rs485'), shards))
+        self.assertIn(assign_shard(_slave('plc', 'tcp'), shards), ['tcp-0', 'tcp-1', 'tcp-2'])
+        # slaves without a shard go to the Modbus TCP shards, always to the same process
+        self.assertEqual(assign_shard(_slave('plc'), shards), assign_shard(_slave('plc'), shards))
+        self.assertEqual(set(['tcp-0', 'tcp-1', 'tcp-2']),
+            set(assign_shard(_slave('plc{}'.format(i)), shards) for i in range(50)))
+        self.assertRaises(KeyError, assign_shard, _slave('meter', 'unknown'), shards)
+
+    def test_slaves_without_shard_default_to_first_shard(self):
+        shards = expand_shards(SHARDS[:1])
+        self.assertEqual('rs485', assign_shard(_slave('meter'), shards))
+
+    def test_partition_config(self):
+        shards = expand_shards(SHARDS)
+        slaves_config = {config.CONFIG_KEY_UPDATE_INTERVAL: 5,
+            config.CONFIG_KEY_SLAVES: [_slave('meter', 'rs485'), _slave('plc')]}
+        partitions = partition_config(slaves_config, shards)
+        self.assertEqual(['meter'], [slave[config.CONFIG_KEY_DEVICE_ID] for slave in partitions['rs485'][config.CONFIG_KEY_SLAVES]])
+        self.assertEqual(1, sum(len(partitions[name][config.CONFIG_KEY_SLAVES]) for name in ['tcp-0', 'tcp-1', 'tcp-2']))
+        self.assertEqual(5, partitions['tcp-0'][config.CONFIG_KEY_UPDATE_INTERVAL])
+        self.assertEqual(2, len(slaves_config[config.CONFIG_KEY_SLAVES]))
+
+class WorkerConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        names = list(SHARD_SETTINGS.values()) + ['DEVICE_LOOP_MODE', 'PROVISIONING_CACHE_PATH', 'TELEMETRY_BUFFER_PATH',
+            'METRICS_PORT']
+        self.saved = dict((name, getattr(config, name)) for name in names)
+        config.TELEMETRY_BUFFER_PATH = self.directory
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(config, name, value)
+        shutil.rmtree(self.directory)
+
+    def test_worker_buffers_telemetry_in_its_own_directory(self):
+        configure_worker(expand_shards(SHARDS)[1])
+        self.assertEqual(os.path.join(self.directory, 'tcp-0'), config.TELEMETRY_BUFFER_PATH)
+        self.assertEqual(None, config.PROVISIONING_CACHE_PATH)
+        self.assertEqual(2, config.MODBUS_MODE)
+
+    def test_relay_has_no_telemetry_buffer(self):
+        relay = RelayDevice(None, None, 'model', 'meter', 'master', 1, None, LOGGER, client=FakeClient())
+        self.assertEqual(None, relay.telemetry_buffer)
+        self.assertEqual([], os.listdir(self.directory))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import logging
+import unittest
+
+import config
+from devices.slave_device import SlaveDevice
+from register_profiles import DEFAULT_PROFILE, load_profiles
+from slave_health import HEALTH_HEALTHY
+from test_device import FakeClient
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+def _profile(*registers):
+    slaves_config = {config.CONFIG_KEY_UPDATE_INTERVAL: 1, config.CONFIG_KEY_SLAVES: [],
+        config.CONFIG_KEY_ACTIVE_REGISTERS: [dict(registerName=name, address=address, type='hr', pollInterval=interval) 
+            for name, address, interval in registers]}
+    slaves_config[config.CONFIG_KEY_SLAVES].append({config.CONFIG_KEY_DEVICE_ID: 'slave', config.CONFIG_KEY_SLAVE_ID: 1})
+    return load_profiles(slaves_config)[DEFAULT_PROFILE]
+
+class ReconfiguringModbusClient(object):
+    """ Returns 1 for every register, and applies the given profile to the slave on the first read like a 
+        config update arriving mid-pass
+    """
+
+    def __init__(self):
+        self.slave = None
+        self.profile = None
+        self.reads = []
+
+    def read_registers(self, register_type, slave_id, address, count, priority=None):
+        self.reads.append((register_type, address, count))
+        if self.profile != None:
+            profile, self.profile = self.profile, None
+            self.slave.configure(profile)
+        return [1] * count
+
+    def health_state(self, slave_id):
+        return HEALTH_HEALTHY
+
+class SlaveDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer_path = config.TELEMETRY_BUFFER_PATH
+        config.TELEMETRY_BUFFER_PATH = None
+        self.client = FakeClient()
+        self.modbus_client = ReconfiguringModbusClient()
+        self.slave = SlaveDevice(None, None, 'slave', 'master', 1, _profile(('a', 0, 1), ('b', 10, 2)),
+            self.modbus_client, LOGGER, client=self.client)
+        self.modbus_client.slave = self.slave
+
+    def tearDown(self):
+        config.TELEMETRY_BUFFER_PATH = self.buffer_path
+
+    def _poll(self):
+        for group in self.slave.register_map.poll_groups:
+            group.deadline = 0
+        self.slave._do_loop_actions()
+        return [json.loads(payload) for payload, _ in self.client.sent]
+
+    def test_configure_keeps_unchanged_profile(self):
+        register_map = self.slave.register_map
+        self.slave.configure(register_map.profile)
+        self.assertIs(register_map, self.slave.register_map)
+
+    def test_configure_mid_pass_finishes_the_pass_with_its_profile(self):
+        profile = _profile(('c', 20, 1))
+        self.modbus_client.profile = profile
+        sent = self._poll()
+        self.assertEqual([{'a': 1}, {'b': 1}], [values for values in sent if config.KEY_HEALTH not in values])
+        self.assertIs(profile, self.slave.register_map.profile)
+        self.client.sent = []
+        self.assertEqual([{'c': 1}], [values for values in self._poll() if config.KEY_HEALTH not in values])
+
+    def test_read_values_of_stale_registers(self):
+        profile = self.slave.register_map.profile
+        decoders = len(profile._decoders)
+        values = self.slave.read_values(['b'], max_age=60)
+        self.assertEqual(1, values['b'].value)
+        self.assertEqual([('hr', 10, 1)], self.modbus_client.reads)
+        # served from the cache while fresh
+        self.slave.read_values(['b'], max_age=60)
+        self.assertEqual(1, len(self.modbus_client.reads))
+        # the decoders of on-demand blocks are not kept
+        self.slave.read_values(['a', 'b'], max_age=0)
+        self.assertEqual(decoders, len(profile._decoders))
+
+if __name__ == '__main__':
+    unittest.main()
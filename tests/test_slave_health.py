@@ -0,0 +1,70 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import unittest
+
+from slave_health import HEALTH_HEALTHY, HEALTH_PROBING, HEALTH_QUARANTINED, HealthTracker, SlaveQuarantinedException
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class HealthTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = HealthTracker(LOGGER, failure_threshold=3, backoff_min=5, backoff_max=12)
+
+    def _quarantine(self, slave_id=1, now=100):
+        for _ in range(3):
+            self.assertFalse(self.tracker.acquire(slave_id, now))
+            self.tracker.record_failure(slave_id, now)
+
+    def test_quarantined_after_consecutive_failures(self):
+        for _ in range(2):
+            self.tracker.record_failure(1, 100)
+        self.assertEqual(HEALTH_HEALTHY, self.tracker.state(1))
+        self.tracker.record_failure(1, 100)
+        self.assertEqual(HEALTH_QUARANTINED, self.tracker.state(1))
+        self.assertRaises(SlaveQuarantinedException, self.tracker.acquire, 1, 104.9)
+
+    def test_success_resets_the_failure_count(self):
+        for _ in range(2):
+            self.tracker.record_failure(1, 100)
+        self.tracker.record_success(1)
+        for _ in range(2):
+            self.tracker.record_failure(1, 100)
+        self.assertEqual(HEALTH_HEALTHY, self.tracker.state(1))
+        self.assertEqual({1: HEALTH_HEALTHY}, self.tracker.states())
+
+    def test_single_probe_after_the_backoff(self):
+        self._quarantine()
+        self.assertTrue(self.tracker.acquire(1, 105))
+        self.assertEqual(HEALTH_PROBING, self.tracker.state(1))
+        # other requests wait for the outcome of the probe
+        self.assertRaises(SlaveQuarantinedException, self.tracker.acquire, 1, 105)
+
+    def test_answered_probe_closes_the_breaker(self):
+        self._quarantine()
+        self.tracker.acquire(1, 105)
+        self.tracker.record_success(1)
+        self.assertEqual(HEALTH_HEALTHY, self.tracker.state(1))
+        self.assertEqual({}, self.tracker.states())
+        self.assertFalse(self.tracker.acquire(1, 105))
+
+    def test_failed_probe_doubles_the_backoff_up_to_max(self):
+        self._quarantine()
+        now = 105
+        for backoff in (10, 12, 12):
+            self.assertTrue(self.tracker.acquire(1, now))
+            self.tracker.record_failure(1, now)
+            self.assertEqual(HEALTH_QUARANTINED, self.tracker.state(1))
+            self.assertRaises(SlaveQuarantinedException, self.tracker.acquire, 1, now + backoff - 0.1)
+            now += backoff
+
+    def test_slaves_are_tracked_separately(self):
+        self._quarantine(1)
+        self.assertFalse(self.tracker.acquire(2, 100))
+        self.assertEqual(HEALTH_HEALTHY, self.tracker.state(2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import socket
+import threading
+import time
+import unittest
+
+from pymodbus.exceptions import ConnectionException
+
+import config
+from tcp_pool import TCPConnectionPool
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+HOST = '127.0.0.1'
+
+class TCPConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # a listening socket is all the pool needs to connect, connections are never read from
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((HOST, 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.pool = TCPConnectionPool(LOGGER, max_connections=1, idle_timeout=60, port=self.port, timeout=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.listener.close()
+
+    def test_released_connections_are_reused(self):
+        client = self.pool.acquire(HOST)
+        self.pool.release(HOST, client)
+        self.assertIs(client, self.pool.acquire(HOST))
+
+    def test_unhealthy_connections_are_discarded(self):
+        client = self.pool.acquire(HOST)
+        self.pool.release(HOST, client, healthy=False)
+        self.assertIsNot(client, self.pool.acquire(HOST))
+
+    def test_acquire_waits_for_a_connection_beyond_max_connections(self):
+        client = self.pool.acquire(HOST)
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.pool.acquire(HOST)))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual([], acquired)
+        self.pool.release(HOST, client)
+        thread.join(2)
+        self.assertEqual([client], acquired)
+
+    def test_idle_connections_are_evicted(self):
+        pool = TCPConnectionPool(LOGGER, max_connections=2, idle_timeout=0.05, port=self.port, timeout=1)
+        first = pool.acquire(HOST)
+        second = pool.acquire(HOST)
+        pool.release(HOST, first)
+        time.sleep(0.1)
+        pool.release(HOST, second)
+        self.assertEqual([second], [client for client, _ in pool._hosts[HOST].idle])
+        pool.close()
+
+    def test_reconnects_to_an_unreachable_host_back_off(self):
+        backoff = config.TCP_RECONNECT_BACKOFF_MIN, config.TCP_RECONNECT_BACKOFF_MAX
+        config.TCP_RECONNECT_BACKOFF_MIN, config.TCP_RECONNECT_BACKOFF_MAX = 10, 60
+        try:
+            self.listener.close()
+            with self.assertRaises(ConnectionException):
+                self.pool.acquire(HOST)
+            host = self.pool._hosts[HOST]
+            self.assertEqual(1, host.failures)
+            self.assertTrue(host.retry_at > time.time() + 5)
+            with self.assertRaises(ConnectionException) as raised:
+                self.pool.acquire(HOST)
+            self.assertIn('Backing off', str(raised.exception))
+            self.assertEqual(1, host.failures)
+            self.assertEqual(0, host.in_use)
+        finally:
+            config.TCP_RECONNECT_BACKOFF_MIN, config.TCP_RECONNECT_BACKOFF_MAX = backoff
+
+if __name__ == '__main__':
+    unittest.main()
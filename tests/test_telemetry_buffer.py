@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from telemetry_buffer import TelemetryBuffer
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class TelemetryBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _buffer(self, segment_bytes=1024, max_bytes=1024 * 1024, max_age=3600):
+        return TelemetryBuffer(self.directory, LOGGER, segment_bytes, max_bytes, max_age)
+
+    def test_replay_in_order_with_poll_times(self):
+        buffer = self._buffer()
+        now = time.time()
+        for i in range(5):
+            buffer.append('{{"a":{}}}'.format(i), now - 10 + i)
+        self.assertFalse(buffer.is_empty())
+        payloads, cursor = buffer.read(3)
+        self.assertEqual(['{"a":0}', '{"a":1}', '{"a":2}'], [payload for _, payload in payloads])
+        self.assertAlmostEqual(now - 10, payloads[0][0], places=2)
+        # nothing is committed until the payloads were sent
+        self.assertEqual(payloads, buffer.read(3)[0])
+        buffer.commit(cursor)
+        payloads, cursor = buffer.read(10)
+        self.assertEqual(['{"a":3}', '{"a":4}'], [payload for _, payload in payloads])
+        buffer.commit(cursor)
+        self.assertTrue(buffer.is_empty())
+        self.assertEqual(0, buffer.pending_bytes())
+
+    def test_restart_resumes_at_the_cursor(self):
+        buffer = self._buffer(segment_bytes=40)
+        for i in range(6):
+            buffer.append('{{"a":{}}}'.format(i))
+        payloads, cursor = buffer.read(4)
+        buffer.commit(cursor)
+        self.assertEqual(['{"a":4}', '{"a":5}'], [payload for _, payload in self._buffer(segment_bytes=40).read(10)[0]])
+
+    def test_drained_segments_are_deleted(self):
+        buffer = self._buffer(segment_bytes=40)
+        for i in range(6):
+            buffer.append('{{"a":{}}}'.format(i))
+        segments = len([name for name in os.listdir(self.directory) if name.endswith('.seg')])
+        self.assertTrue(segments > 1)
+        buffer.commit(buffer.read(10)[1])
+        self.assertEqual(1, len([name for name in os.listdir(self.directory) if name.endswith('.seg')]))
+
+    def test_oldest_segments_are_evicted_beyond_max_bytes(self):
+        buffer = self._buffer(segment_bytes=40, max_bytes=100)
+        for i in range(20):
+            buffer.append('{{"a":{}}}'.format(i))
+        payloads = [payload for _, payload in buffer.read(100)[0]]
+        self.assertEqual('{"a":19}', payloads[-1])
+        self.assertTrue(len(payloads) < 20)
+        self.assertTrue(buffer.pending_bytes() <= 100)
+
+    def test_records_older_than_max_age_are_skipped(self):
+        buffer = self._buffer(max_age=60)
+        buffer.append('{"a":0}', time.time() - 120)
+        buffer.append('{"a":1}', time.time() - 30)
+        payloads, cursor = buffer.read(10)
+        self.assertEqual(['{"a":1}'], [payload for _, payload in payloads])
+        buffer.commit(cursor)
+        self.assertTrue(buffer.is_empty())
+
+    def _write_partial_record(self, segment):
+        with open(os.path.join(self.directory, '{0:010d}.seg'.format(segment)), 'a') as segment_file:
+            segment_file.write('123.000\t{"a":')
+
+    def test_partly_written_record_is_cut_off_on_restart(self):
+        buffer = self._buffer()
+        buffer.append('{"a":0}')
+        self._write_partial_record(0)
+        buffer = self._buffer()
+        buffer.append('{"a":1}')
+        self.assertEqual(['{"a":0}', '{"a":1}'], [payload for _, payload in buffer.read(10)[0]])
+
+    def test_partly_written_record_is_skipped(self):
+        buffer = self._buffer(segment_bytes=10)
+        buffer.append('{"a":0}')
+        buffer.append('{"a":1}')
+        # only the newest segment is repaired on restart, an older one is read up to the partial record
+        self._write_partial_record(0)
+        buffer = self._buffer(segment_bytes=10)
+        payloads, cursor = buffer.read(10)
+        self.assertEqual(['{"a":0}', '{"a":1}'], [payload for _, payload in payloads])
+        buffer.commit(cursor)
+        self.assertTrue(buffer.is_empty())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import base64
+import json
+import unittest
+import zlib
+
+from telemetry_encoder import TelemetryBatcher, encode_members, format_timestamp, parse_timestamp
+
+class EncodeMembersTest(unittest.TestCase):
+
+    def test_members(self):
+        values = {'a': 1, 'b': 2.5, 'c': True, 'd': u'text', 'e': None}
+        self.assertEqual(values, json.loads('{' + encode_members(values) + '}'))
+        self.assertEqual('', encode_members({}))
+
+    def test_values_json_cannot_represent_are_null(self):
+        members = encode_members({'a': 1, 'b': float('nan'), 'c': float('inf')})
+        self.assertEqual({'a': 1, 'b': None, 'c': None}, json.loads('{' + members + '}'))
+
+class TelemetryBatcherTest(unittest.TestCase):
+
+    def test_single_snapshots_are_sent_right_away(self):
+        batcher = TelemetryBatcher(0, compress=False)
+        self.assertEqual(['{"a":1}'], batcher.add('"a":1'))
+        self.assertEqual([], batcher.add(''))
+
+    def test_batches(self):
+        batcher = TelemetryBatcher(10, max_bytes=100, compress=False)
+        self.assertEqual([], batcher.add('"a":1', now=100))
+        self.assertEqual([], batcher.add('"a":2', now=101))
+        self.assertEqual([], batcher.flush(now=105))
+        self.assertEqual(5, batcher.next_flush_delay(now=105))
+        messages = batcher.flush(now=110)
+        self.assertEqual([[{'timestamp': format_timestamp(100), 'a': 1}, {'timestamp': format_timestamp(101), 'a': 2}]],
+            [json.loads(message) for message in messages])
+        self.assertEqual(None, batcher.next_flush_delay())
+
+    def test_batches_are_split_at_max_bytes(self):
+        batcher = TelemetryBatcher(10, max_bytes=100, compress=False)
+        messages = []
+        for i in range(5):
+            messages.extend(batcher.add('"a":{}'.format(i), now=100 + i))
+        messages.extend(batcher.flush(force=True))
+        self.assertTrue(len(messages) > 1)
+        self.assertTrue(all(len(message) <= 100 for message in messages))
+        self.assertEqual(list(range(5)), [snapshot['a'] for message in messages for snapshot in json.loads(message)])
+
+    def test_compression(self):
+        message = TelemetryBatcher(0, compress=True).add('"a":1')[0]
+        envelope = json.loads(message)
+        self.assertEqual('gzip', envelope['contentEncoding'])
+        self.assertEqual('{"a":1}', zlib.decompress(base64.b64decode(envelope['data']), 31))
+
+    def test_timestamps(self):
+        self.assertEqual('2020-01-01T00:00:01.250Z', format_timestamp(1577836801.25))
+        self.assertEqual(1577836801.25, parse_timestamp('2020-01-01T00:00:01.250Z'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import logging
+import unittest
+import urllib2
+
+from metrics_server import start_metrics_server
+from value_cache import (NEVER_READ, QUALITY_BAD, QUALITY_GOOD, CachedValue, ValueCache, encode_cached_values, 
+    parse_read_command)
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+class ValueCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ValueCache()
+
+    def test_failed_reads_keep_the_last_known_value(self):
+        self.cache.update({'a': 1, 'b': 2}, now=100)
+        self.cache.mark_bad(['a', 'c'])
+        self.assertEqual({'a': CachedValue(1, 100, QUALITY_BAD), 'b': CachedValue(2, 100, QUALITY_GOOD), 'c': NEVER_READ}, 
+            self.cache.get(['a', 'b', 'c']))
+        self.cache.update({'a': 3}, now=101)
+        self.assertEqual(CachedValue(3, 101, QUALITY_GOOD), self.cache.get(['a'])['a'])
+
+    def test_stale(self):
+        self.cache.update({'a': 1}, now=100)
+        self.cache.update({'b': 2}, now=110)
+        self.assertEqual(['a', 'c'], self.cache.stale(['a', 'b', 'c'], 5, now=112))
+        self.assertEqual(['c'], self.cache.stale(['a', 'b', 'c'], 12, now=112))
+
+    def test_retain(self):
+        self.cache.update({'a': 1, 'b': 2})
+        self.cache.retain({'b': 0})
+        self.assertEqual(NEVER_READ, self.cache.get(['a'])['a'])
+        self.assertEqual(2, self.cache.get(['b'])['b'].value)
+
+    def test_encode_cached_values(self):
+        encoded = encode_cached_values({'a': CachedValue(1.5, 100, QUALITY_GOOD), 'b': NEVER_READ}, now=102.5)
+        self.assertEqual({'a': {'value': 1.5, 'timestamp': '1970-01-01T00:01:40.000Z', 'age': 2.5, 'quality': 'good'}, 
+            'b': {'value': None, 'timestamp': None, 'age': None, 'quality': 'bad'}}, json.loads(encoded))
+
+    def test_parse_read_command(self):
+        self.assertEqual((None, None, None), parse_read_command(''))
+        self.assertEqual(('meter', ['a'], 5.0), parse_read_command('{"deviceId": "meter", "registers": "a", "maxAge": "5"}'))
+        self.assertEqual((None, ['a', 'b'], None), parse_read_command('{"registers": ["a", "b"]}'))
+        self.assertRaises(ValueError, parse_read_command, '[1]')
+        self.assertRaises(ValueError, parse_read_command, '{"maxAge": "soon"}')
+
+class ValueDevice(object):
+    """ Master whose only slave, meter, has registers a and b
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def read_values(self, register_names=None, max_age=None, device_id=None):
+        self.requests.append((register_names, max_age, device_id))
+        if device_id != 'meter':
+            raise KeyError('Unknown slave {}'.format(device_id))
+        register_names = ['a', 'b'] if register_names == None else register_names
+        if 'c' in register_names:
+            raise KeyError('Unknown register c of meter')
+        return dict((name, CachedValue(1, None, QUALITY_GOOD)) for name in register_names)
+
+class ValuesEndpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = ValueDevice()
+        self.server = start_metrics_server(LOGGER, '127.0.0.1', 0, self.device)
+        self.url = 'http://127.0.0.1:{}/values/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _status(self, path):
+        try:
+            return urllib2.urlopen(self.url + path, timeout=5).getcode()
+        except urllib2.HTTPError as e:
+            return e.code
+
+    def test_values(self):
+        values = json.loads(urllib2.urlopen(self.url + 'meter?registers=a&maxAge=2.5', timeout=5).read())
+        self.assertEqual(['a'], list(values))
+        self.assertEqual((['a'], 2.5, 'meter'), self.device.requests[-1])
+        self.assertEqual(['a', 'b'], sorted(json.loads(urllib2.urlopen(self.url + 'meter', timeout=5).read())))
+
+    def test_errors(self):
+        self.assertEqual(404, self._status('unknown'))
+        self.assertEqual(404, self._status('meter?registers=c'))
+        self.assertEqual(400, self._status('meter?maxAge=soon'))
+
+if __name__ == '__main__':
+    unittest.main()
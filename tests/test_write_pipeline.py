@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import logging
+import unittest
+
+import config
+from write_pipeline import PendingWrite, WritePipeline, merge_writes
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+HOLDING = config.ACTIVE_REGISTERS_TYPE_HOLDING_REGISTER
+COIL = config.ACTIVE_REGISTERS_TYPE_COIL
+
+def _write(type, address, *values):
+    return PendingWrite(type, address, list(values), None)
+
+class RecordingModbusClient(object):
+    """ Keeps the registers written to it, answers reads from them and fails writes at the given addresses
+    """
+
+    def __init__(self, failing=(), read_offset=0):
+        self.failing = failing
+        self.read_offset = read_offset
+        self.requests = []
+        self.registers = {}
+
+    def write_register(self, type, slave_id, address, value):
+        self.write_registers(type, slave_id, address, [value])
+
+    def write_registers(self, type, slave_id, address, values):
+        self.requests.append((type, address, list(values)))
+        if address in self.failing:
+            raise IOError('no answer')
+        for offset, value in enumerate(values):
+            self.registers[(type, address + offset)] = value
+
+    def read_registers(self, type, slave_id, address, count, priority=None):
+        return [self.registers[(type, address + offset)] + self.read_offset for offset in range(count)]
+
+class MergeWritesTest(unittest.TestCase):
+
+    def test_adjacent_writes_of_a_type_are_merged(self):
+        blocks = merge_writes([_write(HOLDING, 3, 30), _write(HOLDING, 1, 10, 11), _write(HOLDING, 4, 40), 
+            _write(COIL, 2, 1), _write(HOLDING, 7, 70)])
+        self.assertEqual([(COIL, 2, [1]), (HOLDING, 1, [10, 11, 30, 40]), (HOLDING, 7, [70])], 
+            [(block.type, block.address, block.values) for block in blocks])
+        self.assertEqual(3, len(blocks[1].writes))
+
+    def test_blocks_stay_within_the_protocol_limit(self):
+        writes = [_write(HOLDING, address, address) for address in range(config.MODBUS_MAX_WRITE_REGISTERS + 1)]
+        self.assertEqual([config.MODBUS_MAX_WRITE_REGISTERS, 1], [len(block.values) for block in merge_writes(writes)])
+
+    def test_without_merging_every_write_is_a_block(self):
+        self.assertEqual(2, len(merge_writes([_write(HOLDING, 1, 10), _write(HOLDING, 2, 20)], merge_adjacent=False)))
+
+class WritePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outcomes = []
+
+    def _pipeline(self, client, verify=False):
+        return WritePipeline(client, 1, LOGGER, debounce=60, verify=verify, merge_adjacent=True)
+
+    def _done(self, name):
+        return lambda error: self.outcomes.append((name, error))
+
+    def test_debounced_writes_are_sent_together(self):
+        client = RecordingModbusClient()
+        pipeline = self._pipeline(client)
+        self.assertEqual(None, pipeline.next_flush_delay())
+        pipeline.submit(HOLDING, 10, [1], self._done('a'))
+        pipeline.submit(HOLDING, 11, [2], self._done('b'))
+        pipeline.flush()
+        self.assertEqual([], client.requests)
+        self.assertTrue(pipeline.next_flush_delay() > 0)
+        pipeline.flush(force=True)
+        self.assertEqual([(HOLDING, 10, [1, 2])], client.requests)
+        self.assertEqual([('a', None), ('b', None)], self.outcomes)
+        self.assertEqual(None, pipeline.next_flush_delay())
+
+    def test_later_write_replaces_the_pending_one(self):
+        client = RecordingModbusClient()
+        pipeline = self._pipeline(client)
+        pipeline.submit(HOLDING, 10, [1], self._done('first'))
+        pipeline.submit(HOLDING, 10, [2], self._done('second'))
+        pipeline.flush(force=True)
+        self.assertEqual([(HOLDING, 10, [2])], client.requests)
+        self.assertEqual([('second', None)], self.outcomes)
+
+    def test_failed_block_reports_its_writes_only(self):
+        client = RecordingModbusClient(failing=(20,))
+        pipeline = self._pipeline(client)
+        pipeline.submit(HOLDING, 10, [1], self._done('ok'))
+        pipeline.submit(HOLDING, 20, [1], self._done('failed'))
+        pipeline.flush(force=True)
+        outcomes = dict(self.outcomes)
+        self.assertEqual(None, outcomes['ok'])
+        self.assertIn('no answer', outcomes['failed'])
+
+    def test_read_back_mismatch_fails_the_write(self):
+        pipeline = self._pipeline(RecordingModbusClient(read_offset=1), verify=True)
+        pipeline.submit(HOLDING, 10, [5], self._done('a'))
+        pipeline.flush(force=True)
+        self.assertIn('Read back [6]', self.outcomes[0][1])
+
+    def test_verified_write(self):
+        pipeline = self._pipeline(RecordingModbusClient(), verify=True)
+        pipeline.submit(HOLDING, 10, [5, 6], self._done('a'))
+        pipeline.flush(force=True)
+        self.assertEqual([('a', None)], self.outcomes)
+
+if __name__ == '__main__':
+    unittest.main()
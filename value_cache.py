@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+import config
+from telemetry_encoder import encode_value, format_timestamp
+
+# Quality of a cached value: good if the last read of the register succeeded, bad if it failed,
+# in which case value and timestamp are the ones of the last successful read, if any
+QUALITY_GOOD = 'good'
+QUALITY_BAD = 'bad'
+
+# Last known value of a register, timestamp being the time it was read or None if it never was
+CachedValue = namedtuple('CachedValue', 'value timestamp quality')
+NEVER_READ = CachedValue(None, None, QUALITY_BAD)
+
+def parse_read_command(payload):
+    """ Reads the device id, register names and max age of a readNow command, all optional and None
+        when not set. Raises ValueError for invalid payloads
+    """
+    request = json.loads(payload) if payload else {}
+    if not isinstance(request, dict):
+        raise ValueError('Invalid {0} payload {1}'.format(config.COMMAND_READ_NOW, payload))
+    register_names = request.get(config.COMMAND_KEY_REGISTERS)
+    if isinstance(register_names, (str, type(u''))):
+        register_names = [register_names]
+    max_age = request.get(config.COMMAND_KEY_MAX_AGE)
+    if max_age != None:
+        max_age = float(max_age)
+    return request.get(config.CONFIG_KEY_DEVICE_ID), register_names, max_age
+
+def encode_cached_values(values, now=None):
+    """ Returns the JSON object of a dict of register name to CachedValue, every register holding its
+        value, the ISO 8601 timestamp and age in seconds of the value, and its quality
+    """
+    now = time.time() if now == None else now
+    members = []
+    for name in sorted(values.keys()):
+        cached = values[name]
+        if cached.timestamp == None:
+            timestamp, age = 'null', 'null'
+        else:
+            timestamp, age = '"{0}"'.format(format_timestamp(cached.timestamp)), '{0:.3f}'.format(now - cached.timestamp)
+        members.append('{0}:{{"value":{1},"timestamp":{2},"age":{3},"quality":"{4}"}}'.format(
+            json.dumps(name), encode_value(cached.value), timestamp, age, cached.quality))
+    return '{' + ','.join(members) + '}'
+
+class ValueCache(object):
+    """ Last known value of every register of a slave, filled by the poll path and read by on-demand requests
+    """
+
+    def __init__(self):
+        # register name -> CachedValue
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def update(self, values, now=None):
+        """ Records the values of a successful read, a dict of register name to value
+        """
+        now = time.time() if now == None else now
+        with self._lock:
+            for name, value in values.items():
+                self._values[name] = CachedValue(value, now, QUALITY_GOOD)
+
+    def mark_bad(self, register_names):
+        """ Flags the values of registers whose read failed, keeping their last known value
+        """
+        with self._lock:
+            for name in register_names:
+                cached = self._values.get(name, NEVER_READ)
+                if cached.quality != QUALITY_BAD:
+                    self._values[name] = CachedValue(cached.value, cached.timestamp, QUALITY_BAD)
+
+    def get(self, register_names):
+        """ Returns a dict of register name to CachedValue, NEVER_READ for registers without a value
+        """
+        with self._lock:
+            return dict((name, self._values.get(name, NEVER_READ)) for name in register_names)
+
+    def stale(self, register_names, max_age, now=None):
+        """ Returns the registers without a value read within the last max_age seconds
+        """
+        now = time.time() if now == None else now
+        with self._lock:
+            return [name for name in register_names
+                if self._values.get(name, NEVER_READ).timestamp == None or now - self._values[name].timestamp > max_age]
+
+    def retain(self, register_names):
+        """ Forgets the values of registers not in register_names, e.g. after the register map changed
+        """
+        with self._lock:
+            for name in list(self._values.keys()):
+                if name not in register_names:
+                    del self._values[name]
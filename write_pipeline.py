@@ -0,0 +1,116 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+import threading
+import time
+from collections import namedtuple
+
+from pymodbus.exceptions import ModbusException
+
+import config
+from bus_arbiter import PRIORITY_WRITE
+
+# A register write waiting for the next flush. values holds the 16-bit words of a holding register
+# or the single value of a coil, done is called once written with None, or with the error text
+PendingWrite = namedtuple('PendingWrite', 'type address values done')
+
+# Adjacent pending writes of the same type, sent as one request
+WriteBlock = namedtuple('WriteBlock', 'type address values writes')
+
+class ReadBackMismatchException(ModbusException):
+    def __init__(self, address, written, read):
+        super(ReadBackMismatchException, self).__init__(
+            'Read back {0} at address {1} after writing {2}'.format(read, address, written))
+
+def max_write_count(type):
+    """ Protocol limit of a single FC15 (coils) or FC16 (holding registers) write
+    """
+    return config.MODBUS_MAX_WRITE_BITS if type in config.ACTIVE_REGISTERS_BIT_TYPES else config.MODBUS_MAX_WRITE_REGISTERS
+
+def merge_writes(writes, merge_adjacent=True):
+    """ Groups pending writes into blocks of consecutive addresses of the same type, within the protocol
+        limits. Without merge_adjacent every write is a block of its own
+    """
+    blocks = []
+    for write in sorted(writes, key=lambda write: (write.type, write.address)):
+        if merge_adjacent and blocks:
+            last = blocks[-1]
+            if last.type == write.type and last.address + len(last.values) == write.address and \
+               len(last.values) + len(write.values) <= max_write_count(write.type):
+                blocks[-1] = WriteBlock(last.type, last.address, last.values + write.values, last.writes + [write])
+                continue
+        blocks.append(WriteBlock(write.type, write.address, list(write.values), [write]))
+    return blocks
+
+class WritePipeline(object):
+    """ Debounced writes of a slave. Writes queued during the debounce time are sent together: a later
+        write to a register replaces the earlier one, and writes to adjacent registers of the same type
+        are merged into a single FC15/FC16 request, optionally verified with a read-back of the block
+    """
+
+    logger = None
+    modbus_client = None
+
+    def __init__(self, modbus_client, slave_id, logger, debounce=None, verify=None, merge_adjacent=None):
+        self.modbus_client = modbus_client
+        self.slave_id = slave_id
+        self.logger = logger
+        self.debounce = config.WRITE_DEBOUNCE if debounce == None else debounce
+        self.verify = config.WRITE_VERIFY if verify == None else verify
+        self.merge_adjacent = config.WRITE_MERGE_ADJACENT if merge_adjacent == None else merge_adjacent
+
+        # (type, address) -> PendingWrite
+        self._pending = {}
+        self._first = None
+        self._lock = threading.Lock()
+
+    def submit(self, type, address, values, done):
+        """ Queues a write of values starting at address. A pending write to the same address is dropped
+            without calling its done callback, only the last value of a register is written and acknowledged
+        """
+        with self._lock:
+            if self._first == None:
+                self._first = time.time()
+            self._pending[(type, address)] = PendingWrite(type, address, list(values), done)
+
+    def next_flush_delay(self, now=None):
+        """ Seconds until the pending writes are due, None if there are none
+        """
+        if self._first == None:
+            return None
+        now = time.time() if now == None else now
+        return max(0, self._first + self.debounce - now)
+
+    def flush(self, force=False):
+        """ Sends the pending writes once the debounce time has elapsed and reports their outcome
+        """
+        if not force and self.next_flush_delay() != 0:
+            return
+        with self._lock:
+            writes = self._pending.values()
+            self._pending = {}
+            self._first = None
+        for block in merge_writes(writes, self.merge_adjacent):
+            error = self._write_block(block)
+            for write in block.writes:
+                write.done(error)
+
+    def _write_block(self, block):
+        """ Writes a block, returns None on success or the error text
+        """
+        try:
+            if len(block.values) == 1:
+                self.modbus_client.write_register(block.type, self.slave_id, block.address, block.values[0])
+            else:
+                self.modbus_client.write_registers(block.type, self.slave_id, block.address, block.values)
+            if self.verify:
+                read = self.modbus_client.read_registers(block.type, self.slave_id, block.address,
+                    len(block.values), PRIORITY_WRITE)
+                if [int(value) for value in read] != [int(value) for value in block.values]:
+                    raise ReadBackMismatchException(block.address, block.values, read)
+            return None
+        except Exception as e:
+            status_text = 'Writing {0} values at address {1} of slave {2} failed: {3}'.format(
+                len(block.values), block.address, self.slave_id, e)
+            self.logger.error(status_text)
+            return status_text